@@ -0,0 +1,287 @@
+'''
+Photo catalog reads
+
+A photo's items share its pk, '<bucket>#<key>', with one item per sk, eg. 'camera#v0'. The
+catalog reads them back as common.models item dataclasses: every item of a photo with one
+Query, many photos with batched BatchGetItem, and optionally only some attributes. The large
+exif#v0 item is only read when asked for and comes back as a LazyExifDataItem, decoded from its
+storage codec if it has one.
+
+Reads go through a TTL bounded LRU cache, so returned models are shared and must be treated as
+read only.
+'''
+
+import logging
+import random
+import time
+
+from dataclasses import fields, is_dataclass
+from datetime import timedelta
+from functools import lru_cache
+from typing import TYPE_CHECKING, Any, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+import boto3
+
+if TYPE_CHECKING:
+    # Type stubs are only installed for development.
+    from mypy_boto3_dynamodb import DynamoDBClient
+
+from .exif_codec import EXIF_BLOBS_ATTR, EXIF_CODEC_ATTR, EXIF_ITEM_SK, decode_exif_item
+from .facets import FACETS
+from .models import JpegDataItem
+from .util.cache import TtlLruCache
+from .util.ddb import unmarshal_item
+
+_logger = logging.getLogger(__name__)
+
+ItemKey = Tuple[str, str]
+
+# Model of each item type. Items of other types are returned as dicts.
+ITEM_CLASSES: Dict[str, type] = {
+    **{_f.sk: _f.item_class for _f in FACETS.values()},
+    'jpeg#v0': JpegDataItem,
+}
+# Items read when none are named. The exif#v0 item has to be asked for.
+DEFAULT_SKS: Tuple[str, ...] = tuple(ITEM_CLASSES)
+
+# BatchGetItem takes at most 100 keys.
+DDB_BATCH_GET_SIZE = 100
+DDB_BATCH_MAX_ATTEMPTS = 5
+DDB_BATCH_BACKOFF_BASE_SECONDS = 0.05
+DDB_BATCH_BACKOFF_MAX_SECONDS = 2
+
+CATALOG_CACHE_MAXSIZE = 1024
+CATALOG_CACHE_TTL = timedelta(minutes=5)
+
+# Cached for items that don't exist, so they aren't read again either.
+_NOT_FOUND = object()
+
+
+@lru_cache(maxsize=None)
+def _get_field_types(cls: type) -> Tuple[Tuple[str, Any], ...]:
+    '''Return the names and types of a dataclass's fields'''
+    return tuple((_f.name, _f.type) for _f in fields(cls))
+
+
+def _convert(field_type: Any, value: Any) -> Any:
+    '''Return a value as its field type, building nested dataclasses'''
+    if value is None:
+        return None
+
+    # Optional[X] is Union[X, None].
+    type_args = getattr(field_type, '__args__', ())
+    if getattr(field_type, '__origin__', None) is Union and len(type_args) == 2 \
+            and type_args[1] is type(None):
+        field_type, type_args = type_args[0], getattr(type_args[0], '__args__', ())
+
+    if is_dataclass(field_type) and isinstance(value, dict):
+        return _from_dict(field_type, value)
+    if getattr(field_type, '__origin__', None) is list and isinstance(value, list) and type_args:
+        return [_convert(type_args[0], _v) for _v in value]
+    return value
+
+
+def _from_dict(cls: type, values: Dict[str, Any]) -> Any:
+    '''
+    Return a dataclass built from an item.
+
+    Attributes that aren't fields, eg. content_digest, are left out. Fields missing from the
+    item, eg. not projected, are None.
+    '''
+    return cls(**{_n: _convert(_t, values.get(_n)) for _n, _t in _get_field_types(cls)})
+
+
+def _to_model(item: Dict[str, Any]) -> Any:
+    '''Return the model of an unmarshalled item'''
+    sk = item.get('sk')
+    if sk == EXIF_ITEM_SK:
+        if EXIF_BLOBS_ATTR not in item:
+            # Plain, or the compressed IFDs weren't projected.
+            item = {_k: _v for _k, _v in item.items() if _k != EXIF_CODEC_ATTR}
+        return decode_exif_item(item)
+
+    cls = ITEM_CLASSES.get(sk or '')
+    return item if cls is None else _from_dict(cls, item)
+
+
+def _get_projection(attributes: Optional[Iterable[str]]) -> Dict[str, Any]:
+    '''
+    Return ProjectionExpression request parameters for attribute paths, eg. exif.ifd0.make.
+
+    Every name goes through ExpressionAttributeNames so reserved words are fine. The key is
+    always projected so items can be told apart.
+    '''
+    if attributes is None:
+        return {}
+
+    names: Dict[str, str] = {}
+    paths = []
+    for _a in ['pk', 'sk'] + [_a for _a in attributes if _a not in ('pk', 'sk')]:
+        parts = []
+        for _p in _a.split('.'):
+            placeholder = '#a{}'.format(len(names))
+            names[placeholder] = _p
+            parts.append(placeholder)
+        paths.append('.'.join(parts))
+
+    return {'ProjectionExpression': ', '.join(paths), 'ExpressionAttributeNames': names}
+
+
+class PhotoCatalog:
+    '''Read photo items from a PhotoOps table'''
+
+    def __init__(
+            self,
+            table_name: str,
+            ddb_client: Optional['DynamoDBClient'] = None,
+            cache_maxsize: int = CATALOG_CACHE_MAXSIZE,
+            cache_ttl: timedelta = CATALOG_CACHE_TTL,
+            consistent_read: bool = False
+    ) -> None:
+        self._table_name = table_name
+        self._ddb_client = ddb_client
+        self._cache = TtlLruCache(cache_maxsize, cache_ttl)
+        self._consistent_read = consistent_read
+
+    @property
+    def ddb_client(self) -> 'DynamoDBClient':
+        '''DDB client, created on first use'''
+        if self._ddb_client is None:
+            self._ddb_client = boto3.client('dynamodb')
+        return self._ddb_client
+
+    def clear_cache(self) -> None:
+        '''Forget everything read so far'''
+        self._cache.clear()
+
+    def get_photo(
+            self,
+            pk: str,
+            include_exif: bool = False,
+            attributes: Optional[Sequence[str]] = None
+    ) -> Dict[str, Any]:
+        '''
+        Return every item of a photo by sk with one Query.
+
+        The exif#v0 item is filtered out unless include_exif. A filter applies after items are
+        read so it still costs read capacity, but isn't transferred or decoded. To not read it
+        at all name the items wanted with get_photos().
+        '''
+        attributes = tuple(attributes) if attributes is not None else None
+        cache_key = ('query', pk, include_exif, attributes)
+        items = self._cache.get(cache_key)
+        if items is not None:
+            return items
+
+        request: Dict[str, Any] = {
+            'TableName': self._table_name,
+            'KeyConditionExpression': 'pk = :pk',
+            'ExpressionAttributeValues': {':pk': {'S': pk}},
+            'ConsistentRead': self._consistent_read,
+            **_get_projection(attributes),
+        }
+        if not include_exif:
+            request['FilterExpression'] = 'sk <> :exif_sk'
+            request['ExpressionAttributeValues'][':exif_sk'] = {'S': EXIF_ITEM_SK}
+
+        items = {}
+        while True:
+            response = self.ddb_client.query(**request)
+            for _i in response.get('Items', []):
+                items[_i['sk']['S']] = _to_model(unmarshal_item(_i))
+            if 'LastEvaluatedKey' not in response:
+                break
+            request['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+        self._cache.put(cache_key, items)
+        return items
+
+    def get_item(
+            self,
+            pk: str,
+            sk: str,
+            attributes: Optional[Sequence[str]] = None
+    ) -> Optional[Any]:
+        '''Return one item of a photo or None'''
+        return self.get_items([(pk, sk)], attributes).get((pk, sk))
+
+    def get_photos(
+            self,
+            pks: Iterable[str],
+            sks: Iterable[str] = DEFAULT_SKS,
+            attributes: Optional[Sequence[str]] = None
+    ) -> Dict[str, Dict[str, Any]]:
+        '''Return items of many photos by pk then sk, reading only the items named'''
+        pks = list(dict.fromkeys(pks))
+        sks = list(sks)
+        items = self.get_items([(_p, _s) for _p in pks for _s in sks], attributes)
+
+        photos: Dict[str, Dict[str, Any]] = {_p: {} for _p in pks}
+        for (_p, _s), _m in items.items():
+            photos[_p][_s] = _m
+        return photos
+
+    def get_items(
+            self,
+            keys: Iterable[ItemKey],
+            attributes: Optional[Sequence[str]] = None
+    ) -> Dict[ItemKey, Any]:
+        '''
+        Return items by key with BatchGetItem. Missing items are left out.
+
+        Cached items aren't read again. The rest are read DDB_BATCH_GET_SIZE at a time with
+        unprocessed keys retried with jittered backoff.
+        '''
+        attributes = tuple(attributes) if attributes is not None else None
+
+        items: Dict[ItemKey, Any] = {}
+        to_read: List[ItemKey] = []
+        for _k in dict.fromkeys(keys):
+            model = self._cache.get(('item', _k, attributes))
+            if model is None:
+                to_read.append(_k)
+            elif model is not _NOT_FOUND:
+                items[_k] = model
+
+        for _s in range(0, len(to_read), DDB_BATCH_GET_SIZE):
+            chunk = to_read[_s:_s + DDB_BATCH_GET_SIZE]
+            read = self._batch_get_items(chunk, attributes)
+            for _k in chunk:
+                model = read.get(_k, _NOT_FOUND)
+                self._cache.put(('item', _k, attributes), model)
+                if model is not _NOT_FOUND:
+                    items[_k] = model
+
+        return items
+
+    def _batch_get_items(
+            self,
+            keys: List[ItemKey],
+            attributes: Optional[Sequence[str]]
+    ) -> Dict[ItemKey, Any]:
+        '''Read up to DDB_BATCH_GET_SIZE items'''
+        request = {
+            'Keys': [{'pk': {'S': _p}, 'sk': {'S': _s}} for _p, _s in keys],
+            'ConsistentRead': self._consistent_read,
+            **_get_projection(attributes),
+        }
+
+        items = {}
+        for attempt in range(DDB_BATCH_MAX_ATTEMPTS):
+            if attempt:
+                ceiling = min(
+                    DDB_BATCH_BACKOFF_MAX_SECONDS, DDB_BATCH_BACKOFF_BASE_SECONDS * 2 ** attempt
+                )
+                time.sleep(random.uniform(0, ceiling))
+
+            response = self.ddb_client.batch_get_item(RequestItems={self._table_name: request})
+            for _i in response.get('Responses', {}).get(self._table_name, []):
+                items[(_i['pk']['S'], _i['sk']['S'])] = _to_model(unmarshal_item(_i))
+
+            unprocessed = response.get('UnprocessedKeys', {}).get(self._table_name)
+            if not unprocessed:
+                return items
+            request = unprocessed
+            _logger.info('Retrying {} unprocessed keys'.format(len(unprocessed['Keys'])))
+
+        raise RuntimeError('Failed to read {} items'.format(len(request['Keys'])))
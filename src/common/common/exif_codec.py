@@ -0,0 +1,166 @@
+'''
+Compressed storage encoding for EXIF data items
+
+A full ExifDataItem stored as a nested map costs several WCUs and, with DNG profile tables,
+tone curves and strip offsets, heads towards the DDB item size limit. Encoded, each IFD is zlib
+compressed into one binary value while a few small, commonly queried tags stay plain, nested as
+before, so they can still be projected and filtered on:
+
+    exif: {'ifd0': {'make': 'NIKON', 'exif_ifd': {'f_number': 2.8, ...}, ...}}
+    exif_z: {'.': <root>, 'ifd0': <ifd0>, 'ifd0/exif_ifd': <exif_ifd>, ...}
+    exif_codec: 'zlib'
+
+Each compressed value also holds its IFD's key order, which a DDB map doesn't keep, so the
+decoded data is the same as what was encoded. Decoding returns a LazyExifDataItem that only
+decompresses an IFD when it's read.
+'''
+
+import json
+import zlib
+
+from functools import partial
+from typing import Any, Dict, FrozenSet, List, Tuple
+
+from .models import DeferredIfd, LazyExifData, LazyExifDataItem
+
+EXIF_ITEM_SK = 'exif#v0'
+
+EXIF_CODEC_ATTR = 'exif_codec'
+EXIF_BLOBS_ATTR = 'exif_z'
+EXIF_CODEC_ZLIB = 'zlib'
+EXIF_CODECS = (EXIF_CODEC_ZLIB,)
+# Blob path of the top level. DDB map keys can't be empty and '.' is never a tag name.
+EXIF_ROOT_PATH = '.'
+
+# Tags left plain in whichever IFD they appear, unless their value is over EXIF_PLAIN_MAX_BYTES.
+EXIF_PLAIN_TAGS = frozenset([
+    'make',
+    'model',
+    'software',
+    'serial_number',
+    'lens_model',
+    'orientation',
+    'date_time',
+    'date_time_original',
+    'offset_time',
+    'exposure_time',
+    'f_number',
+    'focal_length',
+    'photographic_sensitivity',
+    'gps_latitude_ref',
+    'gps_latitude',
+    'gps_longitude_ref',
+    'gps_longitude',
+    'gps_altitude',
+])
+EXIF_PLAIN_MAX_BYTES = 64
+
+
+def _get_ifd_path(path: str, key: str) -> str:
+    '''Return the path of a nested IFD'''
+    return key if path == EXIF_ROOT_PATH else '{}/{}'.format(path, key)
+
+
+def _is_plain(key: str, value: Any, plain_tags: FrozenSet[str], plain_max_bytes: int) -> bool:
+    '''Return whether a tag is stored plain'''
+    if key not in plain_tags:
+        return False
+    if value is None or isinstance(value, (bool, int, float)):
+        return True
+    if isinstance(value, str):
+        return len(value) <= plain_max_bytes
+    return len(json.dumps(value, separators=(',', ':'))) <= plain_max_bytes
+
+
+def _encode_ifd(
+        ifd: Dict[str, Any],
+        path: str,
+        blobs: Dict[str, bytes],
+        plain_tags: FrozenSet[str],
+        plain_max_bytes: int
+) -> Dict[str, Any]:
+    '''Compress an IFD and those nested in it into blobs and return its plain tags'''
+    plain: Dict[str, Any] = {}
+    compressed: Dict[str, Any] = {}
+    for _k, _v in ifd.items():
+        if isinstance(_v, dict):
+            nested_plain = _encode_ifd(
+                _v, _get_ifd_path(path, _k), blobs, plain_tags, plain_max_bytes
+            )
+            if nested_plain:
+                plain[_k] = nested_plain
+        elif _is_plain(_k, _v, plain_tags, plain_max_bytes):
+            plain[_k] = _v
+        else:
+            compressed[_k] = _v
+
+    body: Tuple[List[str], Dict[str, Any]] = (list(ifd), compressed)
+    blobs[path] = zlib.compress(json.dumps(body, separators=(',', ':')).encode('utf-8'))
+    return plain
+
+
+def encode_exif_item(
+        item: Dict[str, Any],
+        codec: str = EXIF_CODEC_ZLIB,
+        plain_tags: FrozenSet[str] = EXIF_PLAIN_TAGS,
+        plain_max_bytes: int = EXIF_PLAIN_MAX_BYTES
+) -> Dict[str, Any]:
+    '''Return an EXIF data item in its compressed storage encoding'''
+    if codec not in EXIF_CODECS:
+        raise ValueError('Unknown EXIF codec: {}'.format(codec))
+
+    blobs: Dict[str, bytes] = {}
+    plain = _encode_ifd(item['exif'], EXIF_ROOT_PATH, blobs, plain_tags, plain_max_bytes)
+    return {
+        **item,
+        'exif': plain,
+        EXIF_BLOBS_ATTR: blobs,
+        EXIF_CODEC_ATTR: codec,
+    }
+
+
+def is_encoded_exif_item(item: Dict[str, Any]) -> bool:
+    '''Return whether an item is in a compressed storage encoding'''
+    return EXIF_CODEC_ATTR in item
+
+
+def _decode_ifd(plain: Dict[str, Any], blobs: Dict[str, Any], path: str) -> Dict[str, Any]:
+    '''Return an IFD's raw tags with the IFDs nested in it deferred'''
+    # Binary values read with the DDB resource layer are boto3 Binary, not bytes.
+    keys, compressed = json.loads(zlib.decompress(bytes(blobs[path])))
+
+    raw: Dict[str, Any] = {}
+    for _k in keys:
+        if _k in compressed:
+            raw[_k] = compressed[_k]
+            continue
+
+        nested_path = _get_ifd_path(path, _k)
+        if nested_path in blobs:
+            raw[_k] = DeferredIfd(partial(_decode_ifd, plain.get(_k) or {}, blobs, nested_path))
+        else:
+            raw[_k] = plain.get(_k)
+    return raw
+
+
+def decode_exif(plain: Dict[str, Any], blobs: Dict[str, Any]) -> LazyExifData:
+    '''Return a lazy view of encoded EXIF data decompressing each IFD on first access'''
+    return LazyExifData(**_decode_ifd(plain, blobs, EXIF_ROOT_PATH))
+
+
+def decode_exif_item(item: Dict[str, Any]) -> LazyExifDataItem:
+    '''Return a lazy EXIF data item from an encoded or plain stored item'''
+    if not is_encoded_exif_item(item):
+        return LazyExifDataItem(
+            pk=item['pk'], sk=item['sk'], exif=item.get('exif'), file=item.get('file')
+        )
+
+    if item[EXIF_CODEC_ATTR] not in EXIF_CODECS:
+        raise ValueError('Unknown EXIF codec: {}'.format(item[EXIF_CODEC_ATTR]))
+
+    return LazyExifDataItem(
+        pk=item['pk'],
+        sk=item['sk'],
+        exif=decode_exif(item['exif'], item[EXIF_BLOBS_ATTR]),
+        file=item.get('file')
+    )
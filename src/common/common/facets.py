@@ -0,0 +1,211 @@
+'''
+Normalizers turning EXIF data into facet data
+
+These are shared by the per facet functions and by fused extraction, which runs several on one
+parsed ExifDataItem.
+'''
+
+import logging
+
+from dataclasses import asdict, dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union, cast
+
+from .models import (
+    CameraExifData,
+    CameraExifDataItem,
+    ExifDataItem,
+    FileData,
+    FileDataItem,
+    Ifd,
+    ImageExifData,
+    ImageExifDataItem,
+    LazyExifDataItem,
+    LensExifData,
+    LensExifDataItem,
+    LocationExifData,
+    LocationExifDataItem
+)
+
+_logger = logging.getLogger(__name__)
+
+# Normalizers read attributes only so either an ExifDataItem or its lazy view will do.
+AnyExifDataItem = Union[ExifDataItem, LazyExifDataItem]
+
+
+def get_exif_camera_data(exif_data: AnyExifDataItem) -> CameraExifData:
+    '''Return normalized camera data'''
+
+    ifd0 = cast(Ifd, exif_data.exif.ifd0)
+
+    camera_data = {
+        'make': ifd0.make,
+        'model': ifd0.model,
+        'software': ifd0.software,
+        'serial_number': None if ifd0.maker_note is None else ifd0.maker_note.serial_number
+    }
+
+    return CameraExifData(**camera_data)
+
+
+def _get_lens_focal_attrs(ifd: Ifd) -> Dict[str, Union[int, float, None]]:
+    '''Return lens focal attributes'''
+    focal_attrs = ifd.maker_note.lens_min_max_focal_max_aperture
+    return {
+        'min_focal': int(focal_attrs[0]),
+        'max_focal': int(focal_attrs[1]),
+        'min_aperture': None,
+        'max_aperture_high': focal_attrs[2],
+        'max_aperture_low': focal_attrs[3],
+    }
+
+
+def get_exif_lens_data(exif_data: AnyExifDataItem) -> LensExifData:
+    '''Return normalized lens data'''
+    ifd = cast(Ifd, exif_data.exif.ifd0)
+
+    lens_data = {
+        **_get_lens_focal_attrs(ifd)
+    }
+
+    lens_data['lens_maker_type'] = []
+    lens_data['camera_maker_type'] = ifd.maker_note.lens_type.split(' ')
+
+    lens_data['auto_focus'] = True if lens_data['camera_maker_type'][0] == 'AF' else False
+    lens_data['vibration_reduction'] = True if 'VR' in lens_data['camera_maker_type'] else False
+
+    # These are in LensData which I don't know how to read
+    lens_data['make'] = None
+    lens_data['model'] = None
+    lens_data['serial_number'] = None
+    lens_data['macro'] = None
+    lens_data['zoom'] = True if lens_data['min_focal'] != lens_data['max_focal'] else False
+
+    return LensExifData(**lens_data)
+
+
+def get_exif_location_data(exif_data: AnyExifDataItem) -> LocationExifData:
+    '''Return normalized location data'''
+    ifd0 = cast(Ifd, exif_data.exif.ifd0)
+    location_data = {}
+    location_data['gps_version_id'] = ifd0.gps_ifd.gps_version_id
+    location_data['gps_latitude_ref'] = ifd0.gps_ifd.gps_latitude_ref
+    location_data['gps_latitude'] = ifd0.gps_ifd.gps_latitude
+    location_data['gps_longitude_ref'] = ifd0.gps_ifd.gps_longitude_ref
+    location_data['gps_longitude'] = ifd0.gps_ifd.gps_longitude
+    location_data['gps_altitude_ref'] = ifd0.gps_ifd.gps_altitude_ref
+    location_data['gps_altitude'] = ifd0.gps_ifd.gps_altitude
+    location_data['gps_time_stamp'] = ifd0.gps_ifd.gps_time_stamp
+    location_data['gps_satellites'] = ifd0.gps_ifd.gps_satellites
+    location_data['gps_map_datum'] = ifd0.gps_ifd.gps_map_datum
+    location_data['gps_date'] = ifd0.gps_ifd.gps_date
+
+    return LocationExifData(**location_data)
+
+
+def get_exif_image_data(exif_item: AnyExifDataItem) -> ImageExifData:
+    '''Return normalized image data'''
+
+    ifd0 = exif_item.exif.ifd0
+
+    # FIXME: We can now actually get whether the file is a JPG or not from the event.
+    length, width, orientation, compression = exif_item.exif.tag_index.get_image_info()
+
+    image_data: Dict[str, Any] = {}
+
+    # FIXME: Query for filetype once that data is available.
+    image_data['length'] = length
+    image_data['width'] = width
+    image_data['orientation'] = orientation
+    image_data['compression'] = compression
+
+    # NOTE: DateTime is complicated. We should check for discrepancies between all the
+    # locations and decide what to use when.
+    image_data['date_time'] = ifd0.date_time
+    image_data['date_time_offset'] = ifd0.exif_ifd.offset_time
+
+    image_data['auto_focus'] = True if ifd0.maker_note.focus_mode.startswith('AF') else False
+    # Note: varies by brand.
+    image_data['exposure_mode'] = ifd0.exif_ifd.exposure_mode
+    image_data['exposure_program'] = ifd0.exif_ifd.exposure_program
+    image_data['exposure_time'] = ifd0.exif_ifd.exposure_time
+    image_data['flash'] = ifd0.exif_ifd.flash
+    image_data['fnumber'] = ifd0.exif_ifd.f_number
+    image_data['focal_length'] = ifd0.exif_ifd.focal_length
+    image_data['focal_length_in_35mm_film'] = ifd0.exif_ifd.focal_length_in_35mm_film
+    # ISO
+    # NOTE: These two tags are related but I don't know what variations exist. Also my favorite
+    # line from the spec:
+    #
+    # "While 'Count = Any', only 1 should be used"
+    image_data['photographic_sensitivity'] = ifd0.exif_ifd.photographic_sensitivity
+    image_data['sensitivity_type'] = ifd0.exif_ifd.sensitivity_type
+
+    image_data['light_source'] = ifd0.exif_ifd.light_source
+    image_data['metering_mode'] = ifd0.exif_ifd.metering_mode
+    image_data['sensing_method'] = ifd0.exif_ifd.sensing_method
+
+    image_data['contrast'] = ifd0.exif_ifd.contrast
+    image_data['gain_control'] = ifd0.exif_ifd.gain_control
+    image_data['saturation'] = ifd0.exif_ifd.saturation
+    image_data['sharpness'] = ifd0.exif_ifd.sharpness
+    image_data['subject_distance_range'] = ifd0.exif_ifd.subject_distance_range
+    image_data['white_balance'] = ifd0.exif_ifd.white_balance
+
+    return ImageExifData(**image_data)
+
+
+def get_file_data(exif_item: AnyExifDataItem) -> FileData:
+    '''Return file data'''
+    return cast(FileData, exif_item.file)
+
+
+@dataclass
+class Facet:
+    '''A facet of EXIF data and how to produce its DDB item'''
+    name: str
+    sk: str
+    normalizer: Callable[[AnyExifDataItem], Any]
+    item_class: type
+
+
+FACETS: Dict[str, Facet] = {
+    'camera': Facet('camera', 'camera#v0', get_exif_camera_data, CameraExifDataItem),
+    'lens': Facet('lens', 'lens#v0', get_exif_lens_data, LensExifDataItem),
+    'location': Facet('location', 'location#v0', get_exif_location_data, LocationExifDataItem),
+    'image': Facet('image', 'image#v0', get_exif_image_data, ImageExifDataItem),
+    'file': Facet('file', 'file#v0', get_file_data, FileDataItem),
+}
+
+
+def get_facet_item(exif_item: AnyExifDataItem, facet: Facet) -> Any:
+    '''Return a facet DDB item'''
+    facet_data = facet.normalizer(exif_item)
+    return facet.item_class(
+        **{
+            'pk': exif_item.pk,
+            'sk': facet.sk,
+            **asdict(facet_data)
+        }
+    )
+
+
+def get_facet_items(
+        exif_item: AnyExifDataItem,
+        facet_names: Optional[List[str]] = None
+) -> Tuple[List[Any], List[str]]:
+    '''
+    Return facet DDB items for one parsed EXIF data item.
+
+    A facet that fails to normalize doesn't stop the others. Its name is returned in the
+    failed list so it can be rerun on its own.
+    '''
+    items = []
+    failed = []
+    for _n in facet_names or list(FACETS):
+        try:
+            items.append(get_facet_item(exif_item, FACETS[_n]))
+        except Exception as e:
+            _logger.exception('Failed to normalize {} facet: {}'.format(_n, e))
+            failed.append(_n)
+
+    return items, failed
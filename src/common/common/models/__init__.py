@@ -7,3 +7,4 @@ from .put_ddb_item import *
 from .exif_data import *
 from .file_data import *
 from .jpeg_data import *
+from .exif_profile import *
@@ -4,24 +4,45 @@ EXIF data
 generated by json2python-models v0.2.1 at Wed Sep 29 15:30:53 2021
 command: /Users/tom/.local/share/virtualenvs/PhotoOps-5MqeThcN/bin/json2models -s nested --datetime --max-strings-literals 0 -f dataclasses -m ExifData data/events/GetExifData-output.json
 """
-from dataclasses import dataclass, field, make_dataclass, replace
+from dataclasses import dataclass, field, fields, is_dataclass, make_dataclass
+from functools import lru_cache
 from dataclasses_json import LetterCase, Undefined, config, dataclass_json
+from dataclasses_json.undefined import UndefinedParameterError
 from inflection import underscore
-from json import dumps
 
 from inflection import underscore
 from json_to_models.dynamic_typing import FloatString, IntString, IsoTimeString
-from typing import Any, List, Optional, Union
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
 
+from ..util.dataclasses import add_slots
 from .file_data import FileData
 
+# Bounds on the number of distinct ExifData and MakerNote shapes kept. Each camera model and
+# firmware tends to produce one shape so these are generous.
+EXIF_DATA_CLASS_CACHE_SIZE = 64
+MAKER_NOTE_CLASS_CACHE_SIZE = 256
+
+
+@lru_cache(maxsize=4096)
+def _underscore(word: str) -> str:
+    '''Return a cached snake case tag name'''
+    return underscore(word)
+
+
+@lru_cache(maxsize=MAKER_NOTE_CLASS_CACHE_SIZE)
+def _make_maker_note_class(field_names: Tuple[str, ...]) -> type:
+    '''Return the MakerNote dataclass for a set of tag names'''
+    return add_slots(make_dataclass('MakerNote', field_names))
+
 
 @dataclass_json(letter_case=LetterCase.PASCAL, undefined=Undefined.RAISE)
+@add_slots
 @dataclass
 class Ifd:
     '''EXIF IFD'''
 
     @dataclass_json(letter_case=LetterCase.PASCAL, undefined=Undefined.RAISE)
+    @add_slots
     @dataclass
     class ExifIfd:
         '''EXIF SubIFD'''
@@ -83,6 +104,7 @@ class Ifd:
 
 
     @dataclass_json(letter_case=LetterCase.PASCAL, undefined=Undefined.RAISE)
+    @add_slots
     @dataclass
     class GpsIfd:
         '''GPS SubIFD'''
@@ -100,6 +122,7 @@ class Ifd:
 
 
     @dataclass_json(letter_case=LetterCase.PASCAL, undefined=Undefined.RAISE)
+    @add_slots
     @dataclass
     class ImageIfd:
         '''Image SubIFD'''
@@ -270,23 +293,22 @@ class Ifd:
         if self.gps_ifd and isinstance(self.gps_ifd, dict):
             self.gps_ifd = self.GpsIfd(**self.gps_ifd)
 
-        for _k in self.__dict__:
-            if _k.startswith('sub_ifd') and isinstance(self.__dict__[_k], dict):
-                self.__dict__[_k] = self.ImageIfd(**self.__dict__[_k])
+        for _f in fields(self):
+            if _f.name.startswith('sub_ifd') and isinstance(getattr(self, _f.name), dict):
+                setattr(self, _f.name, self.ImageIfd(**getattr(self, _f.name)))
 
         if self.maker_note is not None:
             self.maker_note = self.make_maker_note(**self.maker_note)
 
-    def make_maker_note(self, **kwargs):
+    @staticmethod
+    def make_maker_note(**kwargs):
         '''Make a MakerNote dataclass'''
         new_kwargs = {}
-        dc_fields=[]
         for _k in kwargs:
-            snake_k = underscore(_k)
-            new_kwargs[snake_k] = kwargs[_k]
-            dc_fields.append((snake_k))
+            new_kwargs[_underscore(_k)] = kwargs[_k]
 
-        MakerNote = make_dataclass('MakerNote', dc_fields)
+        # Building a class is expensive so one is made per distinct set of tags.
+        MakerNote = _make_maker_note_class(tuple(new_kwargs))
         return MakerNote(**new_kwargs)
 
 
@@ -310,10 +332,224 @@ class ExifDataItem:
 
 
 
+class _DictDecoder:
+    '''
+    Build a dataclass_json dataclass straight from a dict.
+
+    This gives the same result as from_dict() for the IFD models without its per call
+    reflection. Keys may be the encoded name (letter case or field_name override) or the field
+    name, unknown keys raise UndefinedParameterError as with Undefined.RAISE and values are
+    passed through as is. Nested optional dataclasses are decoded with their own decoder.
+    '''
+
+    def __init__(self, cls: type) -> None:
+        self._cls = cls
+        self._names: Dict[str, str] = {}
+        self._nested: Dict[str, type] = {}
+        self._defaults: Dict[str, Any] = {}
+
+        cls_letter_case = (getattr(cls, 'dataclass_json_config', None) or {}).get('letter_case')
+        for _f in fields(cls):
+            self._names[_f.name] = _f.name
+            self._defaults[_f.name] = _f.default
+
+            type_args = getattr(_f.type, '__args__', ())
+            if len(type_args) == 2 and type_args[1] is type(None) and is_dataclass(type_args[0]):
+                self._nested[_f.name] = type_args[0]
+
+        # Encoded names win over field names, as in dataclasses_json.
+        for _f in fields(cls):
+            config = _f.metadata.get('dataclasses_json', {})
+            letter_case = config.get('letter_case', cls_letter_case)
+            if letter_case is not None:
+                self._names[letter_case(_f.name)] = _f.name
+
+        # Field name to the keys it may appear under, for decoding a single field.
+        self._keys: Dict[str, Tuple[str, ...]] = {}
+        for _k, _n in self._names.items():
+            self._keys[_n] = self._keys.get(_n, ()) + (_k,)
+
+    def has_field(self, name: str) -> bool:
+        '''Return whether the class has a field'''
+        return name in self._defaults
+
+    def check_keys(self, kvs: Dict[str, Any]) -> None:
+        '''Raise UndefinedParameterError if a dict has keys that aren't fields'''
+        names = self._names
+        unknown = {_k: _v for _k, _v in kvs.items() if _k not in names}
+        if unknown:
+            raise UndefinedParameterError(
+                'Received undefined initialization arguments {}'.format(unknown)
+            )
+
+    def decode(self, kvs: Dict[str, Any]) -> Any:
+        '''Return an instance built from a dict'''
+        self.check_keys(kvs)
+
+        names = self._names
+        kwargs = {}
+        for _k, _v in kvs.items():
+            kwargs[names[_k]] = _v
+
+        for _n, _c in self._nested.items():
+            value = kwargs.get(_n)
+            if isinstance(value, dict):
+                kwargs[_n] = _get_dict_decoder(_c).decode(value)
+
+        return self._cls(**kwargs)
+
+    def get_raw_field(self, kvs: Dict[str, Any], name: str) -> Any:
+        '''Return a field's undecoded value from a dict or its default'''
+        for _k in self._keys[name]:
+            if _k in kvs:
+                return kvs[_k]
+        return self._defaults[name]
+
+    def get_field_name(self, key: str) -> str:
+        '''Return the field name for a key, or the key if it isn't one'''
+        return self._names.get(key, key)
+
+    def get_nested_class(self, name: str) -> Optional[type]:
+        '''Return the dataclass of a nested field'''
+        return self._nested.get(name)
+
+
+@lru_cache(maxsize=None)
+def _get_dict_decoder(cls: type) -> _DictDecoder:
+    '''Return the decoder for a class'''
+    return _DictDecoder(cls)
+
+
+def decode_ifd(kvs: Dict[str, Any]) -> Ifd:
+    '''Return an Ifd built from a dict of IFD tags'''
+    return _get_dict_decoder(Ifd).decode(kvs)
+
+
+# Where a tag was found: the path of IFD names down to it, then its value.
+TagPath = Tuple[str, ...]
+TagEntry = Tuple[TagPath, Any]
+
+FULL_RESOLUTION_SUBFILE_TYPE = 'Full-resolution image'
+
+
+class ExifTagIndex:
+    '''
+    Index of every tag in a piece of EXIF data by tag name.
+
+    Built with one walk over the IFDs, after which a tag's values are a dict lookup rather than
+    a walk of the whole tree. Each tag maps to the IFD paths it appears under, eg.
+    ('ifd0', 'sub_ifd1'), and its values there, in document order. Tags with no value aren't
+    indexed so data serialized with or without None values indexes the same.
+
+    The rules for picking one value when a tag appears in several IFDs live here too.
+    '''
+    __slots__ = ('_tags',)
+
+    def __init__(self) -> None:
+        self._tags: Dict[str, List[TagEntry]] = {}
+
+    @classmethod
+    def from_exif(cls, exif: Any) -> 'ExifTagIndex':
+        '''Return the index of an ExifData dataclass, its lazy view or its raw dict'''
+        index = cls()
+        if isinstance(exif, LazyExifData):
+            exif = exif._raw
+
+        if isinstance(exif, dict):
+            ifds = ((_k.lower(), _v) for _k, _v in exif.items())
+        else:
+            ifds = ((_f.name, getattr(exif, _f.name)) for _f in fields(exif))
+
+        for _n, _v in ifds:
+            if _v is not None:
+                index._add((_n,), _v, Ifd)
+        return index
+
+    def _add(self, path: TagPath, node: Any, cls: Optional[type]) -> None:
+        '''Index the tags of one IFD and the IFDs nested in it'''
+        if isinstance(node, DeferredIfd):
+            node = node.load()
+        if isinstance(node, _LazyView):
+            node, cls = node._raw, node._cls
+
+        if isinstance(node, dict):
+            # Raw keys may be encoded names. MakerNote has no model so is snake cased as when
+            # it's decoded.
+            decoder = None if cls is None else _get_dict_decoder(cls)
+            if decoder is None:
+                tags = ((_underscore(_k), _v) for _k, _v in node.items())
+            else:
+                tags = ((decoder.get_field_name(_k), _v) for _k, _v in node.items())
+        else:
+            decoder = None
+            tags = ((_f.name, getattr(node, _f.name)) for _f in fields(node))
+
+        entries = self._tags
+        for _n, _v in tags:
+            if _v is None:
+                continue
+            if isinstance(_v, (dict, _LazyView, DeferredIfd)) or is_dataclass(_v):
+                nested_cls = None if decoder is None else decoder.get_nested_class(_n)
+                self._add(path + (_n,), _v, nested_cls)
+            elif _n in entries:
+                entries[_n].append((path, _v))
+            else:
+                entries[_n] = [(path, _v)]
+
+    def get_all(self, tag: str) -> List[TagEntry]:
+        '''Return the paths and values of a tag in document order'''
+        return self._tags.get(tag, [])
+
+    def get(self, tag: str, default: Any = None) -> Any:
+        '''Return the first value of a tag in document order'''
+        entries = self._tags.get(tag)
+        return entries[0][1] if entries else default
+
+    def get_at(self, path: TagPath, tag: str, default: Any = None) -> Any:
+        '''Return a tag's value in one IFD'''
+        for _p, _v in self._tags.get(tag, []):
+            if _p == path:
+                return _v
+        return default
+
+    def get_full_resolution_path(self) -> Optional[TagPath]:
+        '''Return the path of the first IFD describing the full resolution image'''
+        for _p, _v in self.get_all('subfile_type'):
+            if _v == FULL_RESOLUTION_SUBFILE_TYPE:
+                return _p
+        return None
+
+    def get_image_info(self) -> Tuple[Optional[int], Optional[int], Optional[str], Optional[str]]:
+        '''
+        Return the image length, width, orientation and compression.
+
+        Dimensions and compression come from the first IFD marked as the full resolution
+        image, as thumbnails and previews set ImageWidth and ImageLength too. Failing that the
+        ExifIFD pixel dimensions are used. Orientation is the first one in document order,
+        which is IFD0's when it has one.
+        '''
+        path = self.get_full_resolution_path()
+        if path is not None:
+            length = self.get_at(path, 'image_length')
+            width = self.get_at(path, 'image_width')
+            compression = self.get_at(path, 'compression')
+        else:
+            length = self.get('pixel_y_dimension')
+            width = self.get('pixel_x_dimension')
+            compression = None
+            dimension_entries = (
+                self.get_all('pixel_x_dimension') or self.get_all('pixel_y_dimension')
+            )
+            if dimension_entries:
+                compression = self.get_at(dimension_entries[0][0], 'compression')
+
+        return (length, width, self.get('orientation'), compression)
+
+
 def _convert_exif_data_attrs_to_ifds(cls) -> None:
-    for _attr in cls.__dict__:
-        if _attr.startswith('ifd') and not isinstance(cls.__dict__[_attr], Ifd):
-            cls.__dict__[_attr] = Ifd.from_json(dumps(cls.__dict__[_attr]))
+    for _f in fields(cls):
+        if _f.name.startswith('ifd') and not isinstance(getattr(cls, _f.name), Ifd):
+            setattr(cls, _f.name, decode_ifd(getattr(cls, _f.name)))
 
 
 def make_exif_data_dataclass(**kwargs):
@@ -325,17 +561,175 @@ def make_exif_data_dataclass(**kwargs):
     '''
 
     new_kwargs = {}
-    dc_fields=[]
     for _k in kwargs:
-        lower_k = _k.lower()
-        new_kwargs[lower_k] = kwargs[_k]
-        dc_fields.append((lower_k, Ifd))
-
-    dc = make_dataclass(
-        'ExifData',
-        dc_fields,
-        namespace={
-            '__post_init__': lambda self: _convert_exif_data_attrs_to_ifds(self)
-        }
-    )
+        new_kwargs[_k.lower()] = kwargs[_k]
+
+    dc = _make_exif_data_class(tuple(new_kwargs))
     return dc(**new_kwargs)
+
+
+@lru_cache(maxsize=EXIF_DATA_CLASS_CACHE_SIZE)
+def _make_exif_data_class(field_names: Tuple[str, ...]) -> type:
+    '''Return the ExifData dataclass for a set of IFD names'''
+    return add_slots(
+        make_dataclass(
+            'ExifData',
+            [(_f, Ifd) for _f in field_names],
+            namespace={
+                '__post_init__': lambda self: _convert_exif_data_attrs_to_ifds(self),
+                'tag_index': property(_get_tag_index),
+            }
+        ),
+        extra_slots=('_tag_index',)
+    )
+
+
+def _get_tag_index(exif_data: Any) -> ExifTagIndex:
+    '''Return the tag index of ExifData, building it on first use'''
+    try:
+        return exif_data._tag_index
+    except AttributeError:
+        exif_data._tag_index = ExifTagIndex.from_exif(exif_data)
+        return exif_data._tag_index
+
+
+class DeferredIfd:
+    '''
+    Raw IFD dict produced on first access, eg. by decompressing it from storage.
+
+    The lazy views, tag index and materialize() load it wherever they would read a raw dict.
+    '''
+    __slots__ = ('_load', '_raw')
+
+    def __init__(self, load: Callable[[], Dict[str, Any]]) -> None:
+        self._load = load
+        self._raw: Optional[Dict[str, Any]] = None
+
+    def load(self) -> Dict[str, Any]:
+        '''Return the raw IFD dict, loading it on first call'''
+        if self._raw is None:
+            self._raw = self._load()
+        return self._raw
+
+    def __repr__(self) -> str:
+        return 'DeferredIfd({})'.format('loaded' if self._raw is not None else 'not loaded')
+
+
+def _load_deferred(raw: Dict[str, Any]) -> Dict[str, Any]:
+    '''Return a raw dict with every deferred IFD in it loaded'''
+    loaded = {}
+    for _k, _v in raw.items():
+        if isinstance(_v, DeferredIfd):
+            _v = _v.load()
+        loaded[_k] = _load_deferred(_v) if isinstance(_v, dict) else _v
+    return loaded
+
+
+class _LazyView:
+    '''
+    Read only view of a model decoding fields from the raw dict on first access.
+
+    Keys are checked when the view is created so an unknown tag still raises, but only for the
+    parts of the EXIF data that are actually read.
+    '''
+    __slots__ = ('_cls', '_raw', '_values')
+
+    def __init__(self, cls: type, raw: Dict[str, Any]) -> None:
+        _get_dict_decoder(cls).check_keys(raw)
+        self._cls = cls
+        self._raw = raw
+        self._values: Dict[str, Any] = {}
+
+    def __getattr__(self, name: str) -> Any:
+        values = self._values
+        if name in values:
+            return values[name]
+
+        decoder = _get_dict_decoder(self._cls)
+        if not decoder.has_field(name):
+            raise AttributeError(
+                "'{}' object has no attribute '{}'".format(self._cls.__name__, name)
+            )
+
+        value = decoder.get_raw_field(self._raw, name)
+        if isinstance(value, DeferredIfd):
+            value = value.load()
+        nested_cls = decoder.get_nested_class(name)
+        if nested_cls is not None and isinstance(value, dict):
+            value = _LazyView(nested_cls, value)
+        elif self._cls is Ifd and name == 'maker_note' and value is not None:
+            value = Ifd.make_maker_note(**value)
+
+        values[name] = value
+        return value
+
+    def __repr__(self) -> str:
+        return 'Lazy{}({})'.format(self._cls.__name__, self._raw)
+
+    def materialize(self) -> Any:
+        '''Return the fully decoded model'''
+        return _get_dict_decoder(self._cls).decode(_load_deferred(self._raw))
+
+
+class LazyExifData:
+    '''ExifData view decoding each IFD on first access'''
+    __slots__ = ('_raw', '_ifds', '_tag_index')
+
+    def __init__(self, **kwargs) -> None:
+        self._raw = {_k.lower(): _v for _k, _v in kwargs.items()}
+        self._ifds: Dict[str, Any] = {}
+        self._tag_index: Optional[ExifTagIndex] = None
+
+    @property
+    def tag_index(self) -> ExifTagIndex:
+        '''Tag index of the raw EXIF data, built on first use'''
+        if self._tag_index is None:
+            self._tag_index = ExifTagIndex.from_exif(self)
+        return self._tag_index
+
+    def __getattr__(self, name: str) -> Any:
+        ifds = self._ifds
+        if name in ifds:
+            return ifds[name]
+
+        if name not in self._raw:
+            raise AttributeError("'ExifData' object has no attribute '{}'".format(name))
+
+        value = self._raw[name]
+        if isinstance(value, DeferredIfd):
+            value = value.load()
+        if isinstance(value, dict):
+            value = _LazyView(Ifd, value)
+        ifds[name] = value
+        return value
+
+    def materialize(self) -> Any:
+        '''Return the fully decoded ExifData dataclass'''
+        return make_exif_data_dataclass(**_load_deferred(self._raw))
+
+
+class LazyExifDataItem:
+    '''
+    Read only ExifDataItem whose EXIF data is decoded on access.
+
+    Takes the same arguments as ExifDataItem. Normalizers that read a handful of tags only pay
+    for decoding those tags and the IFDs holding them rather than the whole EXIF blob.
+    '''
+    __slots__ = ('pk', 'sk', 'exif', 'file')
+
+    def __init__(
+            self,
+            pk: str,
+            sk: str,
+            exif: Optional[Any] = None,
+            file: Optional[Any] = None
+    ) -> None:
+        self.pk = pk
+        self.sk = sk
+        self.exif = LazyExifData(**exif) if isinstance(exif, dict) else exif
+        self.file = FileData(**file) if isinstance(file, dict) else file
+
+    def materialize(self) -> ExifDataItem:
+        '''Return the fully decoded ExifDataItem'''
+        exif = self.exif.materialize() if isinstance(self.exif, LazyExifData) else self.exif
+        return ExifDataItem(pk=self.pk, sk=self.sk, exif=exif, file=self.file)
@@ -0,0 +1,169 @@
+'''
+EXIF extraction profiles
+
+A profile declares which IFDs and tags a consumer reads. Selectors are '/' separated paths of
+tag names as the EXIF parser emits them, eg. 'IFD0/ExifIFD/FNumber'. Each segment may use shell
+wildcards and matching is case insensitive. A selector naming an IFD keeps that whole IFD.
+'''
+from dataclasses import dataclass, field
+from fnmatch import fnmatchcase
+from typing import Any, Dict, Iterable, Tuple
+
+__all__ = ['EXIF_PROFILES', 'ExifProfile', 'get_exif_profile']
+
+_Path = Tuple[str, ...]
+
+
+def _split(selector: str) -> _Path:
+    return tuple(_s.lower() for _s in selector.split('/'))
+
+
+def _matches(pattern: _Path, path: _Path) -> bool:
+    '''Return whether the path segments match the pattern segments pairwise'''
+    return all(fnmatchcase(_s.lower(), _p) for _p, _s in zip(pattern, path))
+
+
+@dataclass(frozen=True)
+class ExifProfile:
+    '''Set of EXIF IFDs and tags a consumer reads'''
+    name: str
+    include: Tuple[str, ...]
+    exclude: Tuple[str, ...] = ()
+    # Selectors split into lower cased segments.
+    _include: Tuple[_Path, ...] = field(init=False, repr=False, compare=False)
+    _exclude: Tuple[_Path, ...] = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        object.__setattr__(self, '_include', tuple(_split(_s) for _s in self.include))
+        object.__setattr__(self, '_exclude', tuple(_split(_s) for _s in self.exclude))
+
+    def __or__(self, other: 'ExifProfile') -> 'ExifProfile':
+        # An exclude only survives if the other profile doesn't select anything it covers.
+        return ExifProfile(
+            name='+'.join([self.name, other.name]),
+            include=self.include + tuple(_s for _s in other.include if _s not in self.include),
+            exclude=tuple(
+                [_s for _s in self.exclude if not other._overlaps(_split(_s))] +
+                [_s for _s in other.exclude if not self._overlaps(_split(_s))]
+            )
+        )
+
+    def _overlaps(self, path: _Path) -> bool:
+        '''Return whether an include selects the path, its parents or its children'''
+        return any(_matches(_s, path) for _s in self._include)
+
+    def _covers(self, selectors: Tuple[_Path, ...], path: _Path) -> bool:
+        '''Return whether a selector names the path or one of its parents'''
+        return any(len(_s) <= len(path) and _matches(_s, path) for _s in selectors)
+
+    def _descends(self, path: _Path) -> bool:
+        '''Return whether a selector names something beneath the path'''
+        return any(len(_s) > len(path) and _matches(_s, path) for _s in self._include)
+
+    def selects(self, selector: str) -> bool:
+        '''Return whether the profile keeps anything at or beneath a path, eg. IFD0/MakerNote'''
+        path = _split(selector)
+        return self._overlaps(path) and not self._covers(self._exclude, path)
+
+    def select(self, tag_values: Dict[str, Any], _path: _Path = ()) -> Dict[str, Any]:
+        '''Return only the declared tags of parsed EXIF tag values'''
+        selected = {}
+        for _k, _v in tag_values.items():
+            path = _path + (_k,)
+            if self._covers(self._exclude, path):
+                continue
+
+            if isinstance(_v, dict) and (self._exclude or not self._covers(self._include, path)):
+                covered = self._covers(self._include, path)
+                if covered or self._descends(path):
+                    sub_selected = self.select(_v, path)
+                    if covered or sub_selected:
+                        selected[_k] = sub_selected
+            elif self._covers(self._include, path):
+                selected[_k] = _v
+
+        return selected
+
+
+_IMAGE_INFO_TAGS = ['SubfileType', 'ImageWidth', 'ImageLength', 'Compression', 'Orientation']
+
+EXIF_PROFILES: Dict[str, ExifProfile] = {
+    # Everything the parser returns less the undecoded MakerNote bytes.
+    'full': ExifProfile(
+        name='full',
+        include=('*',),
+        exclude=('IFD*/ExifIFD/MakerNote',)
+    ),
+    'camera': ExifProfile(
+        name='camera',
+        include=(
+            'IFD0/Make',
+            'IFD0/Model',
+            'IFD0/Software',
+            'IFD0/MakerNote/SerialNumber',
+        )
+    ),
+    'lens': ExifProfile(
+        name='lens',
+        include=(
+            'IFD0/MakerNote/LensMinMaxFocalMaxAperture',
+            'IFD0/MakerNote/LensType',
+        )
+    ),
+    'location': ExifProfile(
+        name='location',
+        include=(
+            'IFD0/GpsIFD',
+        )
+    ),
+    'image': ExifProfile(
+        name='image',
+        include=tuple(
+            ['IFD*/{}'.format(_t) for _t in _IMAGE_INFO_TAGS] +
+            ['IFD*/SubIFD*/{}'.format(_t) for _t in _IMAGE_INFO_TAGS] +
+            ['IFD*/ExifIFD/PixelXDimension', 'IFD*/ExifIFD/PixelYDimension'] +
+            ['IFD0/DateTime', 'IFD0/MakerNote/FocusMode'] +
+            [
+                'IFD0/ExifIFD/{}'.format(_t) for _t in [
+                    'OffsetTime',
+                    'ExposureMode',
+                    'ExposureProgram',
+                    'ExposureTime',
+                    'Flash',
+                    'FNumber',
+                    'FocalLength',
+                    'FocalLengthIn35mmFilm',
+                    'PhotographicSensitivity',
+                    'SensitivityType',
+                    'LightSource',
+                    'MeteringMode',
+                    'SensingMethod',
+                    'Contrast',
+                    'GainControl',
+                    'Saturation',
+                    'Sharpness',
+                    'SubjectDistanceRange',
+                    'WhiteBalance',
+                ]
+            ]
+        )
+    ),
+    # File data comes from the object itself, not EXIF.
+    'file': ExifProfile(
+        name='file',
+        include=()
+    ),
+}
+
+
+def get_exif_profile(names: Iterable[str]) -> ExifProfile:
+    '''Return the union of the named profiles'''
+    profile = None
+    for _n in names:
+        named = EXIF_PROFILES[_n.strip()]
+        profile = named if profile is None else profile | named
+
+    if profile is None:
+        raise ValueError('No EXIF profile named')
+
+    return profile
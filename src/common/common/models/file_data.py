@@ -11,11 +11,11 @@ from typing import Optional
 @dataclass
 class FileData:
     '''file data'''
-    file_type: Optional[str]
-    extension: Optional[str]
-    object_size: Optional[str]
-    is_jpeg: Optional[bool]
-    is_raw: Optional[bool]
+    file_type: Optional[str] = None
+    extension: Optional[str] = None
+    object_size: Optional[str] = None
+    is_jpeg: Optional[bool] = None
+    is_raw: Optional[bool] = None
 
 
 @dataclass
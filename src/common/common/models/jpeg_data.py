@@ -3,8 +3,32 @@ JPEG data classes
 '''
 
 from dataclasses import dataclass
+from typing import List, Optional
 from json_to_models.dynamic_typing import IsoTimeString
 
+
+@dataclass
+class JpegEncoding:
+    '''How a JPEG, or WebP, was encoded'''
+    format: str
+    # None when an embedded preview was used as is.
+    quality: Optional[int] = None
+    optimize: bool = False
+    progressive: bool = False
+    subsampling: Optional[str] = None
+
+
+@dataclass
+class JpegRendition:
+    '''One size of a JPEG'''
+    name: str
+    s3_object_key: str
+    width: int
+    height: int
+    size: int
+    encoding: Optional[JpegEncoding] = None
+
+
 @dataclass
 class JpegData:
     '''JPEG data'''
@@ -14,6 +38,14 @@ class JpegData:
     expiration_date_time: IsoTimeString
     original_s3_bucket: str
     original_s3_object_key: str
+    # CreateJpegFromRaw render profile the JPEG was made with.
+    render_profile: Optional[str] = None
+    # Whether the RAW image was decoded at half size, which the memory budget may force on a
+    # full size profile. None when the embedded preview was used.
+    half_size: Optional[bool] = None
+    encoding: Optional[JpegEncoding] = None
+    # Every size made when more than one is configured, largest first.
+    renditions: Optional[List[JpegRendition]] = None
 
 
 @dataclass
@@ -0,0 +1,144 @@
+'''AWS client utilities'''
+
+import logging
+import threading
+
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import TYPE_CHECKING, Callable, Dict, Optional, TypeVar
+
+import boto3
+from botocore.exceptions import ClientError
+
+if TYPE_CHECKING:
+    # Type stubs are only installed for development.
+    from mypy_boto3_s3 import S3Client
+    from mypy_boto3_sts import STSClient
+
+# Role chaining (function role -> cross account role) caps sessions at 1hr.
+ROLE_CHAINING_MAX_DURATION_SECONDS = 3600
+CREDENTIALS_REFRESH_MARGIN = timedelta(minutes=5)
+# Error codes of credentials that are no longer accepted, eg. a session revoked before it expired.
+CREDENTIALS_ERROR_CODES = ('ExpiredToken', 'InvalidAccessKeyId', 'InvalidToken')
+
+_logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+
+def is_credentials_error(error: ClientError) -> bool:
+    '''
+    Return whether an error may be down to credentials no longer being accepted.
+
+    HeadObject errors, eg. from download_fileobj(), have no body so carry only the status. Those
+    that could be a credentials error count.
+    '''
+    code = error.response.get('Error', {}).get('Code')
+    if error.operation_name == 'HeadObject':
+        return code in ('400', '403')
+    return code in CREDENTIALS_ERROR_CODES
+
+
+@dataclass
+class _CachedClient:
+    '''An S3 client and when its credentials expire'''
+    client: 'S3Client'
+    expiration: datetime
+
+
+class CrossAccountS3ClientProvider:
+    '''
+    Provide S3 clients using assumed cross account role credentials.
+
+    Clients are kept for the life of the function instance and rebuilt shortly before their
+    credentials expire, so warm invocations skip both the STS round trip and client
+    construction. A role can be configured per source bucket with a default for the rest.
+    '''
+
+    def __init__(
+            self,
+            role_session_name: str,
+            default_role_arn: Optional[str] = None,
+            bucket_role_arns: Optional[Dict[str, str]] = None,
+            duration_seconds: int = ROLE_CHAINING_MAX_DURATION_SECONDS,
+            refresh_margin: timedelta = CREDENTIALS_REFRESH_MARGIN
+    ) -> None:
+        self._role_session_name = role_session_name
+        self._default_role_arn = default_role_arn
+        self._bucket_role_arns = bucket_role_arns or {}
+        self._duration_seconds = min(duration_seconds, ROLE_CHAINING_MAX_DURATION_SECONDS)
+        self._refresh_margin = refresh_margin
+
+        # Sessions are not thread safe so clients are only ever created under the lock.
+        self._session = boto3.session.Session()
+        self._sts_client: Optional['STSClient'] = None
+        self._clients: Dict[str, _CachedClient] = {}
+        self._lock = threading.Lock()
+
+    def get_role_arn(self, s3_bucket: Optional[str] = None) -> str:
+        '''Return the role to assume for a bucket'''
+        role_arn = self._bucket_role_arns.get(s3_bucket or '', self._default_role_arn)
+        if not role_arn:
+            raise ValueError('No cross account IAM role for bucket: {}'.format(s3_bucket))
+        return role_arn
+
+    def get_client(self, s3_bucket: Optional[str] = None) -> 'S3Client':
+        '''Return an S3 client able to read from the bucket'''
+        role_arn = self.get_role_arn(s3_bucket)
+
+        with self._lock:
+            cached = self._clients.get(role_arn)
+            if cached is None or self._needs_refresh(cached):
+                cached = self._assume_role(role_arn)
+                self._clients[role_arn] = cached
+
+        return cached.client
+
+    def invalidate(self, s3_bucket: Optional[str] = None) -> None:
+        '''Drop the cached client for a bucket, eg. after an ExpiredToken error'''
+        with self._lock:
+            self._clients.pop(self.get_role_arn(s3_bucket), None)
+
+    def retry_credentials_error(self, s3_bucket: Optional[str], func: Callable[[], T]) -> T:
+        '''
+        Return func(), which gets its client for the bucket from here.
+
+        Should the cached client's credentials be rejected before they're due to expire, eg.
+        the session was revoked, the client is dropped and func() called once more.
+        '''
+        try:
+            return func()
+        except ClientError as e:
+            if not is_credentials_error(e):
+                raise
+            _logger.warning('Retrying with new credentials for {}: {}'.format(s3_bucket, e))
+            self.invalidate(s3_bucket)
+        return func()
+
+    def _needs_refresh(self, cached: _CachedClient) -> bool:
+        '''Return whether credentials are expired or about to expire'''
+        return datetime.now(timezone.utc) + self._refresh_margin >= cached.expiration
+
+    def _assume_role(self, role_arn: str) -> _CachedClient:
+        '''Assume role and build an S3 client with its credentials'''
+        if self._sts_client is None:
+            self._sts_client = self._session.client('sts')
+
+        credentials = self._sts_client.assume_role(
+            RoleArn=role_arn,
+            RoleSessionName=self._role_session_name,
+            DurationSeconds=self._duration_seconds
+        ).get('Credentials', {})
+
+        s3_client: 'S3Client' = self._session.client(
+            's3',
+            aws_access_key_id=credentials['AccessKeyId'],
+            aws_secret_access_key=credentials['SecretAccessKey'],
+            aws_session_token=credentials['SessionToken']
+        )
+
+        expiration = credentials['Expiration']
+        if expiration.tzinfo is None:
+            expiration = expiration.replace(tzinfo=timezone.utc)
+
+        return _CachedClient(s3_client, expiration)
@@ -0,0 +1,171 @@
+'''Caching utilities'''
+
+import json
+import logging
+import threading
+import time
+import zlib
+
+from collections import OrderedDict
+from datetime import timedelta
+from typing import TYPE_CHECKING, Any, Callable, Hashable, Optional
+
+import boto3
+
+from botocore.exceptions import BotoCoreError, ClientError
+
+if TYPE_CHECKING:
+    # Type stubs are only installed for development.
+    from mypy_boto3_dynamodb import DynamoDBClient
+
+_logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+class LruCache:
+    '''Thread safe, size bounded, least recently used cache'''
+
+    def __init__(self, maxsize: int = 128) -> None:
+        self._maxsize = maxsize
+        self._data: 'OrderedDict[Hashable, Any]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._data
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        '''Return a cached value and mark it recently used'''
+        with self._lock:
+            if key not in self._data:
+                return default
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def put(self, key: Hashable, value: Any) -> None:
+        '''Cache a value evicting the least recently used entry when full'''
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self._maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key: Hashable) -> None:
+        '''Remove a cached value if there is one'''
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        '''Empty the cache'''
+        with self._lock:
+            self._data.clear()
+
+
+class TtlLruCache(LruCache):
+    '''
+    LruCache whose entries also expire a fixed time after they're put.
+
+    Expired entries are dropped when next read, or evicted as least recently used.
+    '''
+
+    def __init__(
+            self,
+            maxsize: int = 128,
+            ttl: timedelta = timedelta(minutes=5),
+            clock: Callable[[], float] = time.monotonic
+    ) -> None:
+        super().__init__(maxsize)
+        self._ttl_seconds = ttl.total_seconds()
+        self._clock = clock
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        '''Return a cached value that hasn't expired and mark it recently used'''
+        entry = super().get(key, _MISSING)
+        if entry is _MISSING:
+            return default
+
+        expires_at, value = entry
+        if self._clock() >= expires_at:
+            self.delete(key)
+            return default
+        return value
+
+    def put(self, key: Hashable, value: Any) -> None:
+        '''Cache a value until the TTL passes'''
+        super().put(key, (self._clock() + self._ttl_seconds, value))
+
+
+class DdbCache:
+    '''
+    JSON value cache in a DynamoDB table with an in-process LRU in front.
+
+    Values are stored zlib compressed in a binary attribute. Without a table name only the
+    in-process cache is used. DDB errors are logged and treated as a miss so the cache can never
+    fail the caller.
+    '''
+
+    def __init__(
+            self,
+            table_name: Optional[str] = None,
+            maxsize: int = 128,
+            ttl: Optional[timedelta] = None,
+            ddb_client: Optional['DynamoDBClient'] = None
+    ) -> None:
+        self._table_name = table_name
+        self._ttl = ttl
+        self._ddb_client = ddb_client
+        self._local = LruCache(maxsize)
+
+    @property
+    def ddb_client(self) -> 'DynamoDBClient':
+        '''DDB client, created on first use'''
+        if self._ddb_client is None:
+            self._ddb_client = boto3.client('dynamodb')
+        return self._ddb_client
+
+    def get(self, key: str) -> Optional[Any]:
+        '''Return a cached value or None'''
+        value = self._local.get(key)
+        if value is not None or not self._table_name:
+            return value
+
+        try:
+            r = self.ddb_client.get_item(
+                TableName=self._table_name,
+                Key={'pk': {'S': key}}
+            )
+        except (BotoCoreError, ClientError) as e:
+            _logger.warning('Cache get failed: {}'.format(e))
+            return None
+
+        item = r.get('Item')
+        if item is None:
+            return None
+
+        value = json.loads(zlib.decompress(item['value']['B']))
+        self._local.put(key, value)
+        return value
+
+    def put(self, key: str, value: Any) -> None:
+        '''Cache a JSON serializable value'''
+        self._local.put(key, value)
+        if not self._table_name:
+            return
+
+        item = {
+            'pk': {'S': key},
+            'value': {'B': zlib.compress(json.dumps(value).encode('utf-8'))}
+        }
+        if self._ttl is not None:
+            item['ttl'] = {'N': str(int(time.time() + self._ttl.total_seconds()))}
+
+        try:
+            self.ddb_client.put_item(TableName=self._table_name, Item=item)
+        except (BotoCoreError, ClientError) as e:
+            _logger.warning('Cache put failed: {}'.format(e))
@@ -0,0 +1,158 @@
+'''
+Claim check transport for large pipeline payloads
+
+A large item body is put in a store and replaced on the bus by a small summary plus a pointer
+to the body. Consumers that only need summary fields never fetch the body; the rest call
+resolve_claim_check() to get the full item back. Stores are looked up by the pointer's URI
+scheme so a store other than S3 can be registered.
+'''
+
+import hashlib
+import json
+import logging
+
+from abc import ABC, abstractmethod
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterable, Optional, Tuple
+from urllib.parse import urlparse
+
+import boto3
+
+if TYPE_CHECKING:
+    # Type stubs are only installed for development.
+    from mypy_boto3_s3 import S3Client
+
+from .dataclasses import to_json_bytes
+
+_logger = logging.getLogger(__name__)
+
+CLAIM_CHECK_ATTR = 'claim_check'
+# EventBridge bills in 64KB chunks. Items over half that are checked in.
+CLAIM_CHECK_THRESHOLD_BYTES = 32 * 1024
+# Attributes every consumer can rely on without fetching the body.
+CLAIM_CHECK_SUMMARY_ATTRS = ('pk', 'sk', 'file')
+
+
+class ClaimCheckStore(ABC):
+    '''Store for claim checked bodies'''
+    scheme: str = ''
+
+    @abstractmethod
+    def put(self, body: bytes) -> str:
+        '''Store a body and return its URI'''
+
+    @abstractmethod
+    def get(self, uri: str) -> bytes:
+        '''Return a stored body'''
+
+
+class S3ClaimCheckStore(ClaimCheckStore):
+    '''
+    Claim check store in an S3 bucket.
+
+    Bodies are keyed by content digest so a retried stage overwrites rather than duplicates
+    its body. Expire old bodies with a bucket lifecycle rule.
+    '''
+    scheme = 's3'
+
+    def __init__(
+            self,
+            s3_bucket: Optional[str] = None,
+            prefix: str = 'claim-check/',
+            s3_client: Optional['S3Client'] = None
+    ) -> None:
+        self._s3_bucket = s3_bucket
+        self._prefix = prefix
+        self._s3_client = s3_client
+
+    @property
+    def s3_client(self) -> 'S3Client':
+        '''S3 client, created on first use'''
+        if self._s3_client is None:
+            self._s3_client = boto3.client('s3')
+        return self._s3_client
+
+    def put(self, body: bytes) -> str:
+        if not self._s3_bucket:
+            raise ValueError('No claim check bucket configured')
+
+        key = '{}{}.json'.format(self._prefix, hashlib.sha256(body).hexdigest())
+        self.s3_client.put_object(
+            Bucket=self._s3_bucket,
+            Key=key,
+            Body=body,
+            ContentType='application/json'
+        )
+        return 's3://{}/{}'.format(self._s3_bucket, key)
+
+    def get(self, uri: str) -> bytes:
+        parsed = urlparse(uri)
+        r = self.s3_client.get_object(Bucket=parsed.netloc, Key=parsed.path.lstrip('/'))
+        return r['Body'].read()
+
+
+_STORE_FACTORIES: Dict[str, Callable[[], ClaimCheckStore]] = {
+    S3ClaimCheckStore.scheme: S3ClaimCheckStore,
+}
+_STORES: Dict[str, ClaimCheckStore] = {}
+
+
+def register_claim_check_store(scheme: str, factory: Callable[[], ClaimCheckStore]) -> None:
+    '''Register the store used to resolve pointers with a URI scheme'''
+    _STORE_FACTORIES[scheme] = factory
+    _STORES.pop(scheme, None)
+
+
+def _get_store(uri: str) -> ClaimCheckStore:
+    '''Return the store for a pointer'''
+    scheme = urlparse(uri).scheme
+    if scheme not in _STORES:
+        if scheme not in _STORE_FACTORIES:
+            raise ValueError('No claim check store for URI: {}'.format(uri))
+        _STORES[scheme] = _STORE_FACTORIES[scheme]()
+    return _STORES[scheme]
+
+
+def is_claim_checked(item: Dict[str, Any]) -> bool:
+    '''Return whether an item is a summary with a pointer to its body'''
+    return CLAIM_CHECK_ATTR in item
+
+
+def check_in(
+        item: Dict[str, Any],
+        store: Optional[ClaimCheckStore],
+        threshold: int = CLAIM_CHECK_THRESHOLD_BYTES,
+        summary_attrs: Iterable[str] = CLAIM_CHECK_SUMMARY_ATTRS
+) -> Dict[str, Any]:
+    '''
+    Return the item, or a summary and pointer if its body is over threshold.
+
+    Without a store the item is always returned as is.
+    '''
+    if store is None:
+        return item
+
+    body = to_json_bytes(item)
+    if len(body) <= threshold:
+        return item
+
+    uri = store.put(body)
+    _logger.debug('Claim checked {} bytes: {}'.format(len(body), uri))
+
+    summary = {_k: item[_k] for _k in summary_attrs if _k in item}
+    summary[CLAIM_CHECK_ATTR] = {'uri': uri, 'size': len(body)}
+    return summary
+
+
+def split_claim_check(item: Dict[str, Any]) -> Tuple[Dict[str, Any], Optional[Dict[str, Any]]]:
+    '''Return an item's summary attributes and its pointer, if any'''
+    summary = {_k: _v for _k, _v in item.items() if _k != CLAIM_CHECK_ATTR}
+    return summary, item.get(CLAIM_CHECK_ATTR)
+
+
+def resolve_claim_check(item: Dict[str, Any]) -> Dict[str, Any]:
+    '''Return the full item, fetching the body if the item was claim checked'''
+    if not is_claim_checked(item):
+        return item
+
+    uri = item[CLAIM_CHECK_ATTR]['uri']
+    return json.loads(_get_store(uri).get(uri))
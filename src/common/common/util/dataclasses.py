@@ -1,9 +1,100 @@
+import json
+
 from aws_lambda_powertools.middleware_factory import lambda_handler_decorator
 from aws_lambda_powertools.utilities.typing import LambdaContext
-from dataclasses import asdict
-from typing import Any, Callable, Dict
+from dataclasses import fields
+from functools import lru_cache
+from typing import Any, Callable, Dict, Tuple
+
+# Values returned as is by to_dict().
+_SCALAR_TYPES = frozenset([str, int, float, bool, type(None)])
+
 
 @lambda_handler_decorator
-def lambda_dataclass_response(handler: Callable[..., Any], event: Dict[str, Any], context: LambdaContext) -> Dict[str, Any]:
+def lambda_dataclass_response(
+        handler: Callable[..., Any],
+        event: Dict[str, Any],
+        context: LambdaContext,
+        skip_none: bool = False
+) -> Dict[str, Any]:
     response = handler(event, context)
-    return asdict(response)
\ No newline at end of file
+    return to_dict(response, skip_none)
+
+
+@lru_cache(maxsize=None)
+def _field_names(cls: type) -> Tuple[str, ...]:
+    '''Return a dataclass's field names'''
+    return tuple(_f.name for _f in fields(cls))
+
+
+def to_dict(obj: Any, skip_none: bool = False) -> Any:
+    '''
+    Return dataclasses as dicts, recursing through lists, tuples and dicts.
+
+    The result equals asdict() but is built in one pass without deep copying: lists of plain
+    values and other leaves are shared with obj, so treat the result as read only. With
+    skip_none, None valued fields and dict entries are left out.
+    '''
+    cls = type(obj)
+    if cls in _SCALAR_TYPES:
+        return obj
+
+    if hasattr(cls, '__dataclass_fields__') and not isinstance(obj, type):
+        result = {}
+        for _n in _field_names(cls):
+            value = getattr(obj, _n)
+            if value is None:
+                if skip_none:
+                    continue
+                result[_n] = None
+            else:
+                result[_n] = to_dict(value, skip_none)
+        return result
+
+    if isinstance(obj, (list, tuple)):
+        if all(type(_v) in _SCALAR_TYPES for _v in obj):
+            return obj
+        return cls(to_dict(_v, skip_none) for _v in obj)
+
+    if isinstance(obj, dict):
+        return {
+            _k: to_dict(_v, skip_none) for _k, _v in obj.items() if not (skip_none and _v is None)
+        }
+
+    return obj
+
+
+def to_json(obj: Any, skip_none: bool = False) -> str:
+    '''Return dataclasses as compact JSON'''
+    return json.dumps(to_dict(obj, skip_none), separators=(',', ':'))
+
+
+def to_json_bytes(obj: Any, skip_none: bool = False) -> bytes:
+    '''Return dataclasses as compact UTF-8 encoded JSON'''
+    return to_json(obj, skip_none).encode('utf-8')
+
+
+def add_slots(cls: type, extra_slots: Tuple[str, ...] = ()) -> type:
+    '''
+    Return a copy of a dataclass that stores its fields in __slots__.
+
+    Instances then have no per instance __dict__. Python 3.10's dataclass(slots=True) does
+    the same but we run on 3.8. Apply directly above @dataclass. extra_slots adds slots for
+    non field attributes such as caches.
+    '''
+    if '__slots__' in cls.__dict__:
+        raise TypeError('{} already specifies __slots__'.format(cls.__name__))
+
+    cls_dict = dict(cls.__dict__)
+    field_names = tuple(_f.name for _f in fields(cls))
+    cls_dict['__slots__'] = field_names + tuple(extra_slots)
+    # Class attribute defaults would shadow the slot descriptors. The defaults live on
+    # __init__ so nothing is lost.
+    for _n in field_names:
+        cls_dict.pop(_n, None)
+    cls_dict.pop('__dict__', None)
+    cls_dict.pop('__weakref__', None)
+
+    slotted_cls = type(cls)(cls.__name__, cls.__bases__, cls_dict)
+    slotted_cls.__qualname__ = cls.__qualname__
+    return slotted_cls
@@ -0,0 +1,115 @@
+'''
+DynamoDB attribute value marshalling
+
+Items arrive as parsed JSON. Rather than round trip them through JSON again to turn floats into
+Decimals and then have the boto3 resource layer's TypeSerializer walk them a second time, they
+are turned into low level attribute values in a single pass for use with the DDB client.
+unmarshal_item() goes the other way, giving numbers back as int or float rather than Decimal.
+'''
+
+import hashlib
+import json
+import math
+
+from decimal import Decimal
+from typing import Any, Dict, Tuple
+
+# Attribute holding a digest of the rest of the item so unchanged items need not be rewritten.
+CONTENT_DIGEST_ATTR = 'content_digest'
+
+
+def _marshal_number(value: Any) -> Dict[str, str]:
+    '''Return a number attribute value'''
+    if isinstance(value, float):
+        if not math.isfinite(value):
+            raise TypeError('Infinity and NaN not supported: {}'.format(value))
+        # The shortest repr round trips and is what json.dumps() wrote before. Exponents are
+        # written upper case as Decimal does, eg. 1E-05.
+        return {'N': repr(value).upper()}
+
+    if isinstance(value, Decimal) and not value.is_finite():
+        raise TypeError('Infinity and NaN not supported: {}'.format(value))
+    return {'N': str(value)}
+
+
+def marshal_value(value: Any) -> Dict[str, Any]:
+    '''Return the DDB attribute value of a JSON type value'''
+    # Exact type checks first; they cover everything json.loads() returns.
+    value_type = type(value)
+    if value_type is str:
+        return {'S': value}
+    if value_type is dict:
+        return {'M': {_k: marshal_value(_v) for _k, _v in value.items()}}
+    if value_type is list or value_type is tuple:
+        return {'L': [marshal_value(_v) for _v in value]}
+    if value is None:
+        return {'NULL': True}
+    # bool is an int subclass so must come before numbers.
+    if value_type is bool:
+        return {'BOOL': value}
+    if value_type is int or value_type is float or value_type is Decimal:
+        return _marshal_number(value)
+    if value_type is bytes or value_type is bytearray:
+        return {'B': bytes(value)}
+
+    # Subclasses, eg. an IntEnum or a str Enum.
+    if isinstance(value, str):
+        return {'S': str(value)}
+    if isinstance(value, bool):
+        return {'BOOL': bool(value)}
+    if isinstance(value, (int, float, Decimal)):
+        return _marshal_number(value)
+
+    raise TypeError('Unsupported type "{}" for value "{}"'.format(value_type, value))
+
+
+def marshal_item(item: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    '''Return an item as DDB attribute values'''
+    return {_k: marshal_value(_v) for _k, _v in item.items()}
+
+
+def _unmarshal_number(value: str) -> Any:
+    '''Return a number attribute value as an int or float, as parsed JSON would have it'''
+    if '.' in value or 'E' in value or 'e' in value:
+        return float(value)
+    return int(value)
+
+
+def unmarshal_value(value: Dict[str, Any]) -> Any:
+    '''Return the JSON type value of a DDB attribute value'''
+    (attr_type, attr_value), = value.items()
+    if attr_type == 'S':
+        return attr_value
+    if attr_type == 'N':
+        return _unmarshal_number(attr_value)
+    if attr_type == 'M':
+        return {_k: unmarshal_value(_v) for _k, _v in attr_value.items()}
+    if attr_type == 'L':
+        return [unmarshal_value(_v) for _v in attr_value]
+    if attr_type == 'NULL':
+        return None
+    if attr_type in ('BOOL', 'B'):
+        return attr_value
+    if attr_type == 'SS' or attr_type == 'BS':
+        return set(attr_value)
+    if attr_type == 'NS':
+        return {_unmarshal_number(_v) for _v in attr_value}
+
+    raise TypeError('Unsupported DDB type "{}"'.format(attr_type))
+
+
+def unmarshal_item(item: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+    '''Return an item of DDB attribute values as JSON type values'''
+    return {_k: unmarshal_value(_v) for _k, _v in item.items()}
+
+
+def get_marshalled_key(item: Dict[str, Dict[str, Any]]) -> Tuple[str, str]:
+    '''Return the pk and sk of a marshalled item'''
+    return item['pk']['S'], item['sk']['S']
+
+
+def get_content_digest(item: Dict[str, Any]) -> str:
+    '''Return a digest of an item's content, ignoring any digest it already carries'''
+    content = {_k: _v for _k, _v in item.items() if _k != CONTENT_DIGEST_ATTR}
+    body = json.dumps(content, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(body.encode('utf-8')).hexdigest()
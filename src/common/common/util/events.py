@@ -0,0 +1,119 @@
+'''
+Publish function results to EventBridge
+
+A Lambda OnSuccess destination only sees asynchronous invocations, so a function reading an SQS
+queue has its response dropped. Batch handlers publish each item themselves as an event shaped
+like the destination's invocation record, so the rules that route single record results route
+them the same way.
+'''
+
+import json
+import logging
+
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+
+import boto3
+
+from aws_lambda_powertools.utilities.typing import LambdaContext
+
+if TYPE_CHECKING:
+    # Type stubs are only installed for development.
+    from mypy_boto3_events import EventBridgeClient
+
+_logger = logging.getLogger(__name__)
+
+# Source and detail type of a Lambda destination's success event.
+LAMBDA_RESULT_SOURCE = 'lambda'
+LAMBDA_RESULT_SUCCESS_DETAIL_TYPE = 'Lambda Function Invocation Result - Success'
+# Entries allowed in one PutEvents request.
+PUT_EVENTS_MAX_ENTRIES = 10
+
+
+class LambdaResultPublisher:
+    '''Put (item identifier, request payload, response payload) results on an event bus'''
+
+    def __init__(
+            self,
+            event_bus_name: Optional[str],
+            events_client: Optional['EventBridgeClient'] = None
+    ) -> None:
+        self._event_bus_name = event_bus_name
+        self._events_client = events_client
+
+    @property
+    def events_client(self) -> 'EventBridgeClient':
+        '''EventBridge client, created on first use'''
+        if self._events_client is None:
+            self._events_client = boto3.client('events')
+        return self._events_client
+
+    def _get_entry(
+            self,
+            request_payload: Any,
+            response_payload: Any,
+            context: LambdaContext
+    ) -> Dict[str, Any]:
+        '''Return the PutEvents entry for a result'''
+        detail = {
+            'version': '1.0',
+            'requestContext': {
+                'requestId': context.aws_request_id,
+                'functionArn': context.invoked_function_arn,
+                'condition': 'Success',
+                'approximateInvokeCount': 1
+            },
+            'requestPayload': request_payload,
+            'responsePayload': response_payload
+        }
+        return {
+            'EventBusName': self._event_bus_name,
+            'Source': LAMBDA_RESULT_SOURCE,
+            'DetailType': LAMBDA_RESULT_SUCCESS_DETAIL_TYPE,
+            'Resources': [context.invoked_function_arn],
+            'Detail': json.dumps(detail, separators=(',', ':'))
+        }
+
+    def put_results(
+            self,
+            results: List[Tuple[str, Any, Any]],
+            context: LambdaContext
+    ) -> List[str]:
+        '''
+        Publish results and return the identifiers of those that weren't.
+
+        Payloads must already be JSON types. A failed request or entry fails only the results
+        it carried so the caller can report them as batch item failures.
+        '''
+        failed: List[str] = []
+        for _i in range(0, len(results), PUT_EVENTS_MAX_ENTRIES):
+            chunk = results[_i:_i + PUT_EVENTS_MAX_ENTRIES]
+            entries = []
+            for _id, _req, _resp in chunk:
+                try:
+                    entries.append((_id, self._get_entry(_req, _resp, context)))
+                except (TypeError, ValueError) as e:
+                    _logger.error('Failed to serialize result {}: {}'.format(_id, e))
+                    failed.append(_id)
+            if not entries:
+                continue
+
+            try:
+                r = self.events_client.put_events(Entries=[_e for _, _e in entries])
+            except Exception as e:
+                _logger.exception('Failed to put events: {}'.format(e))
+                failed += [_id for _id, _ in entries]
+                continue
+
+            # Response entries are in request order; failed ones carry an ErrorCode.
+            for (_id, _), _r in zip(entries, r['Entries']):
+                if 'ErrorCode' in _r:
+                    _logger.error(
+                        'Failed to put event for {}: {} {}'.format(
+                            _id,
+                            _r['ErrorCode'],
+                            _r.get('ErrorMessage')
+                        )
+                    )
+                    failed.append(_id)
+
+        return failed
@@ -0,0 +1,355 @@
+'''S3 utilities'''
+
+import io
+import logging
+
+from concurrent.futures import Future, ThreadPoolExecutor
+from tempfile import SpooledTemporaryFile, TemporaryFile
+from typing import IO, TYPE_CHECKING, Any, Dict, List, Optional
+
+if TYPE_CHECKING:
+    # Type stubs are only installed for development.
+    from mypy_boto3_s3 import S3Client
+
+_logger = logging.getLogger(__name__)
+
+# Objects up to this size are buffered in memory, larger ones on disk.
+S3_OBJECT_MEMORY_THRESHOLD = 16 * 1024 * 1024
+
+# Large enough to hold the TIFF header, IFD0 and usually the EXIF SubIFD of a RAW file in a
+# single request.
+S3_RANGE_FILE_BLOCK_SIZE = 64 * 1024
+
+# S3 requires every multipart upload part but the last to be at least 5MiB.
+S3_MULTIPART_MIN_PART_SIZE = 5 * 1024 * 1024
+S3_MULTIPART_PART_SIZE = 8 * 1024 * 1024
+
+
+class S3RangeFile(io.RawIOBase):
+    '''
+    Read-only, seekable file object backed by S3 byte-range GETs.
+
+    Nothing is downloaded up front. Reads are served from fixed size blocks and missing blocks
+    are fetched on demand, so a parser that seeks through IFD, SubIFD and MakerNote offsets only
+    transfers the byte spans it actually touches rather than the whole object.
+    '''
+
+    def __init__(
+            self,
+            s3_client: 'S3Client',
+            s3_bucket: str,
+            s3_object_key: str,
+            object_size: Optional[int] = None,
+            block_size: int = S3_RANGE_FILE_BLOCK_SIZE
+    ) -> None:
+        super().__init__()
+        self._s3_client = s3_client
+        self._s3_bucket = s3_bucket
+        self._s3_object_key = s3_object_key
+        self._block_size = block_size
+        self._blocks: Dict[int, bytes] = {}
+        self._position = 0
+
+        if object_size is None:
+            object_size = s3_client.head_object(
+                Bucket=s3_bucket,
+                Key=s3_object_key
+            )['ContentLength']
+        self._size = object_size
+
+        # Counters so callers can see what the range reads saved them.
+        self.range_requests = 0
+        self.bytes_fetched = 0
+
+    @property
+    def size(self) -> int:
+        '''Object size'''
+        return self._size
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self._position + offset
+        elif whence == io.SEEK_END:
+            position = self._size + offset
+        else:
+            raise ValueError('Invalid whence: {}'.format(whence))
+
+        if position < 0:
+            raise ValueError('Negative seek position: {}'.format(position))
+
+        self._position = position
+        return self._position
+
+    def read(self, size: Optional[int] = -1) -> bytes:
+        if size is None or size < 0:
+            size = self._size - self._position
+
+        start = self._position
+        end = min(start + size, self._size)
+        if start >= end:
+            return b''
+
+        data = self._read_range(start, end)
+        self._position = end
+        return data
+
+    def readall(self) -> bytes:
+        return self.read()
+
+    def readinto(self, b) -> int:
+        data = self.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+    def close(self) -> None:
+        self._blocks.clear()
+        super().close()
+
+    def _read_range(self, start: int, end: int) -> bytes:
+        '''Return bytes [start, end) fetching any blocks not yet held.'''
+        first_block = start // self._block_size
+        last_block = (end - 1) // self._block_size
+        self._fetch_blocks(first_block, last_block)
+
+        if first_block == last_block:
+            block_start = first_block * self._block_size
+            return self._blocks[first_block][start - block_start:end - block_start]
+
+        data = b''.join(self._blocks[_b] for _b in range(first_block, last_block + 1))
+        offset = first_block * self._block_size
+        return data[start - offset:end - offset]
+
+    def _fetch_blocks(self, first_block: int, last_block: int) -> None:
+        '''Fetch missing blocks, coalescing adjacent ones into a single range GET.'''
+        run_start = None
+        for _b in range(first_block, last_block + 2):
+            missing = _b <= last_block and _b not in self._blocks
+            if missing and run_start is None:
+                run_start = _b
+            elif not missing and run_start is not None:
+                self._fetch_block_run(run_start, _b - 1)
+                run_start = None
+
+    def _fetch_block_run(self, first_block: int, last_block: int) -> None:
+        '''Fetch a contiguous run of blocks'''
+        range_start = first_block * self._block_size
+        range_end = min((last_block + 1) * self._block_size, self._size) - 1
+        r = self._s3_client.get_object(
+            Bucket=self._s3_bucket,
+            Key=self._s3_object_key,
+            Range='bytes={}-{}'.format(range_start, range_end)
+        )
+        data = r['Body'].read()
+        self.range_requests += 1
+        self.bytes_fetched += len(data)
+
+        for _b in range(first_block, last_block + 1):
+            offset = (_b - first_block) * self._block_size
+            self._blocks[_b] = data[offset:offset + self._block_size]
+
+
+class S3MultipartWriter(io.RawIOBase):
+    '''
+    Write-only file object streaming to an S3 object with a multipart upload.
+
+    Writes are collected into parts and each full part is uploaded on a background thread while
+    the caller keeps writing, so producing the bytes and uploading them overlap. At most
+    max_workers parts are in flight; further writes wait rather than buffer without bound. An
+    object smaller than one part is sent with a single PutObject instead.
+
+    The upload is completed by close(). Leaving a with block on an exception, calling abort() or
+    dropping the writer unclosed aborts it so no parts are left behind and a partial object is
+    never written.
+    '''
+
+    def __init__(
+            self,
+            s3_client: 'S3Client',
+            s3_bucket: str,
+            s3_object_key: str,
+            part_size: int = S3_MULTIPART_PART_SIZE,
+            max_workers: int = 4,
+            extra_args: Optional[Dict[str, Any]] = None
+    ) -> None:
+        super().__init__()
+        if part_size < S3_MULTIPART_MIN_PART_SIZE:
+            raise ValueError('Part size below S3 minimum: {}'.format(part_size))
+
+        self._s3_client = s3_client
+        self._s3_bucket = s3_bucket
+        self._s3_object_key = s3_object_key
+        self._part_size = part_size
+        self._max_workers = max_workers
+        self._extra_args = extra_args or {}
+
+        self._buffer = bytearray()
+        self._upload_id: Optional[str] = None
+        self._parts: List[Future] = []
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+        # Bytes written and the PutObject or CompleteMultipartUpload response once closed.
+        self.size = 0
+        self.response: Optional[Dict[str, Any]] = None
+
+    def writable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self.size
+
+    def write(self, b) -> int:
+        if self.closed:
+            raise ValueError('I/O operation on closed file.')
+
+        data = bytes(b)
+        self._buffer += data
+        self.size += len(data)
+
+        while len(self._buffer) >= self._part_size:
+            part = bytes(self._buffer[:self._part_size])
+            del self._buffer[:self._part_size]
+            self._upload_part(part)
+
+        return len(data)
+
+    def close(self) -> None:
+        if self.closed:
+            return
+
+        try:
+            if self._upload_id is None:
+                self.response = self._s3_client.put_object(
+                    Bucket=self._s3_bucket,
+                    Key=self._s3_object_key,
+                    Body=bytes(self._buffer),
+                    **self._extra_args
+                )
+            else:
+                if self._buffer:
+                    self._upload_part(bytes(self._buffer))
+                parts = [_p.result() for _p in self._parts]
+                self.response = self._s3_client.complete_multipart_upload(
+                    Bucket=self._s3_bucket,
+                    Key=self._s3_object_key,
+                    UploadId=self._upload_id,
+                    MultipartUpload={'Parts': parts}
+                )
+        except Exception:
+            self.abort()
+            raise
+        finally:
+            self._shutdown()
+
+    def abort(self) -> None:
+        '''Abort the upload and discard anything written'''
+        if self._upload_id is not None:
+            for _p in self._parts:
+                _p.cancel()
+            self._shutdown()
+            self._s3_client.abort_multipart_upload(
+                Bucket=self._s3_bucket,
+                Key=self._s3_object_key,
+                UploadId=self._upload_id
+            )
+            self._upload_id = None
+        self._shutdown()
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if exc_type is not None:
+            self.abort()
+        else:
+            self.close()
+
+    def __del__(self) -> None:
+        # IOBase's finalizer calls close(), which would complete the upload with whatever had
+        # been written when the writer was dropped, eg. on an error outside a with block.
+        if self.closed:
+            return
+        try:
+            self.abort()
+        except Exception as e:
+            _logger.warning('Failed to abort upload of {}: {}'.format(self._s3_object_key, e))
+
+    def _shutdown(self) -> None:
+        '''Stop the upload threads and mark the file closed'''
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        self._buffer = bytearray()
+        super().close()
+
+    def _upload_part(self, data: bytes) -> None:
+        '''Start uploading the next part, waiting if too many are in flight'''
+        if self._upload_id is None:
+            self._upload_id = self._s3_client.create_multipart_upload(
+                Bucket=self._s3_bucket,
+                Key=self._s3_object_key,
+                **self._extra_args
+            )['UploadId']
+            self._executor = ThreadPoolExecutor(max_workers=self._max_workers)
+
+        if len(self._parts) >= self._max_workers:
+            self._parts[-self._max_workers].result()
+
+        # Upload threads mustn't hold the writer, or the last reference to an unclosed writer
+        # could be dropped, and __del__ run, on one of them.
+        part_number = len(self._parts) + 1
+        self._parts.append(self._executor.submit(
+            self._put_part,
+            self._s3_client,
+            self._s3_bucket,
+            self._s3_object_key,
+            self._upload_id,
+            part_number,
+            data
+        ))
+
+    @staticmethod
+    def _put_part(
+            s3_client: 'S3Client',
+            s3_bucket: str,
+            s3_object_key: str,
+            upload_id: str,
+            part_number: int,
+            data: bytes
+    ) -> Dict[str, Any]:
+        '''Upload one part'''
+        r = s3_client.upload_part(
+            Bucket=s3_bucket,
+            Key=s3_object_key,
+            UploadId=upload_id,
+            PartNumber=part_number,
+            Body=data
+        )
+        return {'ETag': r['ETag'], 'PartNumber': part_number}
+
+
+def make_object_buffer(
+        object_size: Optional[int] = None,
+        memory_threshold: int = S3_OBJECT_MEMORY_THRESHOLD
+) -> IO[bytes]:
+    '''
+    Return a buffer sized for an object.
+
+    Objects known to fit under the threshold get a RAM backed buffer and ones known to be larger
+    go straight to disk. When the size isn't known, eg. an encoder's output, the buffer starts in
+    memory and only spools to disk if it outgrows the threshold.
+    '''
+    if object_size is None:
+        return SpooledTemporaryFile(max_size=memory_threshold, mode='wb+')
+
+    if object_size <= memory_threshold:
+        return io.BytesIO()
+
+    return TemporaryFile('wb+')
@@ -3,24 +3,41 @@ import io
 import json
 import logging
 import os
+import resource
 
-from dataclasses import asdict, dataclass
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, replace
 from datetime import datetime, timedelta
-from tempfile import NamedTemporaryFile, TemporaryFile
-from typing import Any, Dict, IO
+from typing import Any, Callable, Dict, IO, List, Optional, Tuple
 
 import boto3
-import imageio
+import numpy as np
 import rawpy
 
+from PIL import Image
+
 from aws_lambda_powertools.utilities.typing import LambdaContext
 from mypy_boto3_s3 import S3Client
 from mypy_boto3_s3.type_defs import PutObjectOutputTypeDef
-from mypy_boto3_sts import STSClient
 
 
-from common.models import JpegData, JpegDataItem, PutDdbItemAction
-from common.util.dataclasses import lambda_dataclass_response
+from common.models import (
+    JpegData,
+    JpegDataItem,
+    JpegEncoding,
+    JpegRendition,
+    LazyExifData,
+    PutDdbItemAction
+)
+from common.util.aws import CrossAccountS3ClientProvider
+from common.util.dataclasses import lambda_dataclass_response, to_dict, to_json
+from common.util.events import LambdaResultPublisher
+from common.util.s3 import (
+    S3_MULTIPART_PART_SIZE,
+    S3_OBJECT_MEMORY_THRESHOLD,
+    S3MultipartWriter,
+    make_object_buffer
+)
 
 log_level = os.environ.get('LOG_LEVEL', 'INFO')
 logging.root.setLevel(logging.getLevelName(log_level))
@@ -30,10 +47,151 @@ S3_CLIENT: S3Client = boto3.client("s3")
 S3_EXPIRATION_DELTA_DAYS = 15
 
 CROSS_ACCOUNT_IAM_ROLE_ARN = os.environ.get('CROSS_ACCOUNT_IAM_ROLE_ARN', '')
+# JSON object of source bucket name to role ARN for buckets needing their own role.
+CROSS_ACCOUNT_IAM_ROLE_ARNS = json.loads(os.environ.get('CROSS_ACCOUNT_IAM_ROLE_ARNS', '{}'))
+S3_CLIENT_PROVIDER = CrossAccountS3ClientProvider(
+    'CreateJpegFromRaw',
+    CROSS_ACCOUNT_IAM_ROLE_ARN,
+    CROSS_ACCOUNT_IAM_ROLE_ARNS
+)
+
+# batch_handler() puts each item on this bus as the OnSuccess destination would.
+EVENT_PUBLISHER = LambdaResultPublisher(os.environ.get('EVENT_BUS_NAME'))
 
 PHOTOOPS_S3_BUCKET = os.environ['PHOTOOPS_S3_BUCKET']
 PHOTOOPS_IMAGE_CACHE_PREFIX = 'cache'
 
+# Objects at or below this size are buffered in memory instead of on /tmp.
+OBJECT_MEMORY_THRESHOLD_BYTES = int(
+    os.environ.get('OBJECT_MEMORY_THRESHOLD_BYTES', S3_OBJECT_MEMORY_THRESHOLD)
+)
+
+# Stream encoded JPEGs to S3 with a multipart upload instead of buffering each one first.
+STREAMING_UPLOAD = os.environ.get('STREAMING_UPLOAD', 'false').lower() == 'true'
+STREAMING_UPLOAD_PART_SIZE = int(os.environ.get('STREAMING_UPLOAD_PART_SIZE', S3_MULTIPART_PART_SIZE))
+
+# Use the JPEG preview embedded in the RAW file when it's large enough instead of a full demosaic.
+EMBEDDED_PREVIEW = os.environ.get('EMBEDDED_PREVIEW', 'false').lower() == 'true'
+# Long edge in pixels of the JPEG to create. 0 is the RAW image's full size.
+JPEG_LONG_EDGE = int(os.environ.get('JPEG_LONG_EDGE', 0))
+
+# Named rawpy postprocess() settings. JPEG holds 8 bits per sample so every profile renders 8
+# bits; 16 bits would only be thrown away when encoding. standard is LibRaw's defaults.
+RENDER_PROFILES: Dict[str, Dict[str, Any]] = {
+    # Screen sized caches. Half size skips demosaicing, about a quarter of the work and memory.
+    'preview': {
+        'half_size': True,
+        'demosaic_algorithm': rawpy.DemosaicAlgorithm.LINEAR,
+        'output_bps': 8,
+        'fbdd_noise_reduction': rawpy.FBDDNoiseReductionMode.Off,
+        'highlight_mode': rawpy.HighlightMode.Clip,
+    },
+    'standard': {
+        'half_size': False,
+        'demosaic_algorithm': rawpy.DemosaicAlgorithm.AHD,
+        'output_bps': 8,
+        'fbdd_noise_reduction': rawpy.FBDDNoiseReductionMode.Off,
+        'highlight_mode': rawpy.HighlightMode.Clip,
+    },
+    'archival': {
+        'half_size': False,
+        'demosaic_algorithm': rawpy.DemosaicAlgorithm.AHD,
+        'output_bps': 8,
+        'fbdd_noise_reduction': rawpy.FBDDNoiseReductionMode.Full,
+        'highlight_mode': rawpy.HighlightMode.Blend,
+    },
+}
+# Profile used when an event doesn't name one.
+RENDER_PROFILE = os.environ.get('RENDER_PROFILE', 'standard')
+
+FULL_RENDITION = 'full'
+
+
+@dataclass
+class Rendition:
+    '''One size of JPEG made from the decode and what its encoding aims for'''
+    name: str
+    long_edge: int
+    # None takes ENCODE_TARGET_BYTES, scaled to the rendition's size, and ENCODE_TARGET_SSIM.
+    target_bytes: Optional[int] = None
+    target_ssim: Optional[float] = None
+
+
+def _parse_renditions(renditions: str) -> List[Rendition]:
+    '''Return renditions from name:long_edge[:target_bytes[:target_ssim]],... largest first'''
+    parsed = []
+    for _r in renditions.split(','):
+        name, long_edge, target_bytes, target_ssim = (_r.strip().split(':') + ['', ''])[:4]
+        parsed.append(
+            Rendition(
+                name=name,
+                long_edge=int(long_edge),
+                target_bytes=int(target_bytes) if target_bytes else None,
+                target_ssim=float(target_ssim) if target_ssim else None
+            )
+        )
+
+    # 0 is full size so sorts first.
+    return sorted(parsed, key=lambda _r: -_r.long_edge if _r.long_edge else float('-inf'))
+
+
+# Comma separated name:long_edge[:target_bytes[:target_ssim]] JPEG renditions made from one
+# decode, eg. full:0,screen:2048:1000000,grid:512::0.95,thumbnail:256. A long edge of 0 is
+# full size. Targets are as ENCODE_TARGET_BYTES and ENCODE_TARGET_SSIM, for that rendition.
+RENDITIONS = _parse_renditions(os.environ.get('RENDITIONS', '{}:0'.format(FULL_RENDITION)))
+
+# Encoder settings. The defaults encode a baseline JPEG at quality 100 as we always have.
+# IMAGE_FORMAT is JPEG or WEBP.
+IMAGE_FORMAT = os.environ.get('IMAGE_FORMAT', 'JPEG').upper()
+IMAGE_QUALITY = int(os.environ.get('IMAGE_QUALITY', 100))
+# Optimized Huffman tables are a few percent smaller for a little more encoding time.
+JPEG_OPTIMIZE = os.environ.get('JPEG_OPTIMIZE', 'false').lower() == 'true'
+JPEG_PROGRESSIVE = os.environ.get('JPEG_PROGRESSIVE', 'false').lower() == 'true'
+# Chroma subsampling, 4:4:4, 4:2:2 or 4:2:0. Unset is the encoder's default.
+JPEG_SUBSAMPLING = os.environ.get('JPEG_SUBSAMPLING') or None
+ENCODING = JpegEncoding(
+    format=IMAGE_FORMAT,
+    quality=IMAGE_QUALITY,
+    optimize=JPEG_OPTIMIZE,
+    progressive=JPEG_PROGRESSIVE,
+    subsampling=JPEG_SUBSAMPLING
+)
+IMAGE_EXTENSIONS = {'JPEG': 'jpg', 'WEBP': 'webp'}
+
+# Search for the highest quality whose output is at most ENCODE_TARGET_BYTES and the lowest
+# whose SSIM to the unencoded image is at least ENCODE_TARGET_SSIM. The byte target wins if
+# they disagree. 0 turns a target off. IMAGE_QUALITY is the highest quality searched. These are
+# the defaults for renditions that don't set their own. The byte target is for the largest
+# rendition and is scaled by pixels for smaller ones, which would otherwise always fit it.
+ENCODE_TARGET_BYTES = int(os.environ.get('ENCODE_TARGET_BYTES', 0))
+ENCODE_TARGET_SSIM = float(os.environ.get('ENCODE_TARGET_SSIM', 0))
+ENCODE_MIN_QUALITY = int(os.environ.get('ENCODE_MIN_QUALITY', 30))
+# The search encodes a probe of this many tiles of this size rather than the image itself.
+ENCODE_PROBE_TILES = 4
+ENCODE_PROBE_TILE_SIZE = int(os.environ.get('ENCODE_PROBE_TILE_SIZE', 256))
+
+# Memory conversion should stay under. Defaults to 80% of the function's memory, leaving the rest
+# for the runtime. 0 turns memory planning off.
+MEMORY_BUDGET_BYTES = int(
+    os.environ.get(
+        'MEMORY_BUDGET_BYTES',
+        int(os.environ.get('AWS_LAMBDA_FUNCTION_MEMORY_SIZE', 0)) * 1024 * 1024 * 4 // 5
+    )
+)
+
+# Bytes per pixel of what's held while converting. See _predict_peak_bytes().
+_RAW_BYTES_PER_PIXEL = 2        # LibRaw's unpacked 16 bit sensor data
+_WORKING_BYTES_PER_PIXEL = 8    # LibRaw's 16 bit, 4 channel working image
+_RGB_BYTES_PER_PIXEL = 3        # postprocess() 8 bit RGB output
+_PIL_BYTES_PER_PIXEL = 4        # PIL stores RGB as 32 bit pixels
+
+# LibRaw flip values to the PIL transpose that applies them.
+_FLIP_TRANSPOSE = {
+    3: Image.ROTATE_180,
+    5: Image.ROTATE_90,
+    6: Image.ROTATE_270,
+}
+
 
 @dataclass
 class Response(PutDdbItemAction):
@@ -41,52 +199,425 @@ class Response(PutDdbItemAction):
     Item: JpegDataItem
 
 
-def _convert_raw_to_jpeg(raw_fileobj: IO[Any]) -> IO[Any]:
-    '''convert a RAW image to a JPEG'''
+@dataclass
+class MemoryPlan:
+    '''How to convert a RAW image and the peak memory that's predicted to take'''
+    half_size: bool
+    predicted_peak_bytes: int
+
+
+@dataclass
+class BatchResponse:
+    '''Batch function response'''
+    batchItemFailures: List[Dict[str, str]]
+
+
+def _get_render_profile(name: Optional[str]) -> str:
+    '''Return a render profile name, defaulting to RENDER_PROFILE'''
+    name = name or RENDER_PROFILE
+    if name not in RENDER_PROFILES:
+        raise ValueError('Unknown render profile: {}'.format(name))
+    return name
+
+
+def _get_peak_rss_bytes() -> int:
+    '''Return the process's peak resident set size'''
+    # ru_maxrss is in kilobytes on Linux.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+# What the runtime and libraries take before any conversion.
+BASE_RSS_BYTES = _get_peak_rss_bytes()
+
+
+def _predict_peak_bytes(
+        width: int,
+        height: int,
+        raw_file_bytes: int,
+        half_size: bool,
+        raw_file_in_memory: bool
+    ) -> int:
+    '''
+    Return the predicted peak memory of converting a RAW image.
+
+    Buffers are freed as soon as they're done with so the peak is the largest of the phases:
+    reading, where rawpy copies the downloaded file and LibRaw unpacks it; demosaicing, where
+    LibRaw holds its working image and the output array; and handing the array to PIL.
+    '''
+    pixels = width * height
+    # Half size decoding builds the working image and output at a quarter of the pixels.
+    output_pixels = pixels // 4 if half_size else pixels
+
+    raw_file = raw_file_bytes * (2 if raw_file_in_memory else 1)
+    unpacked = pixels * _RAW_BYTES_PER_PIXEL + raw_file
+    demosaic = (
+        raw_file_bytes
+        + pixels * _RAW_BYTES_PER_PIXEL
+        + output_pixels * (_WORKING_BYTES_PER_PIXEL + _RGB_BYTES_PER_PIXEL)
+    )
+    encode = output_pixels * (_RGB_BYTES_PER_PIXEL + _PIL_BYTES_PER_PIXEL)
+
+    return BASE_RSS_BYTES + max(unpacked, demosaic, encode)
+
+
+def _plan_memory(
+        width: int,
+        height: int,
+        raw_file_bytes: Optional[int],
+        render_profile: str,
+        raw_file_in_memory: bool = True,
+        prefetched_bytes: int = 0
+    ) -> MemoryPlan:
+    '''
+    Return the first plan predicted to fit MEMORY_BUDGET_BYTES.
+
+    Decoding as the render profile says is tried first, then at half size. If neither fits the
+    half size plan is returned. prefetched_bytes is held alongside the conversion, eg. the next
+    RAW image of a batch downloading into memory, so counts towards the peak.
+    '''
+    if raw_file_bytes is None:
+        # A RAW file is mostly its sensor data.
+        raw_file_bytes = width * height * _RAW_BYTES_PER_PIXEL
+
+    for _half_size in [RENDER_PROFILES[render_profile]['half_size'], True]:
+        plan = MemoryPlan(
+            half_size=_half_size,
+            predicted_peak_bytes=_predict_peak_bytes(
+                width,
+                height,
+                raw_file_bytes,
+                _half_size,
+                raw_file_in_memory
+            ) + prefetched_bytes
+        )
+        if not MEMORY_BUDGET_BYTES or plan.predicted_peak_bytes <= MEMORY_BUDGET_BYTES:
+            return plan
+
+    _logger.warning(
+        'Predicted peak {} bytes is over the {} byte budget'.format(
+            plan.predicted_peak_bytes,
+            MEMORY_BUDGET_BYTES
+        )
+    )
+    return plan
+
+
+def _get_image_size(event: Dict[str, Any]) -> Optional[Tuple[int, int]]:
+    '''Return the full resolution width and height from an event's EXIF data'''
+    if not event.get('exif'):
+        return None
+
+    length, width, _, _ = LazyExifData(**event['exif']).tag_index.get_image_info()
+    if not length or not width:
+        return None
+    return width, length
+
+
+def _get_requested_long_edge(raw: rawpy.RawPy, render_profile: str, long_edge: int = 0) -> int:
+    '''Return the long edge the largest JPEG should have'''
+    if long_edge or JPEG_LONG_EDGE:
+        return long_edge or JPEG_LONG_EDGE
+
+    long_edge = max(raw.sizes.width, raw.sizes.height)
+    if RENDER_PROFILES[render_profile]['half_size']:
+        long_edge = long_edge // 2
+    return long_edge
+
+
+def _resize_image(image: Image.Image, long_edge: int) -> Image.Image:
+    '''Return an image scaled down to a long edge'''
+    if max(image.size) <= long_edge:
+        return image
+
+    scale = long_edge / max(image.size)
+    size = (round(image.width * scale), round(image.height * scale))
+    return image.resize(size, Image.LANCZOS)
+
+
+def _extract_preview(
+        raw: rawpy.RawPy,
+        long_edge: int
+    ) -> Optional[Tuple[Image.Image, Optional[bytes]]]:
+    '''
+    Return the embedded JPEG preview if it's at least the requested size.
+
+    The preview's JPEG data is returned too when it needs neither scaling nor rotating so it can
+    be used without demosaicing or encoding. Returns None when there's no usable preview.
+    '''
+    try:
+        thumb = raw.extract_thumb()
+    except (rawpy.LibRawNoThumbnailError, rawpy.LibRawUnsupportedThumbnailError) as e:
+        _logger.info('No embedded preview: {}'.format(e))
+        return None
+
+    if thumb.format != rawpy.ThumbFormat.JPEG:
+        _logger.info('Embedded preview is not a JPEG: {}'.format(thumb.format))
+        return None
+
+    # Only the JPEG header is read here.
+    preview = Image.open(io.BytesIO(thumb.data))
+    if max(preview.size) < long_edge:
+        _logger.info(
+            'Embedded preview {}x{} is smaller than {}'.format(preview.width, preview.height, long_edge)
+        )
+        return None
+
+    transpose = _FLIP_TRANSPOSE.get(raw.sizes.flip)
+    if max(preview.size) == long_edge and transpose is None:
+        return preview, thumb.data
+
+    image = _resize_image(preview, long_edge)
+    if transpose is not None:
+        image = image.transpose(transpose)
+    return image, None
+
+
+def _decode_raw(
+        raw_fileobj: IO[Any],
+        render_profile: str = 'standard',
+        long_edge: int = 0,
+        plan: Optional[MemoryPlan] = None,
+        prefetched_bytes: int = 0
+    ) -> Tuple[Image.Image, Optional[bytes], Optional[bool]]:
+    '''
+    Return a RAW image decoded once, its JPEG data if it can be used as is and whether it was
+    decoded at half size, None if the embedded preview was used.
+
+    long_edge caps the image size and defaults to JPEG_LONG_EDGE or the RAW image's full size.
+    Without a memory plan one is made from the RAW image's size. raw_fileobj is closed once
+    read and every buffer is released as soon as it's done with.
+    '''
+    raw_fileobj.seek(0, io.SEEK_END)
+    raw_file_bytes = raw_fileobj.tell()
     raw_fileobj.seek(0)
     raw = rawpy.imread(raw_fileobj)
-    rgb = raw.postprocess()
+    # rawpy keeps its own copy of the file.
+    raw_fileobj.close()
+
+    if EMBEDDED_PREVIEW:
+        preview = _extract_preview(raw, _get_requested_long_edge(raw, render_profile, long_edge))
+        if preview is not None:
+            raw.close()
+            return (*preview, None)
+
+    if plan is None:
+        plan = _plan_memory(
+            raw.sizes.width,
+            raw.sizes.height,
+            raw_file_bytes,
+            render_profile,
+            isinstance(raw_fileobj, io.BytesIO),
+            prefetched_bytes
+        )
+        _logger.info('Memory plan: {}'.format(plan))
+    if plan.half_size and not RENDER_PROFILES[render_profile]['half_size']:
+        _logger.warning('Decoding at half size to stay within the memory budget')
+
+    rgb = raw.postprocess(**{**RENDER_PROFILES[render_profile], 'half_size': plan.half_size})
+    raw.close()
+    image = Image.fromarray(rgb)
+    del rgb
+
+    if long_edge or JPEG_LONG_EDGE:
+        image = _resize_image(image, long_edge or JPEG_LONG_EDGE)
+
+    return image, None, plan.half_size
+
+
+def _get_save_kwargs(encoding: JpegEncoding) -> Dict[str, Any]:
+    '''Return PIL save() arguments for an encoding'''
+    if encoding.format == 'WEBP':
+        return {'format': 'WEBP', 'quality': encoding.quality}
+
+    kwargs = {
+        'format': 'JPEG',
+        'quality': encoding.quality,
+        'optimize': encoding.optimize,
+        'progressive': encoding.progressive,
+    }
+    if encoding.subsampling is not None:
+        kwargs['subsampling'] = encoding.subsampling
+    return kwargs
+
+
+def _get_ssim(x: np.ndarray, y: np.ndarray, block_size: int = 8) -> float:
+    '''Return the mean SSIM of two greyscale images over non overlapping blocks'''
+    c1 = (0.01 * 255) ** 2
+    c2 = (0.03 * 255) ** 2
+
+    height = x.shape[0] // block_size * block_size
+    width = x.shape[1] // block_size * block_size
+    shape = (height // block_size, block_size, width // block_size, block_size)
+    x = x[:height, :width].reshape(shape)
+    y = y[:height, :width].reshape(shape)
+
+    mean_x = x.mean(axis=(1, 3))
+    mean_y = y.mean(axis=(1, 3))
+    var_x = x.var(axis=(1, 3))
+    var_y = y.var(axis=(1, 3))
+    covariance = (x * y).mean(axis=(1, 3)) - mean_x * mean_y
+
+    ssim = (
+        ((2 * mean_x * mean_y + c1) * (2 * covariance + c2))
+        / ((mean_x ** 2 + mean_y ** 2 + c1) * (var_x + var_y + c2))
+    )
+    return float(ssim.mean())
+
+
+def _make_probe(image: Image.Image) -> Image.Image:
+    '''
+    Return tiles from across an image at full resolution, side by side.
+
+    A scaled down copy would average away the detail and noise that cost bytes and show
+    artifacts, so it predicts too small a size and too good an SSIM. Tiles from the middle of
+    each quadrant keep both. Tiles are aligned to JPEG's 16 pixel MCUs so the seams between them
+    don't cost extra.
+    '''
+    tile_size = ENCODE_PROBE_TILE_SIZE
+    if image.width < 2 * tile_size or image.height < 2 * tile_size:
+        return image.convert('RGB')
+
+    probe = Image.new('RGB', (tile_size * ENCODE_PROBE_TILES, tile_size))
+    for _i, (_x, _y) in enumerate([(1, 1), (3, 1), (1, 3), (3, 3)]):
+        left = (image.width * _x // 4 - tile_size // 2) // 16 * 16
+        top = (image.height * _y // 4 - tile_size // 2) // 16 * 16
+        tile = image.crop((left, top, left + tile_size, top + tile_size))
+        probe.paste(tile, (_i * tile_size, 0))
+    return probe
+
+
+def _search_quality(
+        image: Image.Image,
+        encoding: JpegEncoding,
+        target_bytes: int,
+        target_ssim: float
+    ) -> int:
+    '''
+    Return the quality meeting a byte and an SSIM target.
+
+    Each step encodes a small probe of the image. Its size is scaled up by the difference in
+    pixels to estimate the image's.
+    '''
+    probe = _make_probe(image)
+    scale = (image.width * image.height) / (probe.width * probe.height)
+    reference = np.asarray(probe.convert('L'), dtype=np.float64)
+
+    def encode(quality: int) -> io.BytesIO:
+        probe_file = io.BytesIO()
+        probe.save(probe_file, **_get_save_kwargs(replace(encoding, quality=quality)))
+        return probe_file
+
+    def fits(quality: int) -> bool:
+        return encode(quality).tell() * scale <= target_bytes
+
+    def looks_right(quality: int) -> bool:
+        decoded = Image.open(encode(quality)).convert('L')
+        return _get_ssim(reference, np.asarray(decoded, dtype=np.float64)) >= target_ssim
+
+    def search(accept: Callable[[int], bool], highest: bool) -> Optional[int]:
+        '''Return the highest or lowest accepted quality, qualities accepted being a run'''
+        low, high = ENCODE_MIN_QUALITY, encoding.quality
+        found = None
+        while low <= high:
+            quality = (low + high) // 2
+            if accept(quality):
+                found = quality
+                if highest:
+                    low = quality + 1
+                else:
+                    high = quality - 1
+            elif highest:
+                high = quality - 1
+            else:
+                low = quality + 1
+        return found
+
+    quality = encoding.quality
+    if target_ssim:
+        quality = search(looks_right, highest=False) or encoding.quality
+    if target_bytes:
+        quality = min(quality, search(fits, highest=True) or ENCODE_MIN_QUALITY)
+    return quality
+
+
+def _get_encoding(
+        image: Image.Image,
+        target_bytes: int = 0,
+        target_ssim: float = 0
+    ) -> JpegEncoding:
+    '''Return how to encode an image, searching for its quality if there's a target'''
+    if not target_bytes and not target_ssim:
+        return ENCODING
+    return replace(ENCODING, quality=_search_quality(image, ENCODING, target_bytes, target_ssim))
+
+
+def _has_encode_targets() -> bool:
+    '''Return whether any rendition searches for its quality'''
+    return bool(
+        ENCODE_TARGET_BYTES or ENCODE_TARGET_SSIM
+        or any(_r.target_bytes or _r.target_ssim for _r in RENDITIONS)
+    )
 
-    image_tmp_file = TemporaryFile('wb+')
-    imageio.imwrite(image_tmp_file, rgb, format='JPEG-PIL', quality=100)
-    image_tmp_file.seek(0)
 
-    return image_tmp_file
+def _get_encode_targets(rendition: Rendition, pixels: int, largest: int) -> Tuple[int, float]:
+    '''Return a rendition's byte and SSIM targets given its pixels and the largest rendition's'''
+    target_bytes = rendition.target_bytes
+    if target_bytes is None:
+        target_bytes = ENCODE_TARGET_BYTES * pixels // largest
+    target_ssim = ENCODE_TARGET_SSIM if rendition.target_ssim is None else rendition.target_ssim
+    return target_bytes, target_ssim
 
 
-def _get_cross_account_s3_client() -> S3Client:
-    '''Return an S3 Client with cross account credentials.'''
-    sts_client: STSClient = boto3.client('sts')
-    cross_account_credentials = sts_client.assume_role(
-        RoleArn=CROSS_ACCOUNT_IAM_ROLE_ARN,
-        RoleSessionName=str('CreateJpegFromRaw'),
-    ).get('Credentials', {})
-    s3_client_cross_account: S3Client = boto3.client(
-        "s3",
-        aws_access_key_id=cross_account_credentials['AccessKeyId'],
-        aws_secret_access_key=cross_account_credentials['SecretAccessKey'],
-        aws_session_token=cross_account_credentials['SessionToken']
-    )
+def _write_jpeg(
+        image_file: IO[Any],
+        image: Image.Image,
+        jpeg_data: Optional[bytes] = None,
+        encoding: JpegEncoding = ENCODING
+    ) -> None:
+    '''Write an image encoded as given, or its existing JPEG data if given'''
+    if jpeg_data is not None:
+        image_file.write(jpeg_data)
+    else:
+        image.save(image_file, **_get_save_kwargs(encoding))
+
 
-    return s3_client_cross_account
+def _encode_jpeg(
+        image: Image.Image,
+        jpeg_data: Optional[bytes] = None,
+        encoding: JpegEncoding = ENCODING
+    ) -> IO[Any]:
+    '''Return an image encoded as given, or its existing JPEG data if given'''
+    # Output size isn't known until encoded so this spools to disk only if it has to.
+    image_file = make_object_buffer(None, OBJECT_MEMORY_THRESHOLD_BYTES)
+    _write_jpeg(image_file, image, jpeg_data, encoding)
+    image_file.seek(0)
 
+    return image_file
 
-def _get_s3_object(s3_bucket: str, s3_object_key: str) -> IO[Any]:
+
+def _convert_raw_to_jpeg(raw_fileobj: IO[Any], render_profile: str = 'standard') -> IO[Any]:
+    '''convert a RAW image to a JPEG'''
+    image, jpeg_bytes, _ = _decode_raw(raw_fileobj, render_profile)
+    return _encode_jpeg(image, jpeg_bytes)
+
+
+def _get_cross_account_s3_client(s3_bucket: str) -> S3Client:
+    '''Return an S3 Client with cross account credentials.'''
+    return S3_CLIENT_PROVIDER.get_client(s3_bucket)
+
+
+def _get_s3_object(s3_bucket: str, s3_object_key: str, object_size: Optional[int] = None) -> IO[Any]:
     '''Get S3 object'''
-    # Role chaining has a limit of 1hr which is shorter than the possible
-    # time of a function instance so have to do this here.
-    #
-    # TODO: investigate acquring outside and a refresh mechanism.
-    s3_client_cross_account = _get_cross_account_s3_client()
-
-    s3_object = NamedTemporaryFile('wb+')
-    s3_client_cross_account.download_fileobj(
-        Bucket=s3_bucket,
-        Key=s3_object_key,
-        Fileobj=s3_object
-    )
+    def download() -> IO[Any]:
+        s3_object = make_object_buffer(object_size, OBJECT_MEMORY_THRESHOLD_BYTES)
+        _get_cross_account_s3_client(s3_bucket).download_fileobj(
+            Bucket=s3_bucket,
+            Key=s3_object_key,
+            Fileobj=s3_object
+        )
+        return s3_object
 
-    return s3_object
+    return S3_CLIENT_PROVIDER.retry_credentials_error(s3_bucket, download)
 
 
 def _put_s3_object(
@@ -108,54 +639,286 @@ def _put_s3_object(
     return r
 
 
-def _create_jpeg(s3_bucket: str, s3_object_key: str) -> JpegData:
-    '''Create JPEG image'''
+def _upload_jpeg(
+        image: Image.Image,
+        jpeg_data: Optional[bytes],
+        s3_bucket: str,
+        s3_object_key: str,
+        s3_object_expiration: datetime,
+        target_bytes: int = 0,
+        target_ssim: float = 0
+    ) -> Tuple[int, JpegEncoding]:
+    '''Encode and upload an image and return its size and encoding'''
+    if jpeg_data is not None:
+        # The embedded preview's settings aren't known.
+        encoding = JpegEncoding(format='JPEG')
+    else:
+        encoding = _get_encoding(image, target_bytes, target_ssim)
+
+    if STREAMING_UPLOAD:
+        # Parts upload as the encoder produces them instead of after it finishes.
+        with S3MultipartWriter(
+            S3_CLIENT,
+            s3_bucket,
+            s3_object_key,
+            part_size=STREAMING_UPLOAD_PART_SIZE,
+            extra_args={'Expires': s3_object_expiration}
+        ) as writer:
+            _write_jpeg(writer, image, jpeg_data, encoding)
+        return writer.size, encoding
+
+    jpeg_image = _encode_jpeg(image, jpeg_data, encoding)
+    jpeg_image.seek(0, io.SEEK_END)
+    size = jpeg_image.tell()
+    _put_s3_object(s3_bucket, s3_object_key, jpeg_image, s3_object_expiration)
+
+    return size, encoding
+
+
+def _get_rendition_key(s3_bucket: str, s3_object_key: str, name: str) -> str:
+    '''Return the cache key of a rendition'''
+    key = '/'.join([PHOTOOPS_IMAGE_CACHE_PREFIX, s3_bucket, s3_object_key])
+    extension = IMAGE_EXTENSIONS[ENCODING.format]
+    if name == FULL_RENDITION:
+        return '{}.{}'.format(key, extension)
+    return '{}.{}.{}'.format(key, name, extension)
+
+
+def _create_jpeg(
+        s3_bucket: str,
+        s3_object_key: str,
+        object_size: Optional[int] = None,
+        render_profile: str = 'standard',
+        raw_image: Optional[IO[Any]] = None,
+        image_size: Optional[Tuple[int, int]] = None,
+        prefetched_bytes: int = 0
+    ) -> JpegData:
+    '''
+    Create JPEG images.
+
+    The RAW image is decoded once and each rendition is scaled down from the one before it.
+    Renditions are encoded and uploaded while the next is scaled. The RAW image is downloaded
+    unless already given. Given the image's width and height, memory is planned before the
+    download rather than once the RAW image is read. prefetched_bytes is memory held by a
+    download running alongside.
+    '''
 
     original_s3_bucket = s3_bucket
     original_s3_object_key = s3_object_key
     cache_s3_bucket = PHOTOOPS_S3_BUCKET
-    cache_s3_object_key = '/'.join([PHOTOOPS_IMAGE_CACHE_PREFIX, s3_bucket, s3_object_key]) + '.jpg'
     expiration = datetime.utcnow() + timedelta(days=S3_EXPIRATION_DELTA_DAYS)
 
-    raw_image = _get_s3_object(s3_bucket, s3_object_key)
-    jpeg_image = _convert_raw_to_jpeg(raw_image)
-    _put_s3_object(cache_s3_bucket, cache_s3_object_key, jpeg_image, expiration)
+    # A full size rendition means decoding at full size, otherwise the largest rendition will do.
+    long_edges = [_r.long_edge for _r in RENDITIONS]
+    long_edge = 0 if 0 in long_edges else max(long_edges)
+
+    plan = None
+    if image_size is not None:
+        if raw_image is None:
+            raw_file_in_memory = object_size is not None and object_size <= OBJECT_MEMORY_THRESHOLD_BYTES
+        else:
+            raw_file_in_memory = isinstance(raw_image, io.BytesIO)
+        plan = _plan_memory(
+            *image_size,
+            object_size,
+            render_profile,
+            raw_file_in_memory,
+            prefetched_bytes
+        )
+
+    if raw_image is None:
+        raw_image = _get_s3_object(s3_bucket, s3_object_key, object_size)
+    image, jpeg_bytes, half_size = _decode_raw(
+        raw_image,
+        render_profile,
+        long_edge,
+        plan,
+        prefetched_bytes
+    )
+    # The embedded preview is only used as is when encoding as we always have.
+    if ENCODING != JpegEncoding(format='JPEG', quality=100) or _has_encode_targets():
+        jpeg_bytes = None
+
+    largest_pixels = image.width * image.height
+    renditions = []
+    with ThreadPoolExecutor(max_workers=len(RENDITIONS)) as executor:
+        uploads = []
+        for _r in RENDITIONS:
+            if _r.long_edge and max(image.size) > _r.long_edge:
+                image = _resize_image(image, _r.long_edge)
+                jpeg_bytes = None
+            if jpeg_bytes is None:
+                # Decode before other threads read the image.
+                image.load()
+
+            cache_s3_object_key = _get_rendition_key(s3_bucket, s3_object_key, _r.name)
+            uploads.append(
+                executor.submit(
+                    _upload_jpeg,
+                    image,
+                    jpeg_bytes,
+                    cache_s3_bucket,
+                    cache_s3_object_key,
+                    expiration,
+                    *_get_encode_targets(_r, image.width * image.height, largest_pixels)
+                )
+            )
+            renditions.append(
+                {
+                    'name': _r.name,
+                    's3_object_key': cache_s3_object_key,
+                    'width': image.width,
+                    'height': image.height
+                }
+            )
+
+        # Raise any upload error.
+        for _r, _u in zip(renditions, uploads):
+            _r['size'], _r['encoding'] = _u.result()
+        renditions = [JpegRendition(**_r) for _r in renditions]
+
+    # Peak RSS is for the life of the process so a warm start may report an earlier peak.
+    _logger.info(
+        'Memory peak predicted {} bytes, actual {} bytes, budget {} bytes'.format(
+            None if plan is None else plan.predicted_peak_bytes,
+            _get_peak_rss_bytes(),
+            MEMORY_BUDGET_BYTES
+        )
+    )
 
     jpeg_data = JpegData(
         **{
             's3_bucket': cache_s3_bucket,
-            's3_object_key': cache_s3_object_key,
+            's3_object_key': renditions[0].s3_object_key,
             'original_s3_bucket': original_s3_bucket,
             'original_s3_object_key': original_s3_object_key,
             'expiration_date_time': str(expiration),
-            'size': jpeg_image.tell()
+            'size': renditions[0].size,
+            'render_profile': render_profile,
+            'half_size': half_size,
+            'encoding': renditions[0].encoding,
+            # A single full size JPEG is described by the item itself.
+            'renditions': renditions if len(renditions) > 1 else None
         }
     )
 
     return jpeg_data
 
 
-@lambda_dataclass_response
-def handler(event: Dict[str, Any], context: LambdaContext) -> Response:
-    '''Function entry'''
-    _logger.debug('Event: {}'.format(json.dumps(event)))
+def _get_raw_image(event: Dict[str, Any]) -> IO[Any]:
+    '''Download the RAW image of an event'''
+    s3_bucket, s3_object_key = event.get('pk', '').split('#')
+    object_size = (event.get('file') or {}).get('object_size')
+    return _get_s3_object(s3_bucket, s3_object_key, object_size)
+
+
+def _get_buffered_bytes(event: Dict[str, Any]) -> int:
+    '''Return the memory an event's RAW image takes once downloaded'''
+    object_size = (event.get('file') or {}).get('object_size')
+    if object_size is None:
+        # Spooled to disk once over the threshold.
+        return OBJECT_MEMORY_THRESHOLD_BYTES
+    return object_size if object_size <= OBJECT_MEMORY_THRESHOLD_BYTES else 0
 
+
+def _get_jpeg_data_item(
+        event: Dict[str, Any],
+        raw_image: Optional[IO[Any]] = None,
+        prefetched_bytes: int = 0
+    ) -> Dict[str, Any]:
+    '''Return the JPEG data item for an event'''
     pk = event.get('pk', '')
     sk = 'jpeg#v0'
     s3_bucket, s3_object_key = pk.split('#')
+    object_size = (event.get('file') or {}).get('object_size')
+    render_profile = _get_render_profile(event.get('render_profile'))
+
+    jpeg_data = _create_jpeg(
+        s3_bucket,
+        s3_object_key,
+        object_size,
+        render_profile,
+        raw_image,
+        _get_image_size(event),
+        prefetched_bytes
+    )
 
-    jpeg_data = _create_jpeg(s3_bucket, s3_object_key)
+    return {
+        'pk': pk,
+        'sk': sk,
+        **asdict(jpeg_data)
+    }
 
-    response = Response(
-        **{
-            'Item': {
-                'pk': pk,
-                'sk': sk,
-                **asdict(jpeg_data)
-            }
-        }
-    )
-    _logger.debug('Response: {}'.format(json.dumps(asdict(response))))
+
+def _get_batch_records(event: Dict[str, Any]) -> List[Tuple[str, Dict[str, Any]]]:
+    '''
+    Return (item identifier, event) pairs from a batch event.
+
+    Accepts an SQS batch whose bodies are single item events or {'Items': [...]} of them. SQS
+    records are identified by message ID so failures can be reported back to the queue.
+    '''
+    if 'Records' in event:
+        return [(_r['messageId'], json.loads(_r['body'])) for _r in event['Records']]
+    return [(_i.get('pk', ''), _i) for _i in event.get('Items', [])]
+
+
+@lambda_dataclass_response
+def handler(event: Dict[str, Any], context: LambdaContext) -> Response:
+    '''Function entry'''
+    if _logger.isEnabledFor(logging.DEBUG):
+        _logger.debug('Event: {}'.format(json.dumps(event)))
+
+    response = Response(**{'Item': _get_jpeg_data_item(event)})
+
+    if _logger.isEnabledFor(logging.DEBUG):
+        _logger.debug('Response: {}'.format(to_json(response)))
 
     return response
 
+
+@lambda_dataclass_response
+def batch_handler(event: Dict[str, Any], context: LambdaContext) -> BatchResponse:
+    '''
+    Batch function entry
+
+    The next record's RAW image downloads while the current one is converted so a batch takes
+    about as long as its slowest stage rather than the sum of them. The memory that download
+    takes is left out of the current conversion's budget.
+
+    An SQS event source mapping only reads batchItemFailures from the response so each item is
+    put on the event bus as handler()'s OnSuccess destination would put it.
+    '''
+    if _logger.isEnabledFor(logging.DEBUG):
+        _logger.debug('Event: {}'.format(json.dumps(event)))
+
+    records = _get_batch_records(event)
+    results: List[Tuple[str, Dict[str, Any], Dict[str, Any]]] = []
+    failed: List[str] = []
+
+    with ThreadPoolExecutor(max_workers=1) as prefetcher:
+        downloads = [prefetcher.submit(_get_raw_image, records[0][1])] if records else []
+        for _i, (_id, _e) in enumerate(records):
+            prefetched_bytes = 0
+            if _i + 1 < len(records):
+                downloads.append(prefetcher.submit(_get_raw_image, records[_i + 1][1]))
+                prefetched_bytes = _get_buffered_bytes(records[_i + 1][1])
+
+            try:
+                raw_image = downloads[_i].result()
+                try:
+                    item = _get_jpeg_data_item(_e, raw_image, prefetched_bytes)
+                finally:
+                    raw_image.close()
+                results.append((_id, _e, to_dict(Response(**{'Item': item}))))
+            except Exception as e:
+                _logger.exception('Failed to process record {}: {}'.format(_id, e))
+                failed.append(_id)
+
+    failed += EVENT_PUBLISHER.put_results(results, context)
+    failures = [{'itemIdentifier': _id} for _id in failed]
+    response = BatchResponse(**{'batchItemFailures': failures})
+
+    if _logger.isEnabledFor(logging.DEBUG):
+        _logger.debug('Response: {}'.format(to_json(response)))
+
+    return response
@@ -4,13 +4,15 @@ import json
 import logging
 import os
 
-from dataclasses import asdict, dataclass
-from typing import Any, Dict, Optional, cast
+from dataclasses import dataclass
+from typing import Any, Dict
 
 from aws_lambda_powertools.utilities.typing import LambdaContext
 
-from common.models import CameraExifData, CameraExifDataItem, ExifDataItem, Ifd, PutDdbItemAction
-from common.util.dataclasses import lambda_dataclass_response
+from common.facets import get_exif_camera_data
+from common.models import CameraExifDataItem, LazyExifDataItem, PutDdbItemAction
+from common.util.claim_check import resolve_claim_check
+from common.util.dataclasses import lambda_dataclass_response, to_json
 
 # FIXME: Replace with powertools logger
 log_level = os.environ.get('LOG_LEVEL', 'INFO')
@@ -24,30 +26,16 @@ class Response(PutDdbItemAction):
     Item: CameraExifDataItem
 
 
-def _get_exif_camera_data(exif_data: ExifDataItem) -> CameraExifData:
-    '''Return normalized camera data'''
-
-    ifd0 = cast(Ifd, exif_data.exif.ifd0)
-
-    camera_data = {
-            'make': ifd0.make,
-            'model': ifd0.model,
-            'software': ifd0.software,
-            'serial_number': None if ifd0.maker_note is None else ifd0.maker_note.serial_number
-        }
-
-    return CameraExifData(**camera_data)
-
-
 @lambda_dataclass_response
 def handler(event: Dict[str, Any], context: LambdaContext) -> Response:
     '''Function entry'''
-    _logger.debug('Event: {}'.format(json.dumps(event)))
+    if _logger.isEnabledFor(logging.DEBUG):
+        _logger.debug('Event: {}'.format(json.dumps(event)))
 
     pk = event.get('pk')
     sk = 'camera#v0'
-    exif_data = ExifDataItem(**event)
-    camera_data = _get_exif_camera_data(exif_data)
+    exif_data = LazyExifDataItem(**resolve_claim_check(event))
+    camera_data = get_exif_camera_data(exif_data)
     print(camera_data.__dict__)
     camera_data_item = CameraExifDataItem(
         **{
@@ -59,6 +47,7 @@ def handler(event: Dict[str, Any], context: LambdaContext) -> Response:
 
     response = Response(**{'Item': camera_data_item})
 
-    _logger.debug('Response: {}'.format(json.dumps(asdict(response))))
+    if _logger.isEnabledFor(logging.DEBUG):
+        _logger.debug('Response: {}'.format(to_json(response)))
 
     return response
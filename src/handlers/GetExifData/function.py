@@ -4,15 +4,16 @@
 #
 # ref. https://aws.amazon.com/blogs/aws/introducing-amazon-s3-object-lambda-use-your-code-to-process-data-as-it-is-being-retrieved-from-s3/
 
+import inspect
 import json
 import logging
 import os
 
-from dataclasses import asdict, dataclass
-from tempfile import TemporaryFile
-from typing import Any, Dict, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import timedelta
+from typing import IO, Any, Dict, List, Optional, Tuple, Union
 
-import boto3
 import exifread
 import filetype
 
@@ -20,10 +21,20 @@ from aws_lambda_powertools.utilities.data_classes import S3Event
 from aws_lambda_powertools.utilities.typing import LambdaContext
 from botocore.exceptions import ParamValidationError
 from mypy_boto3_s3 import S3Client
-from mypy_boto3_sts import STSClient
 
-from common.models import ExifDataItem, FileData, PutDdbItemAction, make_exif_data_dataclass
-from common.util.dataclasses import lambda_dataclass_response
+from common.models import (
+    ExifDataItem,
+    FileData,
+    PutDdbItemAction,
+    get_exif_profile,
+    make_exif_data_dataclass
+)
+from common.util.aws import CrossAccountS3ClientProvider
+from common.util.cache import DdbCache
+from common.util.claim_check import CLAIM_CHECK_THRESHOLD_BYTES, S3ClaimCheckStore, check_in
+from common.util.dataclasses import lambda_dataclass_response, to_dict, to_json
+from common.util.events import LambdaResultPublisher
+from common.util.s3 import S3_OBJECT_MEMORY_THRESHOLD, S3RangeFile, make_object_buffer
 
 # FIXME: Replace with powertools logger
 log_level = os.environ.get('LOG_LEVEL', 'INFO')
@@ -31,61 +42,101 @@ logging.root.setLevel(logging.getLevelName(log_level))
 _logger = logging.getLogger(__name__)
 
 CROSS_ACCOUNT_IAM_ROLE_ARN = os.environ.get('CROSS_ACCOUNT_IAM_ROLE_ARN')
+# JSON object of source bucket name to role ARN for buckets needing their own role.
+CROSS_ACCOUNT_IAM_ROLE_ARNS = json.loads(os.environ.get('CROSS_ACCOUNT_IAM_ROLE_ARNS', '{}'))
+S3_CLIENT_PROVIDER = CrossAccountS3ClientProvider(
+    'GetExifData',
+    CROSS_ACCOUNT_IAM_ROLE_ARN,
+    CROSS_ACCOUNT_IAM_ROLE_ARNS
+)
+
+# Comma separated consumer profiles (camera, lens, location, image, file) whose tags are kept.
+# The default keeps everything less the undecoded MakerNote bytes.
+EXIF_PROFILE = get_exif_profile(os.environ.get('EXIF_PROFILES', 'full').split(','))
+# Whether the parser can be told not to decode MakerNotes. Profiles are otherwise applied to
+# what it returns, so only save building models, not parsing.
+EXIF_PARSER_DETAILED_OPTION = 'detailed' in inspect.signature(exifread.ExifHeader).parameters
+
+# Bump when a change to parsing or the EXIF model changes the output for the same bytes.
+EXIF_PARSER_VERSION = '{}-v0'.format(getattr(exifread, '__version__', 'unknown'))
+EXIF_CACHE = DdbCache(
+    os.environ.get('EXIF_CACHE_TABLE_NAME'),
+    maxsize=int(os.environ.get('EXIF_CACHE_LOCAL_SIZE', 32)),
+    ttl=timedelta(days=int(os.environ.get('EXIF_CACHE_TTL_DAYS', 30)))
+)
+
+# Records processed concurrently by batch_handler(). Work is mostly waiting on S3.
+EXIF_BATCH_MAX_WORKERS = int(os.environ.get('EXIF_BATCH_MAX_WORKERS', 4))
+# batch_handler() puts each item on this bus as the OnSuccess destination would.
+EVENT_PUBLISHER = LambdaResultPublisher(os.environ.get('EVENT_BUS_NAME'))
+
+# Read only the byte ranges the EXIF parser needs instead of downloading the whole object.
+EXIF_RANGE_READ_ENABLED = os.environ.get('EXIF_RANGE_READ_ENABLED', 'true').lower() == 'true'
+# Downloads at or below this size are buffered in memory instead of on /tmp.
+OBJECT_MEMORY_THRESHOLD_BYTES = int(
+    os.environ.get('OBJECT_MEMORY_THRESHOLD_BYTES', S3_OBJECT_MEMORY_THRESHOLD)
+)
+
+# Items over the threshold are put in the claim check bucket and only a summary and pointer
+# are returned. Unset to always return the full item.
+CLAIM_CHECK_BUCKET = os.environ.get('CLAIM_CHECK_BUCKET')
+CLAIM_CHECK_STORE = S3ClaimCheckStore(CLAIM_CHECK_BUCKET) if CLAIM_CHECK_BUCKET else None
+CLAIM_CHECK_THRESHOLD = int(
+    os.environ.get('CLAIM_CHECK_THRESHOLD_BYTES', CLAIM_CHECK_THRESHOLD_BYTES)
+)
+
+# Leave tags the image doesn't have out of the item instead of sending them as null. Most of
+# the ~400 modeled tags are absent from any one image.
+RESPONSE_SKIP_NONE = os.environ.get('RESPONSE_SKIP_NONE', 'false').lower() == 'true'
 
 
 @dataclass
 class Response(PutDdbItemAction):
     '''Function response'''
-    Item: ExifDataItem
+    Item: Union[ExifDataItem, Dict[str, Any]]
+
+
+@dataclass
+class BatchResponse:
+    '''Batch function response'''
+    batchItemFailures: List[Dict[str, str]]
 
 
-def _get_cross_account_s3_client() -> S3Client:
+def _get_cross_account_s3_client(s3_bucket: str) -> S3Client:
     '''Return an S3 Client with cross account credentials.'''
-    sts_client: STSClient = boto3.client('sts')
-    cross_account_credentials = sts_client.assume_role(
-        RoleArn=CROSS_ACCOUNT_IAM_ROLE_ARN,
-        RoleSessionName=str('GetExifData'),
-    ).get('Credentials', {})
-    s3_client_cross_account: S3Client = boto3.client(
-        "s3",
-        aws_access_key_id=cross_account_credentials['AccessKeyId'],
-        aws_secret_access_key=cross_account_credentials['SecretAccessKey'],
-        aws_session_token=cross_account_credentials['SessionToken']
-    )
+    return S3_CLIENT_PROVIDER.get_client(s3_bucket)
 
-    return s3_client_cross_account
 
+def _open_s3_object(s3_bucket: str, s3_object: str, object_size: int) -> IO[Any]:
+    '''Return a file object for the S3 object'''
+    s3_cross_account_client = _get_cross_account_s3_client(s3_bucket)
 
-def _get_exif_data(s3_bucket: str, s3_object: str, object_size: int) -> Tuple[Any, FileData]:
-    '''Get EXIF data from object in S3'''
-    with TemporaryFile('wb+') as image:
-        s3_cross_account_client = _get_cross_account_s3_client()
-        s3_cross_account_client.download_fileobj(s3_bucket, s3_object, image)
-        image.seek(0)
-        ft: filetype.Type = filetype.guess(image)
-        # FIXME: hdr has an open file handle. Will closing it reduce memory
-        # footprint? Should ExifRead close it? Probably not the more I think of it. That
-        # means JPEG handling, which closes it, is broken. Perhaps we delete the object at
-        # end of this clause.
-        image.seek(0)
-        hdr = exifread.ExifHeader(image)
-        exif_data = make_exif_data_dataclass(**hdr.dump_tag_values())
+    if EXIF_RANGE_READ_ENABLED:
+        # The parser follows the IFD, SubIFD and MakerNote offsets itself so only the spans
+        # it seeks to are fetched.
+        return S3RangeFile(s3_cross_account_client, s3_bucket, s3_object, object_size)
 
-    # MakerNote data can be big
-    if exif_data.ifd0 is not None:
-        if exif_data.ifd0.exif_ifd is not None:
-            if exif_data.ifd0.exif_ifd.maker_note is not None:
-                del exif_data.ifd0.exif_ifd.maker_note
+    image = make_object_buffer(object_size, OBJECT_MEMORY_THRESHOLD_BYTES)
+    s3_cross_account_client.download_fileobj(s3_bucket, s3_object, image)
+    image.seek(0)
 
+    return image
 
 
-    if ft.extension == 'tif':
+def _get_file_type(extension: str) -> str:
+    '''Return file type from detected file extension'''
+    if extension == 'tif':
         file_type = 'TIFF'
-    elif ft.extension == 'jpg':
+    elif extension == 'jpg':
         file_type = 'JPEG'
     else:
-        file_type = ft.extension.upper()
+        file_type = extension.upper()
+
+    return file_type
 
+
+def _get_file_data(file_type: str, s3_object: str, object_size: int) -> FileData:
+    '''Return file data'''
     file_name_split = s3_object.split('.')
     if len(file_name_split) == 1:
         extension = None
@@ -113,22 +164,60 @@ def _get_exif_data(s3_bucket: str, s3_object: str, object_size: int) -> Tuple[An
         'is_raw': is_raw,
     })
 
-    return exif_data, file_data
+    return file_data
 
-@lambda_dataclass_response
-def handler(event: Dict[str, Any], context: LambdaContext) -> Response:
-    '''Function entry'''
-    _logger.debug('Event: {}'.format(json.dumps(event)))
 
-    s3_event = S3Event(event)
+def _get_exif_cache_key(etag: Optional[str], object_size: int) -> Optional[str]:
+    '''Return EXIF cache key for an object'''
+    if not etag:
+        return None
+    return '#'.join([etag.strip('"'), str(object_size), EXIF_PARSER_VERSION, EXIF_PROFILE.name])
+
+
+def _get_exif_data(s3_bucket: str, s3_object: str, object_size: int) -> Tuple[Any, FileData]:
+    '''Get EXIF data from object in S3'''
+    with _open_s3_object(s3_bucket, s3_object, object_size) as image:
+        ft: filetype.Type = filetype.guess(image)
+        # FIXME: hdr has an open file handle. Will closing it reduce memory
+        # footprint? Should ExifRead close it? Probably not the more I think of it. That
+        # means JPEG handling, which closes it, is broken. Perhaps we delete the object at
+        # end of this clause.
+        image.seek(0)
+        # Profiles reading no MakerNote tags, eg. location, skip decoding it.
+        header_kwargs = {}
+        if EXIF_PARSER_DETAILED_OPTION and not EXIF_PROFILE.selects('IFD0/MakerNote'):
+            header_kwargs['detailed'] = False
+        hdr = exifread.ExifHeader(image, **header_kwargs)
+        # Drop undeclared tags, eg. the big undecoded MakerNote, before any models are built.
+        exif_data = make_exif_data_dataclass(**EXIF_PROFILE.select(hdr.dump_tag_values()))
 
+    file_data = _get_file_data(_get_file_type(ft.extension), s3_object, object_size)
+
+    return exif_data, file_data
+
+def _get_exif_data_item(s3_event: S3Event) -> ExifDataItem:
+    '''Return EXIF data item for the first record of an S3 event'''
     s3_bucket = s3_event.bucket_name
     s3_object = s3_event.object_key
     object_size = s3_event.record.s3.get_object.size
     pk = '{}#{}'.format(s3_bucket, s3_object)
     sk = 'exif#v0'
 
-    (exif_data, file_data) = _get_exif_data(s3_bucket, s3_object, object_size)
+    # Identical bytes produce identical EXIF data no matter what key they were written to.
+    cache_key = _get_exif_cache_key(s3_event.record.s3.get_object.etag, object_size)
+    cached = None if cache_key is None else EXIF_CACHE.get(cache_key)
+    if cached is not None:
+        _logger.debug('EXIF cache hit: {}'.format(cache_key))
+        exif_data = cached['exif']
+        file_data = _get_file_data(cached['file_type'], s3_object, object_size)
+    else:
+        (exif_data, file_data) = S3_CLIENT_PROVIDER.retry_credentials_error(
+            s3_bucket,
+            lambda: _get_exif_data(s3_bucket, s3_object, object_size)
+        )
+        if cache_key is not None:
+            EXIF_CACHE.put(cache_key, {'exif': to_dict(exif_data), 'file_type': file_data.file_type})
+
     exif_data_item = ExifDataItem(
         **{
             'pk': pk,
@@ -137,8 +226,90 @@ def handler(event: Dict[str, Any], context: LambdaContext) -> Response:
             'exif': exif_data
         }
     )
-    response = Response(**{'Item': exif_data_item})
 
-    _logger.debug('EXIF: {}'.format(json.dumps(asdict(response))))
+    return exif_data_item
+
+
+def _check_in_exif_data_item(exif_data_item: ExifDataItem) -> Union[ExifDataItem, Dict[str, Any]]:
+    '''Return the item or, when it's large, a claim checked summary of it'''
+    if CLAIM_CHECK_STORE is None:
+        return exif_data_item
+    return check_in(to_dict(exif_data_item, RESPONSE_SKIP_NONE), CLAIM_CHECK_STORE, CLAIM_CHECK_THRESHOLD)
+
+
+def _get_batch_records(event: Dict[str, Any]) -> List[Tuple[str, S3Event]]:
+    '''
+    Return (item identifier, single record S3 event) pairs from a batch event.
+
+    Accepts an S3 event with any number of records or an SQS batch whose bodies are S3 events,
+    either directly or wrapped in an SNS notification. SQS records are identified by message ID
+    so failures can be reported back to the queue.
+    '''
+    records = []
+    for record in event.get('Records', []):
+        if record.get('eventSource') == 'aws:sqs':
+            body = json.loads(record['body'])
+            if 'Message' in body:
+                body = json.loads(body['Message'])
+            # NOTE: s3:TestEvent messages have no records.
+            for s3_record in body.get('Records', []):
+                records.append((record['messageId'], S3Event({'Records': [s3_record]})))
+        else:
+            s3_event = S3Event({'Records': [record]})
+            records.append(('{}#{}'.format(s3_event.bucket_name, s3_event.object_key), s3_event))
+
+    return records
+
+
+@lambda_dataclass_response(skip_none=RESPONSE_SKIP_NONE)
+def handler(event: Dict[str, Any], context: LambdaContext) -> Response:
+    '''Function entry'''
+    if _logger.isEnabledFor(logging.DEBUG):
+        _logger.debug('Event: {}'.format(json.dumps(event)))
+
+    s3_event = S3Event(event)
+    exif_data_item = _get_exif_data_item(s3_event)
+    response = Response(**{'Item': _check_in_exif_data_item(exif_data_item)})
+
+    if _logger.isEnabledFor(logging.DEBUG):
+        _logger.debug('EXIF: {}'.format(to_json(response)))
+
+    return response
+
+
+@lambda_dataclass_response(skip_none=RESPONSE_SKIP_NONE)
+def batch_handler(event: Dict[str, Any], context: LambdaContext) -> BatchResponse:
+    '''
+    Batch function entry
+
+    An SQS event source mapping only reads batchItemFailures from the response so each item is
+    put on the event bus as handler()'s OnSuccess destination would put it.
+    '''
+    if _logger.isEnabledFor(logging.DEBUG):
+        _logger.debug('Event: {}'.format(json.dumps(event)))
+
+    records = _get_batch_records(event)
+    results: List[Tuple[str, Dict[str, Any], Dict[str, Any]]] = []
+    failed: List[str] = []
+
+    with ThreadPoolExecutor(max_workers=EXIF_BATCH_MAX_WORKERS) as executor:
+        futures = [
+            (_id, _e, executor.submit(_get_exif_data_item, _e)) for _id, _e in records
+        ]
+        for _id, _e, _f in futures:
+            try:
+                item_response = Response(**{'Item': _check_in_exif_data_item(_f.result())})
+                results.append((_id, _e.raw_event, to_dict(item_response, RESPONSE_SKIP_NONE)))
+            except Exception as e:
+                _logger.exception('Failed to process record {}: {}'.format(_id, e))
+                failed.append(_id)
+
+    failed += EVENT_PUBLISHER.put_results(results, context)
+    # An SQS message can carry more than one S3 record; report it once.
+    failures = [{'itemIdentifier': _id} for _id in dict.fromkeys(failed)]
+    response = BatchResponse(**{'batchItemFailures': failures})
+
+    if _logger.isEnabledFor(logging.DEBUG):
+        _logger.debug('Response: {}'.format(to_json(response)))
 
     return response
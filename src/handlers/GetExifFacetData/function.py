@@ -0,0 +1,48 @@
+'''Return all normalized EXIF facet data items from one EXIF data item'''
+
+import json
+import logging
+import os
+
+from dataclasses import dataclass, field
+from typing import Any, Dict, List
+
+from aws_lambda_powertools.utilities.typing import LambdaContext
+from common.facets import FACETS, get_facet_items
+from common.models import LazyExifDataItem
+from common.util.claim_check import resolve_claim_check
+from common.util.dataclasses import lambda_dataclass_response, to_json
+
+
+# FIXME: Replace with powertools logger
+log_level = os.environ.get('LOG_LEVEL', 'INFO')
+logging.root.setLevel(logging.getLevelName(log_level))
+_logger = logging.getLogger(__name__)
+
+# Comma separated facets (camera, lens, location, image, file) to extract. Defaults to all.
+EXIF_FACETS = [_f.strip() for _f in os.environ.get('EXIF_FACETS', ','.join(FACETS)).split(',')]
+
+
+@dataclass
+class Response:
+    '''Function response'''
+    Items: List[Any]
+    # Facets that couldn't be normalized from this item.
+    FailedFacets: List[str] = field(default_factory=list)
+
+
+@lambda_dataclass_response
+def handler(event: Dict[str, Any], context: LambdaContext) -> Response:
+    '''Function entry'''
+    if _logger.isEnabledFor(logging.DEBUG):
+        _logger.debug('Event: {}'.format(json.dumps(event)))
+
+    exif_item = LazyExifDataItem(**resolve_claim_check(event))
+    items, failed_facets = get_facet_items(exif_item, EXIF_FACETS)
+
+    response = Response(**{'Items': items, 'FailedFacets': failed_facets})
+
+    if _logger.isEnabledFor(logging.DEBUG):
+        _logger.debug('Response: {}'.format(to_json(response)))
+
+    return response
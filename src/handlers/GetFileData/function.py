@@ -8,8 +8,9 @@ from dataclasses import asdict, dataclass
 from typing import Any, Dict, cast
 
 from aws_lambda_powertools.utilities.typing import LambdaContext
-from common.models import ExifDataItem, FileDataItem, PutDdbItemAction
-from common.util.dataclasses import lambda_dataclass_response
+from common.models import FileDataItem, LazyExifDataItem, PutDdbItemAction
+from common.util.claim_check import split_claim_check
+from common.util.dataclasses import lambda_dataclass_response, to_json
 
 
 # FIXME: Replace with powertools logger
@@ -27,11 +28,14 @@ class Response(PutDdbItemAction):
 @lambda_dataclass_response
 def handler(event: Dict[str, Any], context: LambdaContext) -> Response:
     '''Function entry'''
-    _logger.debug('Event: {}'.format(json.dumps(event)))
+    if _logger.isEnabledFor(logging.DEBUG):
+        _logger.debug('Event: {}'.format(json.dumps(event)))
 
     pk = event.get('pk')
     sk = 'file#v0'
-    exif_data = ExifDataItem(**event)
+    # File data is in the summary so a claim checked body is never fetched.
+    summary, _ = split_claim_check(event)
+    exif_data = LazyExifDataItem(**summary)
 
     response = Response(
         **{
@@ -42,6 +46,7 @@ def handler(event: Dict[str, Any], context: LambdaContext) -> Response:
             }
         }
     )
-    _logger.debug('Response: {}'.format(json.dumps(asdict(response))))
+    if _logger.isEnabledFor(logging.DEBUG):
+        _logger.debug('Response: {}'.format(to_json(response)))
 
     return response
@@ -17,14 +17,16 @@ _logger = logging.getLogger(__name__)
 
 def handler(event: Dict[str, Any], context: LambdaContext) -> dict:
     '''Function entry'''
-    _logger.debug('Event: {}'.format(json.dumps(event)))
+    if _logger.isEnabledFor(logging.DEBUG):
+        _logger.debug('Event: {}'.format(json.dumps(event)))
 
     sns_event = SNSEvent(event)
     sns_message_str = json.loads(sns_event.sns_message)
     s3_event = S3Event(sns_message_str)
     s3_event_data = s3_event._data
 
-    _logger.debug('Response: {}'.format(json.dumps(s3_event_data)))
+    if _logger.isEnabledFor(logging.DEBUG):
+        _logger.debug('Response: {}'.format(json.dumps(s3_event_data)))
 
     resp = s3_event_data
     return resp
@@ -3,44 +3,402 @@
 import json
 import logging
 import os
+import random
+import time
 
-from decimal import Decimal
-from typing import Any, Dict
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple, Union
 
 import boto3
+from aws_lambda_powertools import Metrics
+from aws_lambda_powertools.metrics import MetricUnit
 from aws_lambda_powertools.utilities.typing import LambdaContext
+from botocore.exceptions import ClientError
 
-from mypy_boto3_dynamodb import DynamoDBServiceResource
-from mypy_boto3_dynamodb.service_resource import Table
+from mypy_boto3_dynamodb import DynamoDBClient
 from mypy_boto3_dynamodb.type_defs import PutItemOutputTypeDef
 
+from common.exif_codec import EXIF_CODEC_ATTR, EXIF_ITEM_SK, encode_exif_item
+from common.util.claim_check import resolve_claim_check
+from common.util.dataclasses import lambda_dataclass_response
+from common.util.ddb import (
+    CONTENT_DIGEST_ATTR,
+    get_content_digest,
+    get_marshalled_key,
+    marshal_item
+)
+
 # FIXME: Replace with powertools logger
 log_level = os.environ.get('LOG_LEVEL', 'INFO')
 logging.root.setLevel(logging.getLevelName(log_level))
 _logger = logging.getLogger(__name__)
 
-DDB: DynamoDBServiceResource = boto3.resource('dynamodb')
-DDB_TABLE: Table = DDB.Table(os.environ.get('DDB_TABLE_NAME', ''))
+METRICS = Metrics(namespace=os.environ.get('POWERTOOLS_METRICS_NAMESPACE', 'PhotoOps'))
+
+# Items are marshalled in one pass and written with the low level client.
+DDB_CLIENT: DynamoDBClient = boto3.client('dynamodb')
+DDB_TABLE_NAME = os.environ.get('DDB_TABLE_NAME', '')
+
+# Items carry a digest of their content. Skip writing items whose stored digest is the same.
+DDB_SKIP_UNCHANGED = os.environ.get('DDB_SKIP_UNCHANGED', 'true').lower() == 'true'
+
+# Storage codec for EXIF data items, eg. zlib. Unset stores them as a plain nested map.
+EXIF_STORAGE_CODEC = os.environ.get('EXIF_STORAGE_CODEC', '')
+
+# BatchWriteItem takes at most 25 items and BatchGetItem 100 keys.
+DDB_BATCH_SIZE = 25
+DDB_BATCH_GET_SIZE = 100
+# Attempts at writing a chunk before its unprocessed items are reported as failed.
+DDB_BATCH_MAX_ATTEMPTS = int(os.environ.get('DDB_BATCH_MAX_ATTEMPTS', 5))
+DDB_BATCH_BACKOFF_BASE_SECONDS = float(os.environ.get('DDB_BATCH_BACKOFF_BASE_SECONDS', 0.05))
+DDB_BATCH_BACKOFF_MAX_SECONDS = float(os.environ.get('DDB_BATCH_BACKOFF_MAX_SECONDS', 2))
+# Errors where the whole chunk is worth retrying. Anything else is down to an item.
+DDB_RETRYABLE_ERRORS = (
+    'ProvisionedThroughputExceededException',
+    'RequestLimitExceeded',
+    'ThrottlingException',
+    'InternalServerError',
+)
+
+
+@dataclass
+class BatchResponse:
+    '''Batch function response'''
+    batchItemFailures: List[Dict[str, str]]
+
+
+def _is_encoded_item(item: Dict[str, Any]) -> bool:
+    '''Return whether an item is stored with the EXIF storage codec'''
+    return bool(EXIF_STORAGE_CODEC) and item.get('sk') == EXIF_ITEM_SK and 'exif' in item
+
+
+def _get_item_digest(item: Dict[str, Any]) -> str:
+    '''Return an item's content digest'''
+    # Changing codec changes what's stored so must rewrite the item.
+    if _is_encoded_item(item):
+        item = {**item, EXIF_CODEC_ATTR: EXIF_STORAGE_CODEC}
+    return get_content_digest(item)
+
+
+def _marshal_ddb_item(item: Dict[str, Any], digest: Optional[str] = None) -> Dict[str, Any]:
+    '''Return an item marshalled, encoded if need be, with its content digest'''
+    digest = digest or _get_item_digest(item)
+    if _is_encoded_item(item):
+        item = encode_exif_item(item, EXIF_STORAGE_CODEC)
+
+    ddb_item = marshal_item(item)
+    ddb_item[CONTENT_DIGEST_ATTR] = {'S': digest}
+    return ddb_item
+
+
+def _get_ddb_digest(key: Tuple[str, str]) -> Optional[str]:
+    '''Return the stored content digest of an item or None if it can't be read'''
+    try:
+        response = DDB_CLIENT.get_item(
+            TableName=DDB_TABLE_NAME,
+            Key={'pk': {'S': key[0]}, 'sk': {'S': key[1]}},
+            ProjectionExpression='#digest',
+            ExpressionAttributeNames={'#digest': CONTENT_DIGEST_ATTR},
+            ReturnConsumedCapacity='NONE'
+        )
+    except ClientError as e:
+        _logger.warning('Failed to read digest of {}: {}'.format(key, e))
+        return None
+
+    return response.get('Item', {}).get(CONTENT_DIGEST_ATTR, {}).get('S')
 
 
-def _put_ddb_item(item: Dict[str, Any]) -> PutItemOutputTypeDef:
-    '''Write item to DDB'''
-    item['ReturnConsumedCapacity'] = 'NONE'
-    response = DDB_TABLE.put_item(**item)
+def _put_ddb_item(item: Dict[str, Any]) -> Optional[PutItemOutputTypeDef]:
+    '''
+    Write item to DDB and return None if it was unchanged.
+
+    A failed condition still consumes write capacity so with DDB_SKIP_UNCHANGED the stored
+    digest is read first, which costs far less, and the item is only written if it differs. The
+    condition stays to guard against the item changing between the read and the write.
+    '''
+    digest = _get_item_digest(item)
+    condition: Dict[str, Any] = {}
+    if DDB_SKIP_UNCHANGED:
+        if _get_ddb_digest(_get_item_key(item)) == digest:
+            _logger.debug('Item unchanged: {}'.format(_get_item_key(item)))
+            return None
+        condition = {
+            'ConditionExpression': 'attribute_not_exists(#digest) OR #digest <> :digest',
+            'ExpressionAttributeNames': {'#digest': CONTENT_DIGEST_ATTR},
+            'ExpressionAttributeValues': {':digest': {'S': digest}},
+        }
+
+    ddb_item = _marshal_ddb_item(item, digest)
+    try:
+        response = DDB_CLIENT.put_item(
+            TableName=DDB_TABLE_NAME,
+            Item=ddb_item,
+            ReturnConsumedCapacity='NONE',
+            **condition
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+        _logger.debug('Item unchanged: {}'.format(_get_item_key(item)))
+        return None
+
     _logger.debug(response)
     return response
 
 
-def handler(event: Dict[str, Any], context: LambdaContext) -> PutItemOutputTypeDef:
+def _get_item_key(item: Dict[str, Any]) -> Tuple[str, str]:
+    '''Return an item's primary key'''
+    return item['pk'], item['sk']
+
+
+def _sleep_backoff(attempt: int) -> None:
+    '''Sleep before a retry with full jitter exponential backoff'''
+    ceiling = min(DDB_BATCH_BACKOFF_MAX_SECONDS, DDB_BATCH_BACKOFF_BASE_SECONDS * 2 ** attempt)
+    time.sleep(random.uniform(0, ceiling))
+
+
+def _get_request_items(
+        requests: List[Dict[str, Any]],
+        items_by_key: Dict[Tuple[str, str], Dict[str, Any]]
+    ) -> List[Dict[str, Any]]:
+    '''Return the unmarshalled items of put requests'''
+    return [items_by_key[get_marshalled_key(_r['PutRequest']['Item'])] for _r in requests]
+
+
+def _put_ddb_items_individually(items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    '''Write items one at a time and return the ones that failed'''
+    failed = []
+    for _i in items:
+        try:
+            _put_ddb_item(_i)
+        except ClientError as e:
+            _logger.error('Failed to put item {}: {}'.format(_get_item_key(_i), e))
+            failed.append(_i)
+    return failed
+
+
+def _batch_get_ddb_digests(keys: List[Tuple[str, str]]) -> Dict[Tuple[str, str], str]:
+    '''
+    Return the stored content digests of items.
+
+    Only the key and digest are projected. Keys that can't be read are left out so their items
+    are written.
+    '''
+    digests = {}
+    for _s in range(0, len(keys), DDB_BATCH_GET_SIZE):
+        request_keys = [
+            {'pk': {'S': _pk}, 'sk': {'S': _sk}} for _pk, _sk in keys[_s:_s + DDB_BATCH_GET_SIZE]
+        ]
+
+        for attempt in range(DDB_BATCH_MAX_ATTEMPTS):
+            if attempt:
+                _sleep_backoff(attempt)
+
+            try:
+                response = DDB_CLIENT.batch_get_item(
+                    RequestItems={
+                        DDB_TABLE_NAME: {
+                            'Keys': request_keys,
+                            'ProjectionExpression': 'pk, sk, #digest',
+                            'ExpressionAttributeNames': {'#digest': CONTENT_DIGEST_ATTR},
+                        }
+                    },
+                    ReturnConsumedCapacity='NONE'
+                )
+            except ClientError as e:
+                _logger.warning('Failed to read {} digests: {}'.format(len(request_keys), e))
+                if e.response['Error']['Code'] in DDB_RETRYABLE_ERRORS:
+                    continue
+                break
+
+            for _i in response.get('Responses', {}).get(DDB_TABLE_NAME, []):
+                if CONTENT_DIGEST_ATTR in _i:
+                    digests[get_marshalled_key(_i)] = _i[CONTENT_DIGEST_ATTR]['S']
+
+            unprocessed = response.get('UnprocessedKeys', {}).get(DDB_TABLE_NAME, {})
+            request_keys = unprocessed.get('Keys', [])
+            if not request_keys:
+                break
+
+    return digests
+
+
+def _batch_put_ddb_chunk(
+        items: List[Dict[str, Any]],
+        digests: Dict[Tuple[str, str], str]
+    ) -> List[Dict[str, Any]]:
+    '''Write up to DDB_BATCH_SIZE items and return the ones that couldn't be written'''
+    # Unprocessed items come back marshalled. Map them back to what we were given.
+    items_by_key = {_get_item_key(_i): _i for _i in items}
+
+    # One item that can't be marshalled, eg. holding a NaN, mustn't fail the rest.
+    failed = []
+    requests = []
+    for _k, _i in items_by_key.items():
+        try:
+            requests.append({'PutRequest': {'Item': _marshal_ddb_item(_i, digests[_k])}})
+        except (TypeError, ValueError) as e:
+            _logger.error('Failed to marshal item {}: {}'.format(_k, e))
+            failed.append(_i)
+    if not requests:
+        return failed
+
+    for attempt in range(DDB_BATCH_MAX_ATTEMPTS):
+        if attempt:
+            _sleep_backoff(attempt)
+
+        try:
+            response = DDB_CLIENT.batch_write_item(
+                RequestItems={DDB_TABLE_NAME: requests},
+                ReturnConsumedCapacity='NONE'
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] in DDB_RETRYABLE_ERRORS:
+                _logger.warning('Retrying batch of {} items: {}'.format(len(requests), e))
+                continue
+            # eg. one item over the size limit fails the lot. Find which.
+            _logger.warning('Batch failed, writing items individually: {}'.format(e))
+            return failed + _put_ddb_items_individually(_get_request_items(requests, items_by_key))
+
+        requests = response.get('UnprocessedItems', {}).get(DDB_TABLE_NAME, [])
+        if not requests:
+            return failed
+        _logger.info('Retrying {} unprocessed items'.format(len(requests)))
+
+    return failed + _get_request_items(requests, items_by_key)
+
+
+def _batch_put_ddb_items(items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    '''
+    Write items with BatchWriteItem and return the ones that couldn't be written.
+
+    Items are written DDB_BATCH_SIZE at a time. Unprocessed items and throttled chunks are
+    retried with jittered backoff. BatchWriteItem takes no condition so with DDB_SKIP_UNCHANGED
+    stored digests are read first, which costs far less capacity than rewriting an item, and
+    unchanged items are left out.
+    '''
+    # A batch can't put the same key twice. The last item wins as it would with PutItem.
+    items_by_key = {_get_item_key(_i): _i for _i in items}
+
+    failed = []
+    digests = {}
+    for _k, _i in items_by_key.items():
+        try:
+            digests[_k] = _get_item_digest(_i)
+        except (TypeError, ValueError) as e:
+            _logger.error('Failed to digest item {}: {}'.format(_k, e))
+            failed.append(_i)
+
+    unique_items = [items_by_key[_k] for _k in digests]
+    if DDB_SKIP_UNCHANGED:
+        stored_digests = _batch_get_ddb_digests(list(digests))
+        unique_items = [
+            items_by_key[_k] for _k, _d in digests.items() if stored_digests.get(_k) != _d
+        ]
+
+    write_failed = []
+    for _s in range(0, len(unique_items), DDB_BATCH_SIZE):
+        write_failed += _batch_put_ddb_chunk(unique_items[_s:_s + DDB_BATCH_SIZE], digests)
+
+    written = len(unique_items) - len(write_failed)
+    METRICS.add_metric(name='ItemsWritten', unit=MetricUnit.Count, value=written)
+    METRICS.add_metric(
+        name='ItemsUnchanged',
+        unit=MetricUnit.Count,
+        value=len(digests) - len(unique_items)
+    )
+    return failed + write_failed
+
+
+def _get_event_items(event: Dict[str, Any]) -> List[Dict[str, Any]]:
+    '''Return the full items of an {'Item': ...} or {'Items': [...]} event'''
+    items = event['Items'] if 'Items' in event else [event['Item']]
+    # The full item is written, not its claim check summary.
+    return [resolve_claim_check(_i) for _i in items]
+
+
+def _get_batch_items(event: Dict[str, Any]) -> Tuple[List[Tuple[str, Dict[str, Any]]], List[str]]:
+    '''
+    Return (item identifier, item) pairs from a batch event and identifiers that failed.
+
+    Accepts an SQS batch whose bodies are item events or a single item event. SQS records are
+    identified by message ID so failures can be reported back to the queue, other items by key.
+    '''
+    if 'Records' not in event:
+        return [('{}#{}'.format(*_get_item_key(_i)), _i) for _i in _get_event_items(event)], []
+
+    items = []
+    failures = []
+    for record in event['Records']:
+        try:
+            items += [(record['messageId'], _i) for _i in _get_event_items(json.loads(record['body']))]
+        except Exception as e:
+            _logger.exception('Failed to read record {}: {}'.format(record['messageId'], e))
+            failures.append(record['messageId'])
+
+    return items, failures
+
+
+@METRICS.log_metrics
+def handler(
+        event: Dict[str, Any],
+        context: LambdaContext
+    ) -> Union[PutItemOutputTypeDef, Dict[str, int]]:
     '''Function entry'''
-    _logger.debug('Event: {}'.format(json.dumps(event, indent=4)))
+    if _logger.isEnabledFor(logging.DEBUG):
+        _logger.debug('Event: {}'.format(json.dumps(event, indent=4)))
 
-    # Floats are not supported by DDB.
-    event = json.loads(json.dumps(event), parse_float=Decimal)
+    # The full item is written, not its claim check summary.
+    if 'Item' in event:
+        event['Item'] = resolve_claim_check(event['Item'])
+    if 'Items' in event:
+        event['Items'] = _get_event_items(event)
 
-    resp = _put_ddb_item(event)
+    # Fused facet extraction returns several items at once.
+    if 'Items' in event:
+        failed = _batch_put_ddb_items(event['Items'])
+        if failed:
+            raise RuntimeError(
+                'Failed to write items: {}'.format([_get_item_key(_i) for _i in failed])
+            )
+        resp = {'Count': len(event['Items'])}
+    else:
+        resp = _put_ddb_item(event['Item']) or {'Unchanged': True}
+        METRICS.add_metric(
+            name='ItemsUnchanged' if 'Unchanged' in resp else 'ItemsWritten',
+            unit=MetricUnit.Count,
+            value=1
+        )
 
-    _logger.debug('Response: {}'.format(json.dumps(resp, indent=4)))
+    if _logger.isEnabledFor(logging.DEBUG):
+        _logger.debug('Response: {}'.format(json.dumps(resp, indent=4)))
 
     return resp
 
+
+@METRICS.log_metrics
+@lambda_dataclass_response
+def batch_handler(event: Dict[str, Any], context: LambdaContext) -> BatchResponse:
+    '''
+    Batch function entry
+
+    Writes every item of an SQS batch, or an {'Items': [...]} event, with BatchWriteItem
+    instead of one invocation and PutItem per item.
+    '''
+    if _logger.isEnabledFor(logging.DEBUG):
+        _logger.debug('Event: {}'.format(json.dumps(event)))
+
+    batch_items, failures = _get_batch_items(event)
+    failed_keys = {_get_item_key(_i) for _i in _batch_put_ddb_items([_i for _, _i in batch_items])}
+
+    # An SQS message can carry more than one item; report it once.
+    for _id, _i in batch_items:
+        if _get_item_key(_i) in failed_keys and _id not in failures:
+            failures.append(_id)
+
+    response = BatchResponse(**{'batchItemFailures': [{'itemIdentifier': _id} for _id in failures]})
+
+    if _logger.isEnabledFor(logging.DEBUG):
+        _logger.debug('Response: {}'.format(json.dumps(response.batchItemFailures)))
+
+    return response
@@ -0,0 +1,62 @@
+# pylint: disable=redefined-outer-name
+# pylint: disable=protected-access
+'''Test common.models.exif_data'''
+
+import json
+import os
+
+import pytest
+
+from dataclasses import asdict
+
+from dataclasses_json.undefined import UndefinedParameterError
+
+from common.models import ExifDataItem, LazyExifDataItem
+
+DATA_DIR = './data'
+EVENT_DIR = os.path.join(DATA_DIR, 'events')
+
+EVENT = os.path.join(EVENT_DIR, 'GetExifFacetData-event-eb.json')
+
+
+### Events
+@pytest.fixture()
+def event():
+    '''Return an EXIF data item'''
+    with open(EVENT) as f:
+        return json.load(f)
+
+
+### Tests
+def test_exif_data_classes_reused(event):
+    '''Test items of the same shape share generated classes'''
+    first = ExifDataItem(**json.loads(json.dumps(event)))
+    second = ExifDataItem(**json.loads(json.dumps(event)))
+
+    assert type(first.exif) is type(second.exif)
+    assert type(first.exif.ifd0.maker_note) is type(second.exif.ifd0.maker_note)
+
+
+def test_exif_data_slots(event):
+    '''Test EXIF models have no per instance dict and serialize as before'''
+    item = ExifDataItem(**json.loads(json.dumps(event)))
+    ifd0 = item.exif.ifd0
+
+    for _o in [item.exif, ifd0, ifd0.exif_ifd, ifd0.gps_ifd, ifd0.maker_note]:
+        assert not hasattr(_o, '__dict__')
+    assert asdict(item) == event
+
+
+def test_lazy_exif_data_item(event):
+    '''Test the lazy view reads the same values and only checks what it decodes'''
+    expected = ExifDataItem(**json.loads(json.dumps(event)))
+
+    event['exif']['ifd0']['gps_ifd']['not_a_tag'] = 1
+    lazy = LazyExifDataItem(**event)
+    assert lazy.exif.ifd0.make == expected.exif.ifd0.make
+    assert lazy.exif.ifd0.exif_ifd.f_number == expected.exif.ifd0.exif_ifd.f_number
+    assert lazy.exif.ifd0.maker_note == expected.exif.ifd0.maker_note
+    assert lazy.file == expected.file
+
+    with pytest.raises(UndefinedParameterError):
+        lazy.exif.ifd0.gps_ifd
@@ -0,0 +1,114 @@
+# pylint: disable=redefined-outer-name
+# pylint: disable=protected-access
+'''Test common.catalog'''
+
+import json
+import os
+
+import boto3
+import moto
+import pytest
+
+from common.catalog import PhotoCatalog
+from common.exif_codec import encode_exif_item
+from common.facets import FACETS
+from common.models import LazyExifDataItem
+from common.util.ddb import marshal_item
+
+DATA_DIR = './data'
+EVENT_DIR = os.path.join(DATA_DIR, 'events')
+
+FACET_ITEMS = os.path.join(EVENT_DIR, 'GetExifFacetData-output.json')
+EXIF_ITEM = os.path.join(EVENT_DIR, 'PutDdbItem-event-eb.json')
+
+
+### Items
+@pytest.fixture()
+def facet_items():
+    '''Return a photo's facet items'''
+    with open(FACET_ITEMS) as f:
+        return json.load(f)['Items']
+
+
+@pytest.fixture()
+def exif_item(facet_items):
+    '''Return the photo's EXIF data item'''
+    with open(EXIF_ITEM) as f:
+        return {**json.load(f)['Item'], 'pk': facet_items[0]['pk']}
+
+
+### AWS clients
+@pytest.fixture()
+def aws_credentials():
+    '''Mock credentials to prevent accidentally escaping our mock'''
+    os.environ['AWS_ACCESS_KEY_ID'] = 'testing'
+    os.environ['AWS_SECRET_ACCESS_KEY'] = 'testing'
+    os.environ['AWS_SECURITY_TOKEN'] = 'testing'
+    os.environ['AWS_SESSION_TOKEN'] = 'testing'
+
+
+@pytest.fixture()
+def DDB_CLIENT(aws_credentials, facet_items, exif_item):
+    '''DDB client of a table holding a photo, its EXIF data item compressed'''
+    with moto.mock_dynamodb2():
+        ddb_client = boto3.Session().client('dynamodb')
+        ddb_client.create_table(
+            TableName='TestTable',
+            KeySchema=[
+                {
+                    'AttributeName': 'pk',
+                    'KeyType': 'HASH'
+                },
+                {
+                    'AttributeName': 'sk',
+                    'KeyType': 'RANGE'
+                }
+            ],
+            AttributeDefinitions=[
+                {
+                    'AttributeName': 'pk',
+                    'AttributeType': 'S'
+                },
+                {
+                    'AttributeName': 'sk',
+                    'AttributeType': 'S'
+                }
+            ]
+        )
+        for _i in facet_items + [encode_exif_item(exif_item)]:
+            ddb_client.put_item(TableName='TestTable', Item=marshal_item(_i))
+        yield ddb_client
+
+
+### Tests
+def test_catalog(facet_items, DDB_CLIENT, mocker):
+    '''Items are read back as models'''
+    pk = facet_items[0]['pk']
+    item_classes = {_f.sk: _f.item_class for _f in FACETS.values()}
+    expected = {_i['sk']: item_classes[_i['sk']](**_i) for _i in facet_items}
+
+    catalog = PhotoCatalog('TestTable', ddb_client=DDB_CLIENT)
+    query = mocker.spy(DDB_CLIENT, 'query')
+    assert catalog.get_photo(pk) == expected
+    assert catalog.get_photo(pk) == expected
+    assert query.call_count == 1
+
+    exif_item = catalog.get_photo(pk, include_exif=True)['exif#v0']
+    assert isinstance(exif_item, LazyExifDataItem)
+    assert exif_item.exif.ifd0.maker_note.serial_number == expected['camera#v0'].serial_number
+
+    batch_get_item = mocker.spy(DDB_CLIENT, 'batch_get_item')
+    photos = catalog.get_photos([pk, 'photoopsai-bucket#missing'], ['camera#v0', 'lens#v0'])
+    assert photos == {
+        pk: {'camera#v0': expected['camera#v0'], 'lens#v0': expected['lens#v0']},
+        'photoopsai-bucket#missing': {},
+    }
+    # Missing items are cached too.
+    catalog.get_photos([pk, 'photoopsai-bucket#missing'], ['camera#v0', 'lens#v0'])
+    assert batch_get_item.call_count == 1
+
+    camera = catalog.get_item(pk, 'camera#v0', attributes=['make'])
+    assert (camera.make, camera.model) == (expected['camera#v0'].make, None)
+
+    exif_item = catalog.get_item(pk, 'exif#v0', attributes=['exif.ifd0.make'])
+    assert exif_item.exif.ifd0.make == expected['camera#v0'].make
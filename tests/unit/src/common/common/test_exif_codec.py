@@ -0,0 +1,57 @@
+# pylint: disable=redefined-outer-name
+# pylint: disable=protected-access
+'''Test common.exif_codec'''
+
+import json
+import os
+
+import pytest
+
+from dataclasses import asdict
+
+from common.exif_codec import decode_exif_item, encode_exif_item
+from common.models import DeferredIfd, ExifDataItem
+
+DATA_DIR = './data'
+EVENT_DIR = os.path.join(DATA_DIR, 'events')
+
+EVENT = os.path.join(EVENT_DIR, 'GetExifFacetData-event-eb.json')
+
+
+### Events
+@pytest.fixture()
+def event():
+    '''Return an EXIF data item'''
+    with open(EVENT) as f:
+        return json.load(f)
+
+
+### Tests
+def test_exif_codec(event):
+    '''Test encoded EXIF data decodes the same and IFDs are only decompressed when read'''
+    expected = ExifDataItem(**json.loads(json.dumps(event)))
+
+    encoded = encode_exif_item(event)
+    assert encoded['exif']['ifd0']['make'] == expected.exif.ifd0.make
+    assert list(encoded['exif']['ifd0']['maker_note']) == ['serial_number']
+    assert asdict(decode_exif_item(encoded).materialize()) == asdict(expected)
+
+    lazy = decode_exif_item(encoded)
+    assert lazy.exif.ifd0.make == expected.exif.ifd0.make
+    maker_note = lazy.exif.ifd0._raw['maker_note']
+    assert isinstance(maker_note, DeferredIfd) and maker_note._raw is None
+
+    assert lazy.exif.ifd0.maker_note == expected.exif.ifd0.maker_note
+    assert maker_note._raw is not None
+    assert lazy.exif.tag_index.get_image_info() == expected.exif.tag_index.get_image_info()
+
+
+def test_exif_codec_map_keys(event):
+    '''Test no map key of an encoded item is empty, which DDB rejects'''
+    def get_keys(value):
+        if isinstance(value, dict):
+            for _k, _v in value.items():
+                yield _k
+                yield from get_keys(_v)
+
+    assert '' not in set(get_keys(encode_exif_item(event)))
@@ -0,0 +1,69 @@
+# pylint: disable=redefined-outer-name
+# pylint: disable=protected-access
+'''Test common.util.aws'''
+
+import os
+
+import moto
+import pytest
+
+from botocore.exceptions import ClientError
+
+from common.util.aws import CrossAccountS3ClientProvider
+
+ROLE_ARN = 'arn:aws:iam::123456789012:role/PhotoOpsAI/CrossAccountAccess'
+
+
+### AWS clients
+@pytest.fixture()
+def aws_credentials():
+    '''Mock credentials to prevent accidentally escaping our mock'''
+    os.environ['AWS_ACCESS_KEY_ID'] = 'testing'
+    os.environ['AWS_SECRET_ACCESS_KEY'] = 'testing'
+    os.environ['AWS_SECURITY_TOKEN'] = 'testing'
+    os.environ['AWS_SESSION_TOKEN'] = 'testing'
+
+
+@pytest.fixture()
+def provider(aws_credentials):
+    '''Cross account S3 client provider'''
+    with moto.mock_sts():
+        yield CrossAccountS3ClientProvider('Test', ROLE_ARN)
+
+
+def _client_error(code, operation_name='GetObject'):
+    '''Return an S3 client error'''
+    return ClientError({'Error': {'Code': code, 'Message': code}}, operation_name)
+
+
+### Tests
+@pytest.mark.parametrize('error', [
+    _client_error('ExpiredToken'),
+    _client_error('InvalidAccessKeyId'),
+    _client_error('400', 'HeadObject'),
+])
+def test_retry_credentials_error(error, provider):
+    '''Rejected credentials are replaced and the call retried once'''
+    clients = []
+
+    def get_object():
+        clients.append(provider.get_client())
+        if len(clients) == 1:
+            raise error
+        return 'object'
+
+    assert provider.retry_credentials_error(None, get_object) == 'object'
+    assert clients[0] is not clients[1]
+
+
+def test_retry_credentials_error_other(provider):
+    '''Other errors aren't retried'''
+    calls = []
+
+    def get_object():
+        calls.append(provider.get_client())
+        raise _client_error('NoSuchKey')
+
+    with pytest.raises(ClientError):
+        provider.retry_credentials_error(None, get_object)
+    assert len(calls) == 1
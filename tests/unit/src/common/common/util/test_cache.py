@@ -0,0 +1,21 @@
+'''Test common.util.cache'''
+
+from datetime import timedelta
+
+from common.util.cache import TtlLruCache
+
+
+### Tests
+def test_ttl_lru_cache():
+    '''Entries expire after the TTL and the least recently used are evicted'''
+    now = [0.0]
+    cache = TtlLruCache(2, timedelta(seconds=10), clock=lambda: now[0])
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    cache.put('c', 3)
+    assert 'b' not in cache and cache.get('a') == 1
+
+    now[0] = 10.0
+    assert cache.get('a') is None
+    assert len(cache) == 1
@@ -0,0 +1,47 @@
+# pylint: disable=redefined-outer-name
+# pylint: disable=protected-access
+'''Test common.util.claim_check'''
+
+import pytest
+
+from common.util.claim_check import ClaimCheckStore, check_in, resolve_claim_check
+
+
+class DictClaimCheckStore(ClaimCheckStore):
+    '''Claim check store in a dict'''
+    scheme = 'dict'
+
+    def __init__(self) -> None:
+        self.bodies = {}
+
+    def put(self, body: bytes) -> str:
+        uri = 'dict://{}'.format(len(self.bodies))
+        self.bodies[uri] = body
+        return uri
+
+    def get(self, uri: str) -> bytes:
+        return self.bodies[uri]
+
+
+### Tests
+def test_incomplete_store():
+    '''A store missing a method fails when it's made, not when it's used'''
+    class PutOnlyStore(ClaimCheckStore):
+        '''Store that can't get'''
+        def put(self, body: bytes) -> str:
+            return ''
+
+    with pytest.raises(TypeError):
+        PutOnlyStore()
+
+
+def test_check_in(mocker):
+    '''Items over the threshold are replaced by a summary and resolved back'''
+    store = DictClaimCheckStore()
+    mocker.patch('common.util.claim_check._get_store', return_value=store)
+    item = {'pk': 'bucket#key', 'sk': 'exif#v0', 'exif': {'ifd0': {'make': 'NIKON'}}}
+
+    assert check_in(item, store) is item
+    summary = check_in(item, store, threshold=0)
+    assert summary['pk'] == item['pk'] and 'exif' not in summary
+    assert resolve_claim_check(summary) == item
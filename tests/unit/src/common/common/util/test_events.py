@@ -0,0 +1,54 @@
+'''Test common.util.events'''
+
+import json
+
+from common.util.events import PUT_EVENTS_MAX_ENTRIES, LambdaResultPublisher
+
+
+### Tests
+def test_put_results(mocker):
+    '''Results are put in chunks and only the failed entries are returned'''
+    def put_events(Entries):
+        return {
+            'FailedEntryCount': 1,
+            'Entries': [
+                {'ErrorCode': 'InternalFailure', 'ErrorMessage': 'Failed'} if _i == 0
+                else {'EventId': str(_i)}
+                for _i, _ in enumerate(Entries)
+            ]
+        }
+
+    events_client = mocker.Mock()
+    events_client.put_events.side_effect = put_events
+    publisher = LambdaResultPublisher('event-bus', events_client=events_client)
+    context = mocker.Mock(
+        aws_request_id='request-0',
+        invoked_function_arn='arn:aws:lambda:us-east-1:123456789012:function:Test'
+    )
+    results = [
+        ('id-{}'.format(_i), {'n': _i}, {'Item': {'pk': str(_i)}})
+        for _i in range(PUT_EVENTS_MAX_ENTRIES + 1)
+    ]
+    results.append(('id-unserializable', {}, {'Item': {'pk': set()}}))
+
+    assert publisher.put_results(results, context) == ['id-0', 'id-unserializable', 'id-10']
+    assert events_client.put_events.call_count == 2
+
+    entry = events_client.put_events.call_args_list[0].kwargs['Entries'][1]
+    assert entry['Source'] == 'lambda'
+    detail = json.loads(entry['Detail'])
+    assert detail['requestContext']['functionArn'] == context.invoked_function_arn
+    assert detail['requestPayload'] == {'n': 1}
+    assert detail['responsePayload'] == {'Item': {'pk': '1'}}
+
+
+def test_put_results_request_error(mocker):
+    '''A failed request fails every result it carried'''
+    events_client = mocker.Mock()
+    events_client.put_events.side_effect = Exception('Throttled')
+    publisher = LambdaResultPublisher('event-bus', events_client=events_client)
+
+    context = mocker.Mock(aws_request_id='request-0', invoked_function_arn='')
+
+    results = [('id-{}'.format(_i), {}, {}) for _i in range(2)]
+    assert publisher.put_results(results, context) == ['id-0', 'id-1']
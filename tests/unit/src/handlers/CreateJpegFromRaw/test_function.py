@@ -2,17 +2,25 @@
 # pylint: disable=protected-access
 '''Test CreateJpegFromRaw'''
 
+import io
 import json
 import os
 
 import boto3
 import jsonschema
 import moto
+import numpy as np
 import pytest
+import rawpy
 
 from datetime import datetime, timedelta
+from types import SimpleNamespace
 from typing import cast
 
+from PIL import Image
+
+from common.util.s3 import S3_MULTIPART_MIN_PART_SIZE, S3MultipartWriter
+
 CACHE_BUCKET_NAME = 'cache_bucket'
 os.environ['PHOTOOPS_S3_BUCKET'] = CACHE_BUCKET_NAME
 os.environ['CROSS_ACCOUNT_IAM_ROLE_ARN'] = 'arn:aws:iam::123456789012:role/PhotoOpsAI/CrossAccountAccess'
@@ -167,4 +175,367 @@ def test_handler(event: dict, expected_response: dict, image, S3_CLIENT, mocker)
 
     assert resp == expected_response
     expiration = cast(str, expiration)
-    assert (datetime.utcnow() + timedelta(days=15)).date() == datetime.fromisoformat(expiration).date()
\ No newline at end of file
+    assert (datetime.utcnow() + timedelta(days=15)).date() == datetime.fromisoformat(expiration).date()
+
+def test_get_s3_object_buffer(S3_CLIENT, mocker):
+    '''Small objects are buffered in memory and large ones on disk'''
+    mocker.patch(
+        'src.handlers.CreateJpegFromRaw.function._get_cross_account_s3_client',
+        return_value=S3_CLIENT
+    )
+    mocker.patch.object(func, 'OBJECT_MEMORY_THRESHOLD_BYTES', 1024)
+
+    S3_CLIENT.create_bucket(Bucket='photoopsai-bucket')
+    S3_CLIENT.put_object(Bucket='photoopsai-bucket', Key='small.NEF', Body=b'0' * 512)
+    S3_CLIENT.put_object(Bucket='photoopsai-bucket', Key='large.NEF', Body=b'0' * 2048)
+
+    small = func._get_s3_object('photoopsai-bucket', 'small.NEF', 512)
+    assert isinstance(small, io.BytesIO)
+    assert small.getvalue() == b'0' * 512
+
+    large = func._get_s3_object('photoopsai-bucket', 'large.NEF', 2048)
+    assert not isinstance(large, io.BytesIO)
+    large.seek(0)
+    assert large.read() == b'0' * 2048
+
+
+def _make_raw(mocker, raw_size, preview_size, flip=0):
+    '''Return a mock RAW image with an embedded JPEG preview'''
+    preview = io.BytesIO()
+    Image.new('RGB', preview_size).save(preview, format='JPEG')
+
+    raw = mocker.MagicMock()
+    raw.sizes = SimpleNamespace(width=raw_size[0], height=raw_size[1], flip=flip)
+    raw.extract_thumb.return_value = SimpleNamespace(
+        format=rawpy.ThumbFormat.JPEG,
+        data=preview.getvalue()
+    )
+    raw.postprocess.return_value = np.zeros((raw_size[1], raw_size[0], 3), dtype=np.uint8)
+    mocker.patch.object(func.rawpy, 'imread', return_value=raw)
+    return raw, preview.getvalue()
+
+
+@pytest.mark.parametrize('long_edge, preview_size, expected_size', [
+    (0, (600, 400), (600, 400)),
+    (300, (600, 400), (300, 200)),
+])
+def test_convert_raw_to_jpeg_embedded_preview(long_edge, preview_size, expected_size, mocker):
+    '''A large enough embedded preview is used without demosaicing'''
+    mocker.patch.object(func, 'EMBEDDED_PREVIEW', True)
+    mocker.patch.object(func, 'JPEG_LONG_EDGE', long_edge)
+    raw, preview = _make_raw(mocker, (600, 400), preview_size)
+
+    jpeg = func._convert_raw_to_jpeg(io.BytesIO())
+    raw.postprocess.assert_not_called()
+    assert Image.open(jpeg).size == expected_size
+    if long_edge == 0:
+        jpeg.seek(0)
+        assert jpeg.read() == preview
+
+
+def test_convert_raw_to_jpeg_embedded_preview_flip(mocker):
+    '''The preview is rotated as LibRaw would rotate the RAW image'''
+    mocker.patch.object(func, 'EMBEDDED_PREVIEW', True)
+    _make_raw(mocker, (600, 400), (600, 400), flip=6)
+
+    jpeg = func._convert_raw_to_jpeg(io.BytesIO())
+    assert Image.open(jpeg).size == (400, 600)
+
+
+@pytest.mark.parametrize('embedded_preview', [True, False])
+def test_convert_raw_to_jpeg_demosaic(embedded_preview, mocker):
+    '''RAW images are demosaiced when the preview is too small or not wanted'''
+    mocker.patch.object(func, 'EMBEDDED_PREVIEW', embedded_preview)
+    raw, _ = _make_raw(mocker, (600, 400), (160, 120))
+
+    jpeg = func._convert_raw_to_jpeg(io.BytesIO())
+    raw.postprocess.assert_called_once()
+    assert Image.open(jpeg).size == (600, 400)
+
+
+@pytest.mark.parametrize('render_profile', list(func.RENDER_PROFILES))
+def test_convert_raw_to_jpeg_render_profile(render_profile, mocker):
+    '''RAW images are rendered with the profile's settings'''
+    raw, _ = _make_raw(mocker, (600, 400), (160, 120))
+
+    func._convert_raw_to_jpeg(io.BytesIO(), render_profile)
+    raw.postprocess.assert_called_once_with(**func.RENDER_PROFILES[render_profile])
+
+
+def test_convert_raw_to_jpeg_embedded_preview_half_size(mocker):
+    '''A half size profile accepts a preview of half the RAW image's size'''
+    mocker.patch.object(func, 'EMBEDDED_PREVIEW', True)
+    raw, _ = _make_raw(mocker, (600, 400), (300, 200))
+
+    func._convert_raw_to_jpeg(io.BytesIO(), 'preview')
+    raw.postprocess.assert_not_called()
+
+
+def test_get_render_profile(mocker):
+    '''Events may name a render profile and otherwise get the default'''
+    mocker.patch.object(func, 'RENDER_PROFILE', 'preview')
+    assert func._get_render_profile(None) == 'preview'
+    assert func._get_render_profile('archival') == 'archival'
+
+    with pytest.raises(ValueError):
+        func._get_render_profile('poster')
+
+
+def test_parse_renditions():
+    '''Renditions are ordered largest first with full size ahead of all'''
+    assert func._parse_renditions('thumbnail:256, full:0,screen:2048:500000,grid:512::0.95') == [
+        func.Rendition('full', 0),
+        func.Rendition('screen', 2048, 500000),
+        func.Rendition('grid', 512, None, 0.95),
+        func.Rendition('thumbnail', 256),
+    ]
+
+
+def test_get_encode_targets(mocker):
+    '''Renditions without their own byte target get the default scaled to their size'''
+    mocker.patch.object(func, 'ENCODE_TARGET_BYTES', 1000000)
+    mocker.patch.object(func, 'ENCODE_TARGET_SSIM', 0.9)
+    renditions = func._parse_renditions('full:0,screen:2048:500000,thumbnail:256::0.95')
+
+    assert func._get_encode_targets(renditions[0], 400, 400) == (1000000, 0.9)
+    assert func._get_encode_targets(renditions[1], 100, 400) == (500000, 0.9)
+    assert func._get_encode_targets(renditions[2], 4, 400) == (10000, 0.95)
+
+
+@pytest.mark.parametrize('streaming_upload', [False, True])
+def test_create_jpeg_renditions(streaming_upload, S3_CLIENT, mocker):
+    '''One decode makes every rendition'''
+    mocker.patch.object(func, 'STREAMING_UPLOAD', streaming_upload)
+    mocker.patch.object(func, 'S3_CLIENT', S3_CLIENT)
+    mocker.patch.object(func, 'PHOTOOPS_S3_BUCKET', CACHE_BUCKET_NAME)
+    mocker.patch.object(func, 'RENDITIONS', func._parse_renditions('full:0,grid:300,thumbnail:150'))
+    mocker.patch.object(func, '_get_s3_object', return_value=io.BytesIO())
+    raw, _ = _make_raw(mocker, (600, 400), (160, 120))
+    S3_CLIENT.create_bucket(Bucket=CACHE_BUCKET_NAME)
+
+    jpeg_data = func._create_jpeg('photoopsai-bucket', 'images/test.NEF')
+    raw.postprocess.assert_called_once()
+    assert jpeg_data.half_size is False
+
+    key = 'cache/photoopsai-bucket/images/test.NEF'
+    assert jpeg_data.s3_object_key == key + '.jpg'
+    assert [(_r.name, _r.s3_object_key, _r.width, _r.height) for _r in jpeg_data.renditions] == [
+        ('full', key + '.jpg', 600, 400),
+        ('grid', key + '.grid.jpg', 300, 200),
+        ('thumbnail', key + '.thumbnail.jpg', 150, 100),
+    ]
+    for _r in jpeg_data.renditions:
+        body = S3_CLIENT.get_object(Bucket=CACHE_BUCKET_NAME, Key=_r.s3_object_key)['Body'].read()
+        assert len(body) == _r.size
+        assert Image.open(io.BytesIO(body)).size == (_r.width, _r.height)
+
+
+@pytest.mark.parametrize('object_size, parts', [
+    (1024, 0),
+    (2 * S3_MULTIPART_MIN_PART_SIZE + 1024, 3),
+])
+def test_s3_multipart_writer(object_size, parts, S3_CLIENT, mocker):
+    '''Objects are streamed in parts, or put whole when smaller than one'''
+    S3_CLIENT.create_bucket(Bucket=CACHE_BUCKET_NAME)
+    upload_part = mocker.spy(S3_CLIENT, 'upload_part')
+    body = os.urandom(object_size)
+
+    with S3MultipartWriter(S3_CLIENT, CACHE_BUCKET_NAME, 'object', S3_MULTIPART_MIN_PART_SIZE) as writer:
+        for _o in range(0, object_size, 1000):
+            writer.write(body[_o:_o + 1000])
+
+    assert writer.size == object_size
+    assert upload_part.call_count == parts
+    assert S3_CLIENT.get_object(Bucket=CACHE_BUCKET_NAME, Key='object')['Body'].read() == body
+
+
+def test_s3_multipart_writer_abort(S3_CLIENT):
+    '''A failed write leaves neither an object nor an upload behind'''
+    S3_CLIENT.create_bucket(Bucket=CACHE_BUCKET_NAME)
+
+    with pytest.raises(RuntimeError):
+        with S3MultipartWriter(S3_CLIENT, CACHE_BUCKET_NAME, 'object', S3_MULTIPART_MIN_PART_SIZE) as writer:
+            writer.write(b'0' * (S3_MULTIPART_MIN_PART_SIZE + 1))
+            raise RuntimeError('Encoder failed')
+
+    assert 'Contents' not in S3_CLIENT.list_objects_v2(Bucket=CACHE_BUCKET_NAME)
+    assert 'Uploads' not in S3_CLIENT.list_multipart_uploads(Bucket=CACHE_BUCKET_NAME)
+
+
+@pytest.mark.parametrize('object_size', [1024, S3_MULTIPART_MIN_PART_SIZE + 1024])
+def test_s3_multipart_writer_unclosed(object_size, S3_CLIENT):
+    '''A writer dropped without being closed aborts rather than completing on partial data'''
+    S3_CLIENT.create_bucket(Bucket=CACHE_BUCKET_NAME)
+
+    writer = S3MultipartWriter(S3_CLIENT, CACHE_BUCKET_NAME, 'object', S3_MULTIPART_MIN_PART_SIZE)
+    writer.write(b'0' * object_size)
+    del writer
+
+    assert 'Contents' not in S3_CLIENT.list_objects_v2(Bucket=CACHE_BUCKET_NAME)
+    assert 'Uploads' not in S3_CLIENT.list_multipart_uploads(Bucket=CACHE_BUCKET_NAME)
+
+
+def test_batch_handler(event, mocker):
+    '''Records are converted with the next download prefetched and failures reported'''
+    mocker.patch.object(func, 'OBJECT_MEMORY_THRESHOLD_BYTES', 32 * 1024 * 1024)
+
+    def get_raw_image(e):
+        if e['pk'].endswith('bad.NEF'):
+            raise RuntimeError('Download failed')
+        return io.BytesIO()
+
+    mocker.patch.object(func, '_get_raw_image', side_effect=get_raw_image)
+    get_jpeg_data_item = mocker.patch.object(
+        func,
+        '_get_jpeg_data_item',
+        side_effect=lambda e, raw_image, prefetched_bytes: {'pk': e['pk'], 'sk': 'jpeg#v0'}
+    )
+
+    bad_event = dict(event, pk='photoopsai-bucket#images/bad.NEF')
+    sqs_event = {
+        'Records': [
+            {'messageId': 'message-0', 'body': json.dumps(event)},
+            {'messageId': 'message-1', 'body': json.dumps(bad_event)},
+            {'messageId': 'message-2', 'body': json.dumps(event)},
+        ]
+    }
+
+    events_client = mocker.Mock()
+    events_client.put_events.return_value = {
+        'FailedEntryCount': 1,
+        'Entries': [{'EventId': '0'}, {'ErrorCode': 'InternalFailure'}]
+    }
+    mocker.patch.object(
+        func,
+        'EVENT_PUBLISHER',
+        func.LambdaResultPublisher('event-bus', events_client=events_client)
+    )
+    context = mocker.Mock(
+        aws_request_id='request-0',
+        invoked_function_arn='arn:aws:lambda:us-east-1:123456789012:function:CreateJpegFromRaw'
+    )
+
+    resp = func.batch_handler(sqs_event, context)
+    assert resp == {
+        'batchItemFailures': [{'itemIdentifier': 'message-1'}, {'itemIdentifier': 'message-2'}]
+    }
+    entries = events_client.put_events.call_args.kwargs['Entries']
+    assert [json.loads(_e['Detail'])['responsePayload'] for _e in entries] == \
+        [{'Item': {'pk': event['pk'], 'sk': 'jpeg#v0'}}] * 2
+    assert get_jpeg_data_item.call_count == 2
+    # The download of the next record counts against the budget of the one being converted.
+    assert [_c.args[2] for _c in get_jpeg_data_item.call_args_list] == \
+        [event['file']['object_size'], 0]
+
+
+def test_get_image_size(event):
+    '''The full resolution size comes from the EXIF data'''
+    assert func._get_image_size(event) == (5600, 3728)
+    assert func._get_image_size({'pk': event['pk']}) is None
+
+
+@pytest.mark.parametrize('budget, render_profile, half_size', [
+    (0, 'standard', False),
+    (0, 'preview', True),
+    (1024 ** 4, 'standard', False),
+    (1, 'standard', True),
+])
+def test_plan_memory(budget, render_profile, half_size, mocker):
+    '''Half size decoding is chosen when the render profile's settings are over budget'''
+    mocker.patch.object(func, 'MEMORY_BUDGET_BYTES', budget)
+
+    plan = func._plan_memory(6000, 4000, 25 * 1024 * 1024, render_profile)
+    assert plan.half_size is half_size
+
+
+def test_plan_memory_prefetched(mocker):
+    '''Memory held by a prefetched download can push a conversion to half size'''
+    mocker.patch.object(func, 'BASE_RSS_BYTES', 0)
+    full_size = func._predict_peak_bytes(6000, 4000, 25 * 1024 * 1024, False, True)
+    mocker.patch.object(func, 'MEMORY_BUDGET_BYTES', full_size)
+
+    assert func._plan_memory(6000, 4000, 25 * 1024 * 1024, 'standard').half_size is False
+    plan = func._plan_memory(6000, 4000, 25 * 1024 * 1024, 'standard', True, 1024)
+    assert plan.half_size is True
+
+
+def test_plan_memory_prediction(mocker):
+    '''LibRaw's working image and output dominate the predicted peak'''
+    mocker.patch.object(func, 'BASE_RSS_BYTES', 0)
+    full_size = func._predict_peak_bytes(6000, 4000, 25 * 1024 * 1024, False, True)
+    half_size = func._predict_peak_bytes(6000, 4000, 25 * 1024 * 1024, True, True)
+
+    assert full_size == 25 * 1024 * 1024 + 6000 * 4000 * (2 + 8 + 3)
+    assert half_size == 25 * 1024 * 1024 + 6000 * 4000 * 2 + 6000 * 4000 // 4 * (8 + 3)
+
+
+def test_convert_raw_to_jpeg_memory_budget(mocker):
+    '''A RAW image over the memory budget is decoded at half size and its buffers freed'''
+    mocker.patch.object(func, 'MEMORY_BUDGET_BYTES', 1)
+    raw, _ = _make_raw(mocker, (600, 400), (160, 120))
+    raw_fileobj = io.BytesIO(b'0' * 1024)
+
+    func._convert_raw_to_jpeg(raw_fileobj)
+    assert raw.postprocess.call_args.kwargs['half_size'] is True
+    raw.close.assert_called_once()
+    assert raw_fileobj.closed
+
+    # The fallback is reported so it can be recorded with the JPEG.
+    raw, _ = _make_raw(mocker, (600, 400), (160, 120))
+    assert func._decode_raw(io.BytesIO(b'0' * 1024))[2] is True
+
+
+def _make_photo(width=800, height=600):
+    '''Return an image with gradients and noise that compresses like a photo'''
+    rng = np.random.default_rng(0)
+    x = np.linspace(0, 255, width)
+    y = np.linspace(0, 255, height)[:, None]
+    rgb = np.stack([x + 0 * y, y + 0 * x, (x + y) / 2], axis=2)
+    rgb += rng.normal(0, 12, rgb.shape)
+    return Image.fromarray(np.clip(rgb, 0, 255).astype(np.uint8))
+
+
+def test_encoding_settings(mocker):
+    '''Encoder settings are applied and WebP gets its own extension'''
+    encoding = func.JpegEncoding(format='JPEG', quality=80, optimize=True, progressive=True, subsampling='4:4:4')
+    jpeg = Image.open(func._encode_jpeg(_make_photo(), encoding=encoding))
+    assert jpeg.format == 'JPEG'
+    assert jpeg.info.get('progressive')
+
+    encoding = func.JpegEncoding(format='WEBP', quality=80)
+    assert Image.open(func._encode_jpeg(_make_photo(), encoding=encoding)).format == 'WEBP'
+
+    mocker.patch.object(func, 'ENCODING', encoding)
+    assert func._get_rendition_key('bucket', 'images/test.NEF', 'full') == 'cache/bucket/images/test.NEF.webp'
+
+
+def test_get_ssim():
+    '''SSIM is 1 for the same image and falls with compression'''
+    photo = _make_photo()
+    reference = np.asarray(photo.convert('L'), dtype=np.float64)
+    assert func._get_ssim(reference, reference) == pytest.approx(1.0)
+
+    compressed = io.BytesIO()
+    photo.save(compressed, format='JPEG', quality=10)
+    decoded = np.asarray(Image.open(compressed).convert('L'), dtype=np.float64)
+    assert func._get_ssim(reference, decoded) < 0.9
+
+
+def test_get_encoding_target_bytes(mocker):
+    '''The highest quality within the byte target is chosen'''
+    photo = _make_photo()
+
+    encoding = func._get_encoding(photo, target_bytes=100 * 1024)
+    assert func.ENCODE_MIN_QUALITY < encoding.quality < func.IMAGE_QUALITY
+
+    jpeg = func._encode_jpeg(photo, encoding=encoding)
+    jpeg.seek(0, io.SEEK_END)
+    assert jpeg.tell() <= 100 * 1024
+
+
+def test_get_encoding_target_ssim(mocker):
+    '''The lowest quality meeting the SSIM target is chosen'''
+    encoding = func._get_encoding(_make_photo(), target_ssim=0.9)
+    assert func.ENCODE_MIN_QUALITY <= encoding.quality < func.IMAGE_QUALITY
+
+    assert func._get_encoding(_make_photo(), target_ssim=0.99).quality > encoding.quality
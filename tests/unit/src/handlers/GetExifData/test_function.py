@@ -2,6 +2,7 @@
 # pylint: disable=protected-access
 '''test GetExifData'''
 
+import io
 import json
 import os
 
@@ -13,6 +14,10 @@ import pytest
 
 from dataclasses import asdict
 
+from dataclasses_json.undefined import UndefinedParameterError
+
+from common.models.exif_data import Ifd, decode_ifd
+
 os.environ['CROSS_ACCOUNT_IAM_ROLE_ARN'] = 'arn:aws:iam::123456789012:role/PhotoOpsAI/CrossAccountAccess'
 import src.handlers.GetExifData.function as func
 
@@ -152,6 +157,8 @@ def test_handler(event, image, expected_response, s3_client, s3_bucket_name, s3_
         'src.handlers.GetExifData.function._get_cross_account_s3_client',
         return_value=s3_client
     )
+    # Every test image shares the event's ETag and size.
+    mocker.patch.object(func, 'EXIF_CACHE', func.DdbCache())
     s3_client.create_bucket(Bucket=s3_bucket_name)
 
     # FIXME: How do we handle pictures
@@ -162,3 +169,248 @@ def test_handler(event, image, expected_response, s3_client, s3_bucket_name, s3_
 
     resp = func.handler(event, {})
     assert resp == expected_response
+
+
+def test_handler_exif_cache_hit(event, expected_response, mocker):
+    '''Cached EXIF data is returned without touching S3'''
+    get_client = mocker.patch(
+        'src.handlers.GetExifData.function._get_cross_account_s3_client'
+    )
+    mocker.patch.object(func, 'EXIF_CACHE', func.DdbCache())
+
+    s3_object = event['Records'][0]['s3']['object']
+    cache_key = func._get_exif_cache_key(s3_object['eTag'], s3_object['size'])
+    func.EXIF_CACHE.put(
+        cache_key,
+        {
+            'exif': expected_response['Item']['exif'],
+            'file_type': expected_response['Item']['file']['file_type']
+        }
+    )
+
+    resp = func.handler(event, {})
+    get_client.assert_not_called()
+    assert resp['Item']['exif'] == expected_response['Item']['exif']
+    assert resp['Item']['file']['file_type'] == expected_response['Item']['file']['file_type']
+
+
+@moto.mock_s3
+def test_open_s3_object_range_read(s3_client, mocker):
+    '''Range reads only fetch the blocks that are read'''
+    mocker.patch(
+        'src.handlers.GetExifData.function._get_cross_account_s3_client',
+        return_value=s3_client
+    )
+    s3_bucket_name = 'photoopsai-bucket'
+    s3_client.create_bucket(Bucket=s3_bucket_name)
+    data = os.urandom(1024 * 1024)
+    s3_client.put_object(Bucket=s3_bucket_name, Key='images/range.NEF', Body=data)
+
+    image = func._open_s3_object(s3_bucket_name, 'images/range.NEF', len(data))
+    assert image.read(16) == data[:16]
+    image.seek(900000)
+    assert image.read(12) == data[900000:900012]
+    image.seek(-4, os.SEEK_END)
+    assert image.read() == data[-4:]
+
+    assert image.range_requests == 3
+    assert image.bytes_fetched < len(data)
+
+
+@moto.mock_sts
+def test_get_cross_account_s3_client_cached(aws_credentials, mocker):
+    '''Cross account client is reused until its credentials near expiration'''
+    provider = func.CrossAccountS3ClientProvider(
+        'GetExifData',
+        os.environ['CROSS_ACCOUNT_IAM_ROLE_ARN'],
+        {'other-bucket': 'arn:aws:iam::210987654321:role/PhotoOpsAI/CrossAccountAccess'}
+    )
+    mocker.patch.object(func, 'S3_CLIENT_PROVIDER', provider)
+
+    client = func._get_cross_account_s3_client('photoopsai-bucket')
+    assert func._get_cross_account_s3_client('photoopsai-bucket') is client
+    assert func._get_cross_account_s3_client('other-bucket') is not client
+
+    mocker.patch.object(provider, '_needs_refresh', return_value=True)
+    assert func._get_cross_account_s3_client('photoopsai-bucket') is not client
+
+
+def test_batch_handler_partial_failure(mocker):
+    '''One failed record in an SQS batch is reported without failing the others'''
+    with open(os.path.join(EVENT_DIR, 'GetExifData-event-eb.json')) as f:
+        s3_event = json.load(f)
+    with open(os.path.join(EVENT_DIR, 'GetExifData-output-test_image_nikon.NEF.json')) as f:
+        expected_response = json.load(f)
+
+    mocker.patch(
+        'src.handlers.GetExifData.function._get_cross_account_s3_client',
+        side_effect=Exception('AccessDenied')
+    )
+    mocker.patch.object(func, 'EXIF_CACHE', func.DdbCache())
+
+    cached_record = s3_event['Records'][0]
+    cached_record['s3']['object']['key'] = 'images/test_image_nikon.NEF'
+    func.EXIF_CACHE.put(
+        func._get_exif_cache_key(cached_record['s3']['object']['eTag'], cached_record['s3']['object']['size']),
+        {
+            'exif': expected_response['Item']['exif'],
+            'file_type': expected_response['Item']['file']['file_type']
+        }
+    )
+    failed_record = json.loads(json.dumps(cached_record))
+    failed_record['s3']['object']['eTag'] = 'ffffffffffffffffffffffffffffffff'
+
+    event = {
+        'Records': [
+            {
+                'messageId': 'message-{}'.format(_i),
+                'eventSource': 'aws:sqs',
+                'body': json.dumps({'Records': [_r]})
+            } for _i, _r in enumerate([cached_record, failed_record])
+        ]
+    }
+
+    events_client = mocker.Mock()
+    events_client.put_events.return_value = {'FailedEntryCount': 0, 'Entries': [{'EventId': '0'}]}
+    mocker.patch.object(
+        func,
+        'EVENT_PUBLISHER',
+        func.LambdaResultPublisher('event-bus', events_client=events_client)
+    )
+    context = mocker.Mock(
+        aws_request_id='request-0',
+        invoked_function_arn='arn:aws:lambda:us-east-1:123456789012:function:GetExifData'
+    )
+
+    resp = func.batch_handler(event, context)
+    assert resp == {'batchItemFailures': [{'itemIdentifier': 'message-1'}]}
+
+    entries = events_client.put_events.call_args.kwargs['Entries']
+    assert len(entries) == 1
+    assert entries[0]['EventBusName'] == 'event-bus'
+    assert entries[0]['DetailType'] == 'Lambda Function Invocation Result - Success'
+    detail = json.loads(entries[0]['Detail'])
+    assert detail['requestPayload'] == {'Records': [cached_record]}
+    assert detail['responsePayload'] == expected_response
+
+
+@moto.mock_s3
+def test_handler_claim_check(s3_client, mocker):
+    '''A large item is put in the claim check store and a summary returned'''
+    with open(os.path.join(EVENT_DIR, 'GetExifData-event-eb.json')) as f:
+        event = json.load(f)
+    with open(os.path.join(EVENT_DIR, 'GetExifData-output-test_image_nikon.NEF.json')) as f:
+        expected_response = json.load(f)
+
+    s3_client.create_bucket(Bucket='claim-check-bucket')
+    mocker.patch.object(
+        func,
+        'CLAIM_CHECK_STORE',
+        func.S3ClaimCheckStore('claim-check-bucket', s3_client=s3_client)
+    )
+    mocker.patch.object(func, 'CLAIM_CHECK_THRESHOLD', 1024)
+    mocker.patch.object(func, 'EXIF_CACHE', func.DdbCache())
+
+    s3_object = event['Records'][0]['s3']['object']
+    s3_object['key'] = 'images/test_image_nikon.NEF'
+    func.EXIF_CACHE.put(
+        func._get_exif_cache_key(s3_object['eTag'], s3_object['size']),
+        {
+            'exif': expected_response['Item']['exif'],
+            'file_type': expected_response['Item']['file']['file_type']
+        }
+    )
+
+    resp = func.handler(event, {})
+    item = resp['Item']
+    assert 'exif' not in item
+    assert item['file'] == expected_response['Item']['file']
+    assert item['claim_check']['size'] > func.CLAIM_CHECK_THRESHOLD
+
+    uri = item['claim_check']['uri']
+    assert uri.startswith('s3://claim-check-bucket/claim-check/')
+    body = s3_client.get_object(Bucket='claim-check-bucket', Key=uri.split('/', 3)[-1])['Body'].read()
+    assert json.loads(body) == expected_response['Item']
+
+
+@pytest.mark.parametrize('profile_names', ['full', 'camera'])
+def test_get_exif_data_profile(profile_names, mocker):
+    '''Only tags declared by the EXIF profile reach the model'''
+    tag_values = {
+        'IFD0': {
+            'Make': 'NIKON CORPORATION',
+            'Artist': '',
+            'ExifIFD': {'FNumber': 1.8, 'MakerNote': [78, 105, 107, 111, 110]},
+            'MakerNote': {'SerialNumber': '1234567', 'FocusMode': 'AF-S'},
+        }
+    }
+    mocker.patch.object(func, 'EXIF_PROFILE', func.get_exif_profile(profile_names.split(',')))
+    mocker.patch.object(
+        func,
+        '_open_s3_object',
+        return_value=io.BytesIO(b'\xff\xd8\xff\xe1' + b'\x00' * 256)
+    )
+    header = mocker.patch.object(func.exifread, 'ExifHeader', create=True)
+    header.return_value.dump_tag_values.return_value = tag_values
+
+    exif_data, file_data = func._get_exif_data('photoopsai-bucket', 'images/test.jpg', 260)
+    ifd0 = asdict(exif_data)['ifd0']
+
+    assert file_data.file_type == 'JPEG'
+    assert ifd0['make'] == 'NIKON CORPORATION'
+    assert ifd0['maker_note']['serial_number'] == '1234567'
+    if profile_names == 'full':
+        assert ifd0['artist'] == ''
+        assert ifd0['exif_ifd']['f_number'] == 1.8
+        assert ifd0['exif_ifd']['maker_note'] is None
+    else:
+        assert ifd0['artist'] is None
+        assert ifd0['exif_ifd'] is None
+        assert 'focus_mode' not in ifd0['maker_note']
+
+
+@pytest.mark.parametrize('profile_names, detailed', [
+    ('full', True),
+    ('camera', True),
+    ('location', False),
+    ('location,file', False),
+])
+def test_get_exif_data_profile_maker_note(profile_names, detailed, mocker):
+    '''MakerNotes are only decoded when the profile reads their tags'''
+    mocker.patch.object(func, 'EXIF_PROFILE', func.get_exif_profile(profile_names.split(',')))
+    mocker.patch.object(func, 'EXIF_PARSER_DETAILED_OPTION', True)
+    mocker.patch.object(
+        func,
+        '_open_s3_object',
+        return_value=io.BytesIO(b'\xff\xd8\xff\xe1' + b'\x00' * 256)
+    )
+    header = mocker.patch.object(func.exifread, 'ExifHeader', create=True)
+    header.return_value.dump_tag_values.return_value = {}
+
+    func._get_exif_data('photoopsai-bucket', 'images/test.jpg', 260)
+    assert header.call_args.kwargs.get('detailed', True) is detailed
+
+
+def test_decode_ifd(expected_response):
+    '''Decoded IFDs match dataclasses_json decoding for field and encoded names'''
+    for _ifd in expected_response['Item']['exif'].values():
+        expected = Ifd.from_dict(_ifd)
+        assert decode_ifd(_ifd) == expected
+        assert decode_ifd(expected.to_dict()) == expected
+
+    with pytest.raises(UndefinedParameterError):
+        decode_ifd({'Make': 'NIKON CORPORATION', 'NotATag': 1})
+
+    with pytest.raises(UndefinedParameterError):
+        decode_ifd({'ExifIFD': {'FNumber': 1.8, 'NotATag': 1}})
+
+
+def test_to_dict(expected_response):
+    '''Serialized items match asdict() and round trip without None fields'''
+    item = func.ExifDataItem(**expected_response['Item'])
+    assert func.to_dict(item) == asdict(item)
+
+    compact = func.to_dict(item, skip_none=True)
+    assert None not in compact['exif']['ifd0'].values()
+    assert func.ExifDataItem(**compact) == item
+    assert len(func.to_json(compact)) < len(func.to_json(item))
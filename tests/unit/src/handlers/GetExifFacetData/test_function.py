@@ -0,0 +1,94 @@
+# pylint: disable=redefined-outer-name
+# pylint: disable=protected-access
+'''Test GetExifFacetData'''
+
+import json
+import os
+
+import jsonschema
+import pytest
+import src.handlers.GetExifFacetData.function as func
+
+DATA_DIR = './data'
+EVENT_DIR = os.path.join(DATA_DIR, 'events')
+SCHEMA_DIR = os.path.join(DATA_DIR, 'schemas')
+
+EVENT = os.path.join(EVENT_DIR, 'GetExifFacetData-event-eb.json')
+EVENT_SCHEMA = os.path.join(SCHEMA_DIR, 'ExifDataItem.schema.json')
+RESPONSE = os.path.join(EVENT_DIR, 'GetExifFacetData-output.json')
+RESPONSE_SCHEMA = os.path.join(SCHEMA_DIR, 'GetExifFacetDataResponse.schema.json')
+
+# Fused output must match what the per facet functions return.
+FACET_RESPONSES = {
+    'camera': os.path.join(EVENT_DIR, 'GetExifCameraData-output.json'),
+    'lens': os.path.join(EVENT_DIR, 'GetExifLensData-output.json'),
+    'location': os.path.join(EVENT_DIR, 'GetExifLocationData-output.json'),
+    'image': os.path.join(EVENT_DIR, 'GetExifImageData-output.json'),
+    'file': os.path.join(EVENT_DIR, 'GetFileData-output.json'),
+}
+
+### Events
+@pytest.fixture()
+def event(request):
+    '''Return a test event'''
+    with open(EVENT) as f:
+        return json.load(f)
+
+
+@pytest.fixture()
+def event_schema():
+    '''Return an event schema'''
+    with open(EVENT_SCHEMA) as f:
+        return json.load(f)
+
+
+@pytest.fixture()
+def expected_response(request):
+    '''Return DDB items'''
+    with open(RESPONSE) as f:
+        return json.load(f)
+
+
+@pytest.fixture()
+def response_schema():
+    '''Return a response schema'''
+    with open(RESPONSE_SCHEMA) as f:
+        return json.load(f)
+
+
+# Data validation
+def test_validate_event(event, event_schema):
+    '''Test event data against schema'''
+    jsonschema.validate(event, event_schema)
+
+
+def test_validate_expected_response(expected_response, response_schema):
+    '''Test response against schema.'''
+    jsonschema.validate(expected_response, response_schema)
+
+
+### Tests
+def test_handler(event, expected_response, mocker):
+    '''Call handler'''
+    resp = func.handler(event, {})
+    assert resp == expected_response
+
+
+@pytest.mark.parametrize('facet', list(FACET_RESPONSES))
+def test_handler_matches_facet_function(facet, event, mocker):
+    '''Test a fused facet item equals the per facet function's item'''
+    mocker.patch.object(func, 'EXIF_FACETS', [facet])
+    with open(FACET_RESPONSES[facet]) as f:
+        expected_item = json.load(f)['Item']
+
+    resp = func.handler(event, {})
+    assert resp == {'Items': [expected_item], 'FailedFacets': []}
+
+
+def test_handler_failed_facet(event, mocker):
+    '''Test a failing facet doesn't stop the others'''
+    del event['exif']['ifd0']['gps_ifd']
+
+    resp = func.handler(event, {})
+    assert resp['FailedFacets'] == ['location']
+    assert [_i['sk'] for _i in resp['Items']] == ['camera#v0', 'lens#v0', 'image#v0', 'file#v0']
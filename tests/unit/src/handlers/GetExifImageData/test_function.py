@@ -11,12 +11,24 @@ import src.handlers.GetExifImageData.function as func
 
 from dataclasses import asdict
 
+from common.models import ExifDataItem, LazyExifDataItem
+from common.util.dataclasses import to_dict
+
 DATA_DIR = './data'
 EVENT_DIR = os.path.join(DATA_DIR, 'events')
 SCHEMA_DIR = os.path.join(DATA_DIR, 'schemas')
 IMAGE_DIR = os.path.join(DATA_DIR, 'images')
 MODEL_DIR = os.path.join(DATA_DIR, 'models')
 
+# Image info per sample, as the recursive walk the tag index replaced returned it.
+IMAGE_INFO = {
+    'test_image_lightroom_nikon.dng': (3728, 5600, 'Horizontal (normal)', 'JPEG'),
+    'test_image_lightroom_nikon_embedded_raw.dng': (3728, 5600, 'Horizontal (normal)', 'JPEG'),
+    'test_image_lightroom_nikon.tif': (3712, 5568, None, 'Uncompressed'),
+    'test_image_lightroom_nikon.jpg': (None, None, None, None),
+    'test_image_nikon.NEF': (3728, 5600, 'Horizontal (normal)', 'Nikon NEF Compressed'),
+}
+
 EVENT = os.path.join(EVENT_DIR, 'GetExifImageData-event-eb.json')
 EVENT_SCHEMA = os.path.join(SCHEMA_DIR, 'ExifDataItem.schema.json')
 RESPONSE = os.path.join(EVENT_DIR, 'GetExifImageData-output.json')
@@ -89,3 +101,20 @@ def test_handler(event, expected_response, mocker):
     '''Call handler'''
     resp = func.handler(event, {})
     assert resp == expected_response
+
+
+@pytest.mark.parametrize('image', list(IMAGE_INFO))
+def test_tag_index_image_info(image):
+    '''Test image info from the tag index of eager, lazy and None skipped items'''
+    with open(os.path.join(EVENT_DIR, 'GetExifData-output-{}.json'.format(image))) as f:
+        event = json.load(f)['Item']
+
+    item = ExifDataItem(**json.loads(json.dumps(event)))
+    assert item.exif.tag_index.get_image_info() == IMAGE_INFO[image]
+    assert item.exif.tag_index is item.exif.tag_index
+
+    lazy = LazyExifDataItem(**event)
+    assert lazy.exif.tag_index.get_image_info() == IMAGE_INFO[image]
+
+    lazy = LazyExifDataItem(**to_dict(item, True))
+    assert lazy.exif.tag_index.get_image_info() == IMAGE_INFO[image]
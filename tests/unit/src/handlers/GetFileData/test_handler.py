@@ -89,3 +89,18 @@ def test_handler(event, expected_response, mocker):
     '''Call handler'''
     resp = func.handler(event, {})
     assert resp == expected_response
+
+
+def test_handler_claim_check(event, expected_response, mocker):
+    '''Call handler with a claim checked summary without fetching the body'''
+    get_store = mocker.patch('common.util.claim_check._get_store')
+    summary = {
+        'pk': event['pk'],
+        'sk': event['sk'],
+        'file': event['file'],
+        'claim_check': {'uri': 's3://claim-check-bucket/claim-check/0.json', 'size': 1}
+    }
+
+    resp = func.handler(summary, {})
+    get_store.assert_not_called()
+    assert resp == expected_response
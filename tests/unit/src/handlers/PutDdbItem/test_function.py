@@ -5,6 +5,8 @@
 import json
 import os
 
+from decimal import Decimal
+
 import boto3
 import exifread
 import moto
@@ -12,6 +14,12 @@ import pytest
 
 import src.handlers.PutDdbItem.function as func
 
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+
+from common.exif_codec import decode_exif_item
+from common.util.claim_check import S3ClaimCheckStore, check_in
+from common.util.ddb import get_content_digest, marshal_item, marshal_value
+
 DATA_DIR = './data'
 EVENT_DIR = os.path.join(DATA_DIR, 'events')
 IMAGE_DIR = os.path.join(DATA_DIR, 'images')
@@ -70,19 +78,214 @@ def DDB_TABLE(session):
         yield session.resource('dynamodb').Table('TestTable')
 
 
+@pytest.fixture()
+def DDB_CLIENT(DDB_TABLE, session, mocker):
+    '''Point the function's DDB client at the test table'''
+    # Not the table's client. That one marshals items itself.
+    ddb_client = session.client('dynamodb')
+    mocker.patch.object(func, 'DDB_CLIENT', ddb_client)
+    mocker.patch.object(func, 'DDB_TABLE_NAME', DDB_TABLE.name)
+    return ddb_client
+
+
 ### Tests
-def test_handler(event, DDB_TABLE, mocker):
+def test_handler(event, DDB_TABLE, DDB_CLIENT, mocker):
     '''Call handler'''
 
-    mocker.patch.object(
-        func,
-        'DDB_TABLE',
-        DDB_TABLE
-    )
+    resp = func.handler(event, {})
+    assert resp['ResponseMetadata']['HTTPStatusCode'] == 200
+
+
+def test_handler_items(DDB_TABLE, DDB_CLIENT, mocker):
+    '''Call handler with fused facet items'''
+    with open(os.path.join(EVENT_DIR, 'GetExifFacetData-output.json')) as f:
+        event = json.load(f)
 
     resp = func.handler(event, {})
+    assert resp == {'Count': 5}
+    assert DDB_TABLE.scan()['Count'] == 5
+
+
+@moto.mock_s3
+def test_handler_claim_check(event, DDB_TABLE, DDB_CLIENT, session, mocker):
+    '''Call handler with a claim checked item'''
+    s3_client = session.client('s3')
+    s3_client.create_bucket(Bucket='claim-check-bucket')
+    store = S3ClaimCheckStore('claim-check-bucket', s3_client=s3_client)
+    mocker.patch('common.util.claim_check._get_store', return_value=store)
+
+    item = event['Item']
+    resp = func.handler({'Item': check_in(item, store, threshold=0)}, {})
     assert resp['ResponseMetadata']['HTTPStatusCode'] == 200
 
+    ddb_item = DDB_TABLE.get_item(Key={'pk': item['pk'], 'sk': item['sk']})['Item']
+    assert 'claim_check' not in ddb_item
+    assert ddb_item['exif']['ifd0']['make'] == item['exif']['ifd0']['make']
+
+
+def test_batch_handler(event, DDB_TABLE, DDB_CLIENT, mocker):
+    '''Call batch handler with an SQS batch'''
+    with open(os.path.join(EVENT_DIR, 'GetExifFacetData-output.json')) as f:
+        facet_event = json.load(f)
+
+    sqs_event = {
+        'Records': [
+            {'messageId': 'message-0', 'body': json.dumps(event)},
+            {'messageId': 'message-1', 'body': json.dumps(facet_event)},
+            {'messageId': 'message-2', 'body': 'not json'},
+        ]
+    }
+
+    resp = func.batch_handler(sqs_event, {})
+    assert resp == {'batchItemFailures': [{'itemIdentifier': 'message-2'}]}
+    assert DDB_TABLE.scan()['Count'] == 6
+
+
+def test_batch_handler_unmarshallable(DDB_TABLE, DDB_CLIENT, mocker):
+    '''An item that can't be marshalled fails only its own record'''
+    sqs_event = {
+        'Records': [
+            {
+                'messageId': 'message-{}'.format(_i),
+                'body': '{{"Item": {{"pk": "bucket#{}", "sk": "file#v0", "n": {}}}}}'.format(_i, _n)
+            }
+            for _i, _n in enumerate(['1', 'NaN', '2'])
+        ]
+    }
+
+    resp = func.batch_handler(sqs_event, {})
+    assert resp == {'batchItemFailures': [{'itemIdentifier': 'message-1'}]}
+    assert DDB_TABLE.scan()['Count'] == 2
+
+
+def test_batch_put_ddb_items_chunks(DDB_TABLE, DDB_CLIENT, mocker):
+    '''Items are written 25 at a time with duplicate keys written once'''
+    batch_write_item = mocker.spy(DDB_CLIENT, 'batch_write_item')
+
+    items = [{'pk': 'bucket#{}'.format(_i), 'sk': 'file#v0', 'n': _i} for _i in range(60)]
+    items.append({'pk': 'bucket#0', 'sk': 'file#v0', 'n': 60})
+
+    assert func._batch_put_ddb_items(items) == []
+    assert [len(_c.kwargs['RequestItems']['TestTable']) for _c in batch_write_item.call_args_list] == [25, 25, 10]
+    assert DDB_TABLE.get_item(Key={'pk': 'bucket#0', 'sk': 'file#v0'})['Item']['n'] == 60
+
+
+def test_batch_put_ddb_items_unprocessed(DDB_TABLE, DDB_CLIENT, mocker):
+    '''Unprocessed items are retried and reported once out of attempts'''
+    sleep = mocker.patch.object(func.time, 'sleep')
+
+    items = [{'pk': 'bucket#{}'.format(_i), 'sk': 'file#v0'} for _i in range(3)]
+    unprocessed = {'UnprocessedItems': {'TestTable': [{'PutRequest': {'Item': marshal_item(items[2])}}]}}
+    mocker.patch.object(
+        DDB_CLIENT,
+        'batch_write_item',
+        side_effect=[unprocessed, {'UnprocessedItems': {}}]
+    )
+    assert func._batch_put_ddb_items(items) == []
+    assert sleep.call_count == 1
+
+    mocker.patch.object(DDB_CLIENT, 'batch_write_item', return_value=unprocessed)
+    assert func._batch_put_ddb_items(items) == [items[2]]
+
+
+def test_handler_unchanged(event, DDB_TABLE, DDB_CLIENT, mocker):
+    '''An item is only rewritten when its content changes'''
+    item = event['Item']
+    put_item = mocker.spy(DDB_CLIENT, 'put_item')
+
+    assert func.handler(event, {})['ResponseMetadata']['HTTPStatusCode'] == 200
+    assert func.handler(event, {}) == {'Unchanged': True}
+    # The stored digest is read first so an unchanged item isn't put at all.
+    assert put_item.call_count == 1
+
+    ddb_item = DDB_TABLE.get_item(Key={'pk': item['pk'], 'sk': item['sk']})['Item']
+    assert ddb_item['content_digest'] == get_content_digest(item)
+
+    item['exif']['ifd0']['make'] = 'Changed'
+    assert func.handler(event, {})['ResponseMetadata']['HTTPStatusCode'] == 200
+    ddb_item = DDB_TABLE.get_item(Key={'pk': item['pk'], 'sk': item['sk']})['Item']
+    assert ddb_item['exif']['ifd0']['make'] == 'Changed'
+
+
+def test_handler_unchanged_race(event, DDB_TABLE, DDB_CLIENT, mocker):
+    '''The write is still conditional in case the item is written after its digest is read'''
+    assert func.handler(event, {})['ResponseMetadata']['HTTPStatusCode'] == 200
+
+    mocker.patch.object(func, '_get_ddb_digest', return_value=None)
+    put_item = mocker.spy(DDB_CLIENT, 'put_item')
+    assert func.handler(event, {}) == {'Unchanged': True}
+    assert put_item.call_count == 1
+
+
+def test_batch_put_ddb_items_unchanged(DDB_TABLE, DDB_CLIENT, mocker):
+    '''Items whose stored digest matches are left out of the batch'''
+    items = [{'pk': 'bucket#{}'.format(_i), 'sk': 'file#v0', 'n': _i} for _i in range(3)]
+    assert func._batch_put_ddb_items(items) == []
+
+    batch_write_item = mocker.spy(DDB_CLIENT, 'batch_write_item')
+    items[1]['n'] = 10
+    assert func._batch_put_ddb_items(items) == []
+
+    requests = batch_write_item.call_args.kwargs['RequestItems']['TestTable']
+    assert [_r['PutRequest']['Item']['pk']['S'] for _r in requests] == ['bucket#1']
+    assert DDB_TABLE.get_item(Key={'pk': 'bucket#1', 'sk': 'file#v0'})['Item']['n'] == 10
+
+    mocker.patch.object(func, 'DDB_SKIP_UNCHANGED', False)
+    assert func._batch_put_ddb_items(items) == []
+    assert len(batch_write_item.call_args.kwargs['RequestItems']['TestTable']) == 3
+
+
+def test_handler_exif_storage_codec(event, DDB_TABLE, DDB_CLIENT, mocker):
+    '''EXIF items are written compressed and read back with the codec reader'''
+    mocker.patch.object(func, 'EXIF_STORAGE_CODEC', 'zlib')
+    item = event['Item']
+
+    assert func.handler(event, {})['ResponseMetadata']['HTTPStatusCode'] == 200
+
+    ddb_item = DDB_TABLE.get_item(Key={'pk': item['pk'], 'sk': item['sk']})['Item']
+    assert ddb_item['exif_codec'] == 'zlib'
+    assert ddb_item['exif']['ifd0']['make'] == item['exif']['ifd0']['make']
+    assert 'strip_offsets' not in ddb_item['exif']['ifd0']
+
+    exif_item = decode_exif_item(ddb_item)
+    assert exif_item.exif.ifd0.strip_offsets == item['exif']['ifd0']['strip_offsets']
+    assert exif_item.exif.ifd0.maker_note.serial_number == \
+        item['exif']['ifd0']['maker_note']['serial_number']
+
+    # Switching codec rewrites otherwise unchanged items.
+    mocker.patch.object(func, 'EXIF_STORAGE_CODEC', '')
+    assert func.handler(event, {})['ResponseMetadata']['HTTPStatusCode'] == 200
+
+
+def test_marshal_item(event):
+    '''Test items marshal the same as through a Decimal round trip and TypeSerializer'''
+    item = event['Item']
+    item['empty_list'] = []
+    item['empty_map'] = {}
+    item['none'] = None
+    item['floats'] = [0.1, 1e-05, 1e+16, -2.5, 1.0]
+
+    serializer = TypeSerializer()
+    expected = {
+        _k: serializer.serialize(_v)
+        for _k, _v in json.loads(json.dumps(item), parse_float=Decimal).items()
+    }
+    marshalled = marshal_item(item)
+
+    # Number strings may be written differently but must be the same number.
+    deserializer = TypeDeserializer()
+    assert {_k: deserializer.deserialize(_v) for _k, _v in marshalled.items()} == \
+        {_k: deserializer.deserialize(_v) for _k, _v in expected.items()}
+    assert marshalled['none'] == {'NULL': True}
+    assert marshalled['empty_list'] == {'L': []}
+    assert marshal_value(True) == {'BOOL': True}
+
+
+@pytest.mark.parametrize('value', [float('nan'), float('inf'), Decimal('NaN'), object()])
+def test_marshal_value_unsupported(value):
+    '''Test values DDB can't store are rejected'''
+    with pytest.raises(TypeError):
+        marshal_value(value)
 
 
 @pytest.mark.skip(reason='Need to write')